@@ -1 +1 @@
-python3 ./preprocess/process_epi_data.py auto 2023 3 2024 3 ./website/data.csv
\ No newline at end of file
+python3 ./preprocess/process_epi_data.py run auto 2023 3 2024 3 ./website/data.csv
\ No newline at end of file
@@ -0,0 +1,244 @@
+"""Bootstrap confidence intervals for statistics from a DatasetSnapshot.
+
+Uses the Bayesian bootstrap: each replicate multiplies every observation's
+census weight by an independent exponential draw rather than resampling
+observations. As wages in a snapshot are already sorted, the weighted median of
+every replicate is a cumulative sum and comparison over a (replicates x wages)
+matrix so replicates are computed together in numpy. Many groups may be spread
+over a process pool with each group given its own child seed such that results
+do not depend on the number of workers.
+
+Wages are reweighted per wage observation but unemployment is only available as
+a rate for each aggregated group so its replicates reweight groups. Intervals
+are therefore refused for populations with fewer than MIN_OBSERVATIONS weighted
+observations, which would otherwise give misleadingly narrow (for a single
+group, zero width) intervals.
+
+Requires numpy.
+
+Author: A Samuel Pottinger
+License: MIT License
+"""
+import concurrent.futures
+
+NUM_REPLICATES = 1000
+CONFIDENCE = 0.95
+MIN_OBSERVATIONS = 5
+MAX_CHUNK_ELEMENTS = 4000000
+STATISTICS = ['get_wageotc', 'get_unemp']
+
+_worker_snapshot = None
+
+
+def get_wage_replicates(wages, weights, num_replicates, rng):
+    """Compute bootstrap replicates of a weighted median.
+
+    Args:
+        wages (numpy.ndarray): Wages sorted ascending.
+        weights (numpy.ndarray): The weight of each wage.
+        num_replicates (int): The number of replicates to draw.
+        rng (numpy.random.Generator): Source of randomness.
+
+    Returns:
+        numpy.ndarray: The median wage of each replicate.
+    """
+    import numpy
+
+    if len(wages) == 0:
+        raise RuntimeError('Unable to get median wage.')
+
+    chunk_size = max(1, MAX_CHUNK_ELEMENTS // len(wages))
+    replicates = []
+
+    for start in range(0, num_replicates, chunk_size):
+        size = min(chunk_size, num_replicates - start)
+        draws = rng.standard_exponential((size, len(wages)))
+        cumulative = numpy.cumsum(draws * weights, axis=1)
+        mid_counts = cumulative[:, -1:] / 2
+        positions = (cumulative < mid_counts).sum(axis=1)
+        replicates.append(wages[positions])
+
+    return numpy.concatenate(replicates)
+
+
+def get_unemp_replicates(unemps, counts, num_replicates, rng):
+    """Compute bootstrap replicates of a weighted unemployment rate.
+
+    Args:
+        unemps (numpy.ndarray): The unemployment rate of each record.
+        counts (numpy.ndarray): The unemployment count of each record.
+        num_replicates (int): The number of replicates to draw.
+        rng (numpy.random.Generator): Source of randomness.
+
+    Returns:
+        numpy.ndarray: The unemployment rate of each replicate.
+    """
+    import numpy
+
+    if counts.sum() == 0:
+        raise RuntimeError('Unable to get unemployment.')
+
+    chunk_size = max(1, MAX_CHUNK_ELEMENTS // len(counts))
+    replicates = []
+
+    for start in range(0, num_replicates, chunk_size):
+        size = min(chunk_size, num_replicates - start)
+        draws = rng.standard_exponential((size, len(counts)))
+        replicate_counts = draws * counts
+        totals = replicate_counts.sum(axis=1)
+        replicates.append((replicate_counts * unemps).sum(axis=1) / totals)
+
+    return numpy.concatenate(replicates)
+
+
+def get_interval(snapshot, query, statistic='get_wageotc',
+    num_replicates=NUM_REPLICATES, confidence=CONFIDENCE, seed=None):
+    """Estimate a percentile bootstrap confidence interval for one group.
+
+    Args:
+        snapshot (data_model.DatasetSnapshot): The data to query.
+        query (data_model.Query): The group for which an interval is needed.
+        statistic (str): Either get_wageotc or get_unemp. Defaults to
+            get_wageotc.
+        num_replicates (int): The number of bootstrap replicates. Defaults to
+            NUM_REPLICATES.
+        confidence (float): The confidence level between 0 and 1. Defaults to
+            CONFIDENCE.
+        seed: Seed or numpy.random.SeedSequence for reproducible intervals or
+            None for fresh randomness. Defaults to None.
+
+    Returns:
+        tuple: The lower and upper bounds of the interval. Raises a
+            RuntimeError if the group is empty or has fewer than
+            MIN_OBSERVATIONS wages (for get_wageotc) or groups (for get_unemp)
+            with weight.
+    """
+    import numpy
+
+    rng = numpy.random.default_rng(seed)
+
+    if statistic == 'get_wageotc':
+        values, weights = snapshot.get_wage_sample(query)
+        get_replicates = get_wage_replicates
+    elif statistic == 'get_unemp':
+        values, weights = snapshot.get_unemp_sample(query)
+        get_replicates = get_unemp_replicates
+    else:
+        raise RuntimeError('Unknown statistic: %s' % statistic)
+
+    num_observations = numpy.count_nonzero(weights)
+    if num_observations < MIN_OBSERVATIONS:
+        raise RuntimeError(
+            'Too few observations for an interval: %d' % num_observations
+        )
+
+    replicates = get_replicates(values, weights, num_replicates, rng)
+
+    alpha = 1 - confidence
+    low, high = numpy.quantile(replicates, [alpha / 2, 1 - alpha / 2])
+    return (float(low), float(high))
+
+
+class IntervalExecutor:
+    """Process pool computing confidence intervals for many groups."""
+
+    def __init__(self, snapshot, max_workers=None):
+        """Create a new executor, sending the snapshot to each worker once.
+
+        Args:
+            snapshot (data_model.DatasetSnapshot): The data to query.
+            max_workers (int): The number of processes to use or None to use
+                the concurrent.futures default. Defaults to None.
+        """
+        self._pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_set_worker_snapshot,
+            initargs=(snapshot,)
+        )
+
+    def get_intervals(self, queries, statistic='get_wageotc',
+        num_replicates=NUM_REPLICATES, confidence=CONFIDENCE, seed=None):
+        """Estimate confidence intervals for many groups in parallel.
+
+        Args:
+            queries (iterable): The data_model.Query for each group.
+            statistic (str): Either get_wageotc or get_unemp. Defaults to
+                get_wageotc.
+            num_replicates (int): The number of bootstrap replicates per group.
+                Defaults to NUM_REPLICATES.
+            confidence (float): The confidence level between 0 and 1. Defaults
+                to CONFIDENCE.
+            seed (int): Seed for reproducible intervals or None for fresh
+                randomness. Defaults to None.
+
+        Returns:
+            list: For each query in order, a tuple with the lower and upper
+                bounds or the RuntimeError raised if the group is empty or too
+                small.
+        """
+        import numpy
+
+        if statistic not in STATISTICS:
+            raise RuntimeError('Unknown statistic: %s' % statistic)
+
+        queries = list(queries)
+        seeds = numpy.random.SeedSequence(seed).spawn(len(queries))
+
+        futures = list(map(
+            lambda x: self._pool.submit(
+                _get_worker_interval,
+                x[0],
+                statistic,
+                num_replicates,
+                confidence,
+                x[1]
+            ),
+            zip(queries, seeds)
+        ))
+        return list(map(lambda x: x.result(), futures))
+
+    def shutdown(self):
+        """Stop the worker processes."""
+        self._pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+
+def _set_worker_snapshot(snapshot):
+    """Keep the snapshot for a worker process.
+
+    Args:
+        snapshot (data_model.DatasetSnapshot): The data to query.
+    """
+    global _worker_snapshot
+    _worker_snapshot = snapshot
+
+
+def _get_worker_interval(query, statistic, num_replicates, confidence, seed):
+    """Compute an interval in a worker process, returning any error.
+
+    Args:
+        query (data_model.Query): The group for which an interval is needed.
+        statistic (str): Either get_wageotc or get_unemp.
+        num_replicates (int): The number of bootstrap replicates.
+        confidence (float): The confidence level between 0 and 1.
+        seed (numpy.random.SeedSequence): The seed for this group.
+
+    Returns:
+        tuple or RuntimeError: The interval or the error raised.
+    """
+    try:
+        return get_interval(
+            _worker_snapshot,
+            query,
+            statistic=statistic,
+            num_replicates=num_replicates,
+            confidence=confidence,
+            seed=seed
+        )
+    except RuntimeError as e:
+        return e
@@ -3,9 +3,26 @@
 Author: A Samuel Pottinger
 License: MIT License
 """
+import asyncio
+import bisect
+import collections
+import concurrent.futures
+import copy
 import csv
+import gzip
 import itertools
 import functools
+import json
+import os
+import pickle
+import random
+import time
+
+INDEX_EXTENSION = '.idx'
+SAMPLE_EXTENSION = '.samples'
+MAX_PROFILE_SAMPLES = 10000
+HISTOGRAM_BOUNDS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 1000]
+FEMALE_LABELS = {'Female': True, 'Male': False}
 
 
 class WageTuple:
@@ -39,6 +56,310 @@ class WageTuple:
         return self._weight
 
 
+class LazyWageTuples:
+    """Sequence of WageTuple built from parallel wage and weight lists.
+
+    The WageTuple objects are only created on first access so that loading
+    does not pay to build objects for records which are never queried.
+    """
+
+    def __init__(self, wages, weights):
+        """Create a new sequence without building any WageTuple.
+
+        Args:
+            wages (list of float): The wage amounts.
+            weights (list of float): The weight associated with each wage.
+        """
+        self._wages = wages
+        self._weights = weights
+        self._tuples = None
+
+    def __iter__(self):
+        return iter(self._get_tuples())
+
+    def __len__(self):
+        return len(self._wages)
+
+    def __getitem__(self, index):
+        return self._get_tuples()[index]
+
+    def get_wages_and_weights(self):
+        """Get the wages and weights without building WageTuple objects.
+
+        Returns:
+            tuple: List of wages and list of weights in the same order.
+        """
+        if self._tuples is None:
+            return (self._wages, self._weights)
+
+        wages = list(map(lambda x: x.get_wage(), self._tuples))
+        weights = list(map(lambda x: x.get_weight(), self._tuples))
+        return (wages, weights)
+
+    def _get_tuples(self):
+        """Build the WageTuple list if not already built.
+
+        Returns:
+            list: List of WageTuple.
+        """
+        if self._tuples is None:
+            self._tuples = list(map(WageTuple, self._wages, self._weights))
+            self._wages = None
+            self._weights = None
+
+        return self._tuples
+
+
+class WageRun:
+    """Wages for a group sorted by value.
+
+    Numpy copies of the wages and weights are kept on first use so that runs
+    can be combined without converting Python lists on every query.
+    """
+
+    def __init__(self, wages, weights):
+        """Create a new run, sorting by wage if not already sorted.
+
+        Args:
+            wages (list of float): The wage amounts.
+            weights (list of float): The weight associated with each wage.
+        """
+        pairs = zip(wages, itertools.islice(wages, 1, None))
+        is_sorted = all(map(lambda x: x[0] <= x[1], pairs))
+
+        if not is_sorted:
+            sorted_pairs = sorted(zip(wages, weights), key=lambda x: x[0])
+            wages = list(map(lambda x: x[0], sorted_pairs))
+            weights = list(map(lambda x: x[1], sorted_pairs))
+
+        self._wages = list(wages)
+        self._weights = list(weights)
+        self._arrays = None
+
+    def get_wages(self):
+        """Get the wages in this run.
+
+        Returns:
+            list of float: Wages in ascending order.
+        """
+        return self._wages
+
+    def get_weights(self):
+        """Get the weights in this run.
+
+        Returns:
+            list of float: Weight for each wage in get_wages.
+        """
+        return self._weights
+
+    def get_arrays(self):
+        """Get the wages and weights as numpy arrays.
+
+        Requires numpy.
+
+        Returns:
+            tuple: Array of wages in ascending order and array of their weights.
+        """
+        if self._arrays is None:
+            import numpy
+            self._arrays = (
+                numpy.array(self._wages, dtype=numpy.float64),
+                numpy.array(self._weights, dtype=numpy.float64)
+            )
+
+        return self._arrays
+
+    def get_total_weight(self):
+        """Get the sum of all weights in this run.
+
+        Returns:
+            float: Total weight or zero if the run is empty.
+        """
+        return sum(self._weights)
+
+
+def get_weighted_median(runs):
+    """Find the weighted median wage across multiple sorted runs.
+
+    Finds the smallest wage at which the cumulative weight of all wages at or
+    below it reaches half of the total weight. If numpy is installed, the runs
+    are concatenated and ordered with a stable argsort before the cumulative
+    weight is searched. Otherwise, the wages are sorted together in Python.
+
+    Args:
+        runs (list of WageRun): The runs across which to find the median.
+
+    Returns:
+        float: The weighted median wage.
+    """
+    runs = list(filter(lambda x: len(x.get_wages()) > 0, runs))
+    if len(runs) == 0:
+        raise RuntimeError('Unable to get median wage.')
+
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+
+    if numpy is None:
+        pairs = sorted(
+            itertools.chain(*map(lambda x: zip(x.get_wages(), x.get_weights()), runs)),
+            key=lambda x: x[0]
+        )
+        mid_count = sum(map(lambda x: x[1], pairs)) / 2
+
+        weight_acc = 0
+        for wage, weight in pairs:
+            if weight_acc + weight >= mid_count:
+                return wage
+            weight_acc += weight
+
+        raise RuntimeError('Unable to get median wage.')
+
+    if len(runs) == 1:
+        wages, weights = runs[0].get_arrays()
+    else:
+        arrays = list(map(lambda x: x.get_arrays(), runs))
+        wages = numpy.concatenate(list(map(lambda x: x[0], arrays)))
+        weights = numpy.concatenate(list(map(lambda x: x[1], arrays)))
+        order = numpy.argsort(wages, kind='stable')
+        wages = wages[order]
+        weights = weights[order]
+
+    cumulative = numpy.cumsum(weights)
+    position = numpy.searchsorted(cumulative, cumulative[-1] / 2, side='left')
+    return float(wages[min(position, len(wages) - 1)])
+
+
+class SortedWages:
+    """All wages of a set of records sorted once with the record owning each.
+
+    The weighted median of any subset of records is found by masking the
+    sorted wages to those owned by the subset and searching their cumulative
+    weight, avoiding a sort per query. Arrays are read-only so that a single
+    instance may be shared across threads. Used by both Dataset (for large
+    populations) and DatasetSnapshot. Requires numpy.
+    """
+
+    def __init__(self, records):
+        """Sort the wages of records.
+
+        Args:
+            records (iterable of InputRecord): The records whose wages are
+                included. Records are referred to by their position in this
+                iterable.
+        """
+        import numpy
+
+        def freeze(array):
+            array.flags.writeable = False
+            return array
+
+        records = list(records)
+        runs = list(map(lambda x: x.get_wage_run(), records))
+        lengths = numpy.fromiter(
+            map(lambda x: len(x.get_wages()), runs),
+            dtype=numpy.int64,
+            count=len(runs)
+        )
+        num_wages = int(lengths.sum())
+        wages = numpy.fromiter(
+            itertools.chain(*map(lambda x: x.get_wages(), runs)),
+            dtype=numpy.float64,
+            count=num_wages
+        )
+        weights = numpy.fromiter(
+            itertools.chain(*map(lambda x: x.get_weights(), runs)),
+            dtype=numpy.float64,
+            count=num_wages
+        )
+        owners = numpy.repeat(numpy.arange(len(runs)), lengths)
+
+        order = numpy.argsort(wages, kind='stable')
+        self._wages = freeze(wages[order])
+        self._weights = freeze(weights[order])
+        self._owners = freeze(owners[order])
+        self._positions_by_id = dict(map(
+            lambda x: (x[1].get_index(), x[0]),
+            enumerate(records)
+        ))
+
+    def get_num_records(self):
+        """Get the number of records whose wages are included.
+
+        Returns:
+            int: The record count.
+        """
+        return len(self._positions_by_id)
+
+    def get_wages(self):
+        """Get all wages.
+
+        Returns:
+            numpy.ndarray: Read-only array of wages in ascending order.
+        """
+        return self._wages
+
+    def get_weights(self):
+        """Get the weight of each wage.
+
+        Returns:
+            numpy.ndarray: Read-only array of weights matching get_wages.
+        """
+        return self._weights
+
+    def get_owners(self):
+        """Get the record owning each wage.
+
+        Returns:
+            numpy.ndarray: Read-only array with the position of the record
+                owning each wage in get_wages.
+        """
+        return self._owners
+
+    def get_median(self, record_ids):
+        """Get the weighted median wage of some records.
+
+        Args:
+            record_ids (iterable of int): The IDs of the records to include.
+
+        Returns:
+            float: The smallest wage at which the cumulative weight reaches half
+                of the total.
+        """
+        import numpy
+
+        selected = numpy.zeros(len(self._positions_by_id), dtype=bool)
+        positions = numpy.fromiter(
+            map(lambda x: self._positions_by_id[x], record_ids),
+            dtype=numpy.int64
+        )
+        selected[positions] = True
+        return self.get_masked_median(selected)
+
+    def get_masked_median(self, selected):
+        """Get the weighted median wage of the records selected by a mask.
+
+        Args:
+            selected (numpy.ndarray): Boolean array with an entry for each
+                record by position which is True if the record is included.
+
+        Returns:
+            float: The smallest wage at which the cumulative weight reaches half
+                of the total.
+        """
+        import numpy
+
+        wage_positions = numpy.flatnonzero(selected[self._owners])
+        if len(wage_positions) == 0:
+            raise RuntimeError('Unable to get median wage.')
+
+        cumulative = numpy.cumsum(self._weights[wage_positions])
+        median_position = numpy.searchsorted(cumulative, cumulative[-1] / 2, side='left')
+        median_position = min(median_position, len(wage_positions) - 1)
+        return float(self._wages[wage_positions[median_position]])
+
+
 class InputRecord:
     """A representation of an income dataset record."""
 
@@ -66,10 +387,14 @@ class InputRecord:
         self._index = index
         self._educ = educ
         self._docc03 = docc03
-        self._wageotc = list(wageotc)
+        if isinstance(wageotc, LazyWageTuples):
+            self._wageotc = wageotc
+        else:
+            self._wageotc = list(wageotc)
         self._unemp = unemp
         self._wage_count = wage_count
         self._unemp_count = unemp_count
+        self._wage_run = None
         self._wbhaom = wbhaom
         self._female = female
         self._region = region
@@ -111,6 +436,23 @@ class InputRecord:
         """
         return self._wageotc
 
+    def get_wage_run(self):
+        """Get wage information sorted by wage with cumulative weights.
+
+        Returns:
+            WageRun: The wages for this group, built on first request.
+        """
+        if self._wage_run is None:
+            if isinstance(self._wageotc, LazyWageTuples):
+                wages, weights = self._wageotc.get_wages_and_weights()
+            else:
+                wages = list(map(lambda x: x.get_wage(), self._wageotc))
+                weights = list(map(lambda x: x.get_weight(), self._wageotc))
+
+            self._wage_run = WageRun(wages, weights)
+
+        return self._wage_run
+
     def get_unemp(self):
         """Get unemployment percentage.
 
@@ -188,12 +530,78 @@ class InputRecord:
         return self._citistat
 
 
+class ValueRange:
+    """Inclusive range of values for an ordered dimension like age or educ.
+
+    Ranges are resolved using the order in ORDERINGS so, for example,
+    ValueRange('25-35 yr', '45-55 yr') matches the 25-35 yr, 35-45 yr, and
+    45-55 yr age groups.
+    """
+
+    def __init__(self, start, end):
+        """Create a new range.
+
+        Args:
+            start (str): The first value included in the range.
+            end (str): The last value included in the range.
+        """
+        self._start = start
+        self._end = end
+
+    def get_start(self):
+        """Get the first value in the range.
+
+        Returns:
+            str: The first value included in the range.
+        """
+        return self._start
+
+    def get_end(self):
+        """Get the last value in the range.
+
+        Returns:
+            str: The last value included in the range.
+        """
+        return self._end
+
+    def resolve(self, ordering):
+        """Get the values within this range.
+
+        Args:
+            ordering (list): The values of the dimension in order.
+
+        Returns:
+            list: The values from start to end inclusive. Raises a RuntimeError
+                if either bound is unknown or the start comes after the end.
+        """
+        if self._start not in ordering or self._end not in ordering:
+            message = 'Cannot find the provided range: %s to %s' % (
+                self._start,
+                self._end
+            )
+            raise RuntimeError(message)
+
+        start_index = ordering.index(self._start)
+        end_index = ordering.index(self._end)
+
+        if start_index > end_index:
+            message = 'Range start comes after its end: %s to %s' % (
+                self._start,
+                self._end
+            )
+            raise RuntimeError(message)
+
+        return ordering[start_index:end_index + 1]
+
+
 class Query:
     """Class to represent a query against a dataset.
 
     This class provides a way to filter a dataset by specifying values for
     different dimensions. When a dimension is set to None, no filtering is
-    applied for that dimension.
+    applied for that dimension. Each dimension may be set to a single value,
+    to a collection (set, frozenset, list, or tuple) of values to match any of
+    them, or, for ordered dimensions (educ and age), to a ValueRange.
     """
 
     def __init__(self):
@@ -215,8 +623,8 @@ class Query:
         """Get the education level filter.
 
         Returns:
-            str or None: The education level to filter for, or None if no
-                filtering should be applied.
+            str, collection, ValueRange, or None: The education level to filter
+                for, or None if no filtering should be applied.
         """
         return self._educ
 
@@ -224,8 +632,8 @@ class Query:
         """Set the education level filter.
 
         Args:
-            value (str or None): The education level to filter for, or None to
-                disable filtering by education.
+            value (str, collection, ValueRange, or None): The education level to
+                filter for, or None to disable filtering by education.
         """
         self._educ = value
 
@@ -233,8 +641,8 @@ class Query:
         """Get the occupation filter.
 
         Returns:
-            str or None: The occupation to filter for, or None if no filtering
-                should be applied.
+            str, collection, or None: The occupation to filter for, or None if
+                no filtering should be applied.
         """
         return self._docc03
 
@@ -242,8 +650,8 @@ class Query:
         """Set the occupation filter.
 
         Args:
-            value (str or None): The occupation to filter for, or None to
-                disable filtering by occupation.
+            value (str, collection, or None): The occupation to filter for, or
+                None to disable filtering by occupation.
         """
         self._docc03 = value
 
@@ -251,8 +659,8 @@ class Query:
         """Get the race/ethnicity filter.
 
         Returns:
-            str or None: The race/ethnicity to filter for, or None if no
-                filtering should be applied.
+            str, collection, or None: The race/ethnicity to filter for, or None
+                if no filtering should be applied.
         """
         return self._wbhaom
 
@@ -260,8 +668,8 @@ class Query:
         """Set the race/ethnicity filter.
 
         Args:
-            value (str or None): The race/ethnicity to filter for, or None to
-                disable filtering by race/ethnicity.
+            value (str, collection, or None): The race/ethnicity to filter for,
+                or None to disable filtering by race/ethnicity.
         """
         self._wbhaom = value
 
@@ -269,8 +677,8 @@ class Query:
         """Get the gender filter.
 
         Returns:
-            bool or None: True to filter for Female, False to filter for Male,
-                or None if no filtering should be applied.
+            bool, collection, or None: True to filter for Female, False to
+                filter for Male, or None if no filtering should be applied.
         """
         return self._female
 
@@ -278,8 +686,8 @@ class Query:
         """Set the gender filter.
 
         Args:
-            value (bool or None): True to filter for Female, False to filter for
-                Male, or None to disable filtering by gender.
+            value (bool, collection, or None): True to filter for Female, False
+                to filter for Male, or None to disable filtering by gender.
         """
         self._female = value
 
@@ -287,8 +695,8 @@ class Query:
         """Get the geographic region filter.
 
         Returns:
-            str or None: The region to filter for, or None if no filtering
-                should be applied.
+            str, collection, or None: The region to filter for, or None if no
+                filtering should be applied.
         """
         return self._region
 
@@ -296,8 +704,8 @@ class Query:
         """Set the geographic region filter.
 
         Args:
-            value (str or None): The region to filter for, or None to disable
-                filtering by region.
+            value (str, collection, or None): The region to filter for, or None
+                to disable filtering by region.
         """
         self._region = value
 
@@ -305,8 +713,8 @@ class Query:
         """Get the age group filter.
 
         Returns:
-            str or None: The age group to filter for, or None if no filtering
-                should be applied.
+            str, collection, ValueRange, or None: The age group to filter for,
+                or None if no filtering should be applied.
         """
         return self._age
 
@@ -314,8 +722,8 @@ class Query:
         """Set the age group filter.
 
         Args:
-            value (str or None): The age group to filter for, or None to disable
-                filtering by age group.
+            value (str, collection, ValueRange, or None): The age group to
+                filter for, or None to disable filtering by age group.
         """
         self._age = value
 
@@ -323,8 +731,8 @@ class Query:
         """Get the hours worked filter.
 
         Returns:
-            str or None: The hours worked category to filter for, or None if no
-                filtering should be applied.
+            str, collection, or None: The hours worked category to filter for,
+                or None if no filtering should be applied.
         """
         return self._hoursuint
 
@@ -332,8 +740,8 @@ class Query:
         """Set the hours worked filter.
 
         Args:
-            value (str or None): The hours worked category to filter for, or
-                None to disable filtering by hours worked.
+            value (str, collection, or None): The hours worked category to
+                filter for, or None to disable filtering by hours worked.
         """
         self._hoursuint = value
 
@@ -341,8 +749,8 @@ class Query:
         """Get the citizenship status filter.
 
         Returns:
-            str or None: The citizenship status to filter for, or None if no
-                filtering should be applied.
+            str, collection, or None: The citizenship status to filter for, or
+                None if no filtering should be applied.
         """
         return self._citistat
 
@@ -350,8 +758,8 @@ class Query:
         """Set the citizenship status filter.
 
         Args:
-            value (str or None): The citizenship status to filter for, or None
-                to disable filtering by citizenship status.
+            value (str, collection, or None): The citizenship status to filter
+                for, or None to disable filtering by citizenship status.
         """
         self._citistat = value
 
@@ -388,82 +796,164 @@ class Query:
         self._citistat = None
 
 
+EDUC_ORDER = [
+    'Less than high school',
+    'High school',
+    'Some college',
+    'College',
+    'Advanced'
+]
+AGE_ORDER = [
+    '<25 yr',
+    '25-35 yr',
+    '35-45 yr',
+    '45-55 yr',
+    '55-65 yr',
+    '65+ yr'
+]
+ORDERINGS = {
+    'educ': EDUC_ORDER,
+    'age': AGE_ORDER
+}
+COLLECTION_TYPES = (set, frozenset, list, tuple)
+COALESCE_WINDOW = 0.002
+SORTED_WAGES_MIN_SHARE = 1 / 16
+BATCH_SUMMARIZERS = {
+    'get_wageotc': '_summarize_wageotc',
+    'get_unemp': '_summarize_unemp',
+    'get_size': '_summarize_size'
+}
+
+# Getters for both InputRecord values and Query filters by dimension.
+DIMENSION_GETTERS = {
+    'educ': lambda x: x.get_educ(),
+    'docc03': lambda x: x.get_docc03(),
+    'wbhaom': lambda x: x.get_wbhaom(),
+    'female': lambda x: x.get_female(),
+    'region': lambda x: x.get_region(),
+    'age': lambda x: x.get_age(),
+    'hoursuint': lambda x: x.get_hoursuint(),
+    'citistat': lambda x: x.get_citistat()
+}
+
+
+def get_filter_values(dimension, filter_value, available):
+    """Determine which values of a dimension a filter matches.
+
+    Args:
+        dimension (str): The name of the dimension like educ.
+        filter_value: The value given to the Query setter which may be a
+            single value, collection of values, or ValueRange.
+        available (collection): The values of the dimension present in the
+            dataset.
+
+    Returns:
+        list: The matched values, all of which are present in available.
+    """
+    if isinstance(filter_value, ValueRange):
+        if dimension not in ORDERINGS:
+            message = 'Ranges not supported for: %s' % dimension
+            raise RuntimeError(message)
+
+        in_range = filter_value.resolve(ORDERINGS[dimension])
+        return list(filter(lambda x: x in available, in_range))
+    elif isinstance(filter_value, COLLECTION_TYPES):
+        values = list(filter_value)
+    else:
+        values = [filter_value]
+
+    for value in values:
+        if value not in available:
+            filter_str = str(value)
+            message = 'Cannot find the provided value: %s' % filter_str
+            raise RuntimeError(message)
+
+    return values
+
+
+def get_filter_key(filter_value):
+    """Get a hashable key which is equal for equivalent filter values.
+
+    Args:
+        filter_value: The value given to the Query setter which may be None, a
+            single value, collection of values, or ValueRange.
+
+    Returns:
+        Hashable description of the filter.
+    """
+    if isinstance(filter_value, ValueRange):
+        return ('range', filter_value.get_start(), filter_value.get_end())
+    elif isinstance(filter_value, COLLECTION_TYPES):
+        return ('any', frozenset(filter_value))
+    else:
+        return ('value', filter_value)
+
+
 class Dataset:
     """Class to query a dataset made up of InputRecords."""
 
-    def __init__(self, input_records_iter):
+    def __init__(self, input_records_iter, index_store=None):
         """Create a new dataset.
 
+        Records are consumed from the iterable one at a time so the raw records
+        need not be held in a list. Indexes by dimension are built the first
+        time that dimension is queried.
+
         Args:
-            iterable: Iterable over InputRecord to represent.
+            input_records_iter (iterable): Iterable over InputRecord to
+                represent.
+            index_store (IndexStore): Optional store from which previously
+                built indexes are read and to which new indexes are written.
+                If None, indexes are only kept in memory. Defaults to None.
         """
-        input_records = list(input_records_iter)
         self._records_by_id = dict(map(
             lambda x: (x.get_index(), x),
-            input_records
+            input_records_iter
         ))
-        self._id_by_educ = self._make_index(
-            lambda x: x.get_educ(),
-            input_records
-        )
-        self._id_by_docc03 = self._make_index(
-            lambda x: x.get_docc03(),
-            input_records
-        )
-        self._id_by_wbhaom = self._make_index(
-            lambda x: x.get_wbhaom(),
-            input_records
-        )
-        self._id_by_female = self._make_index(
-            lambda x: x.get_female(),
-            input_records
-        )
-        self._id_by_region = self._make_index(
-            lambda x: x.get_region(),
-            input_records
-        )
-        self._id_by_age = self._make_index(
-            lambda x: x.get_age(),
-            input_records
-        )
-        self._id_by_hoursuint = self._make_index(
-            lambda x: x.get_hoursuint(),
-            input_records
-        )
-        self._id_by_citistat = self._make_index(
-            lambda x: x.get_citistat(),
-            input_records
-        )
+        self._index_store = index_store
+        self._indexes = {}
+        self._coalescer = None
+        self._profiler = None
+        self._sorted_wages = None
 
-    def get_wageotc(self, query):
-        """Get median wage for a group with overtime, tips, and comissions.
+    def set_profiler(self, profiler):
+        """Set the profiler to which query timings are reported.
 
         Args:
-            query (Query): A Query object describing the population for which
-                the median wage should be returned.
+            profiler (Profiler): The profiler to record get_wageotc, get_unemp,
+                and get_size calls or None to disable profiling.
+        """
+        self._profiler = profiler
+
+    def get_profiler(self):
+        """Get the profiler to which query timings are reported.
 
         Returns:
-            float: The estimated median wage for the given population in USD.
+            Profiler: The profiler in use or None if profiling is disabled.
         """
-        subpopulation = self._get_subpopulation(query)
-        wages_nested = map(lambda x: x.get_wageotc(), subpopulation)
-        wages_iter = itertools.chain(*wages_nested)
-        wages = list(wages_iter)
+        return self._profiler
 
-        total_count = sum(map(lambda x: x.get_weight(), wages))
-        mid_count = total_count / 2
+    def snapshot(self):
+        """Create an immutable, thread-safe copy of this dataset for querying.
 
-        wages.sort(key=lambda x: x.get_wage())
-        weight_acc = 0
-        for wage in wages:
-            weight = wage.get_weight()
+        Requires numpy.
 
-            if weight_acc + weight >= mid_count:
-                return wage.get_wage()
+        Returns:
+            DatasetSnapshot: Columnar copy of the records in this dataset.
+        """
+        return DatasetSnapshot(self._records_by_id.values())
 
-            weight_acc += wage.get_weight()
+    def get_wageotc(self, query):
+        """Get median wage for a group with overtime, tips, and comissions.
 
-        raise RuntimeError('Unable to get median wage.')
+        Args:
+            query (Query): A Query object describing the population for which
+                the median wage should be returned.
+
+        Returns:
+            float: The estimated median wage for the given population in USD.
+        """
+        return self._run_query('get_wageotc', query)
 
     def get_unemp(self, query):
         """Get the overall unemployment rate for a group.
@@ -476,17 +966,7 @@ class Dataset:
             float: The estimated unemployment rate for the specified group as
                 a percentage between 0 and 100.
         """
-        subpopulation = self._get_subpopulation(query)
-        unemp_tuples = map(
-            lambda x: (x.get_unemp_count(), x.get_unemp()),
-            subpopulation
-        )
-        weighted_tuples = map(lambda x: (x[0], x[0] * x[1]), unemp_tuples)
-        reduced = functools.reduce(
-            lambda a, b: (a[0] + b[0], a[1] + b[1]),
-            weighted_tuples
-        )
-        return reduced[1] / reduced[0]
+        return self._run_query('get_unemp', query)
 
     def get_size(self, query):
         """Get the size of a population as summed census weight.
@@ -501,9 +981,123 @@ class Dataset:
                 that this uses the wage count though the wage and unemployemnt
                 count are often the same.
         """
-        subpopulation = self._get_subpopulation(query)
-        wage_counts = map(lambda x: x.get_wage_count(), subpopulation)
-        return sum(wage_counts)
+        return self._run_query('get_size', query)
+
+    def get_wage_summary(self, query):
+        """Summarize the wages of a population for merging across datasets.
+
+        Args:
+            query (Query): A Query object describing the population.
+
+        Returns:
+            WageRun: The distinct wages of the population with their summed
+                weights. The get_weighted_median of summaries from datasets
+                with disjoint records is the median of all of those records.
+        """
+        weights_by_wage = {}
+
+        runs = map(lambda x: x.get_wage_run(), self._get_subpopulation(query))
+        for run in runs:
+            for wage, weight in zip(run.get_wages(), run.get_weights()):
+                weights_by_wage[wage] = weights_by_wage.get(wage, 0) + weight
+
+        wages = sorted(weights_by_wage.keys())
+        return WageRun(wages, map(lambda x: weights_by_wage[x], wages))
+
+    def get_unemp_summary(self, query):
+        """Summarize the unemployment of a population for merging.
+
+        Args:
+            query (Query): A Query object describing the population.
+
+        Returns:
+            tuple: The summed unemployment count and summed unemployment count
+                weighted by unemployment rate. The ratio of the second to the
+                first across datasets is the overall unemployment rate.
+        """
+        return self._sum_unemp(self._get_subpopulation(query))
+
+    async def aquery(self, query, method_name='get_wageotc'):
+        """Run a query, batching it with others arriving at about the same time.
+
+        Requests made within COALESCE_WINDOW seconds of each other on the same
+        event loop are run together by run_batch which filters on dimensions
+        shared by all of them only once.
+
+        Args:
+            query (Query): The query to run. This is copied such that it may
+                be changed after calling.
+            method_name (str): The name of the statistic to compute: one of
+                get_wageotc, get_unemp, or get_size. Defaults to get_wageotc.
+
+        Returns:
+            The same value as calling method_name with query.
+        """
+        if self._coalescer is None:
+            self._coalescer = QueryCoalescer(self)
+
+        return await self._coalescer.submit(query, method_name)
+
+    def run_batch(self, requests):
+        """Run many queries together in a single grouped pass.
+
+        Filters which all of the queries have in common are applied once and
+        queries with identical filters share a subpopulation.
+
+        Args:
+            requests (list): List of tuples with the name of the statistic to
+                compute (get_wageotc, get_unemp, or get_size) and the Query.
+
+        Returns:
+            list: The result for each request in order or the RuntimeError
+                raised while computing it.
+        """
+        if len(requests) == 0:
+            return []
+
+        queries = list(map(lambda x: x[1], requests))
+
+        def get_key(query, dimensions):
+            return tuple(map(
+                lambda x: get_filter_key(DIMENSION_GETTERS[x](query)),
+                dimensions
+            ))
+
+        def is_shared(dimension):
+            keys = map(lambda x: get_key(x, [dimension]), queries)
+            return len(set(keys)) == 1
+
+        shared = list(filter(is_shared, DIMENSION_GETTERS.keys()))
+        remaining = list(filter(lambda x: x not in shared, DIMENSION_GETTERS))
+
+        try:
+            prefix_index = self._get_subpopulation_ids(queries[0], shared)
+        except RuntimeError as e:
+            return list(map(lambda x: e, requests))
+
+        subpopulations = {}
+
+        def get_subpopulation_ids(query):
+            key = get_key(query, remaining)
+            if key not in subpopulations:
+                subpopulations[key] = self._get_subpopulation_ids(
+                    query,
+                    remaining,
+                    start_index=prefix_index
+                )
+            return subpopulations[key]
+
+        def run_request(request):
+            method_name, query = request
+            summarizer = getattr(self, BATCH_SUMMARIZERS[method_name])
+
+            try:
+                ids = get_subpopulation_ids(query)
+                return summarizer(map(lambda x: self._records_by_id[x], ids))
+            except RuntimeError as e:
+                return e
+
+        return list(map(run_request, requests))
 
     def get_max_wage(self):
         """Get the maximum wage value across all records in the dataset.
@@ -512,10 +1106,10 @@ class Dataset:
             float: The maximum hourly wage value in USD found in the dataset.
         """
         records = self._records_by_id.values()
-        wages_nest = map(lambda x: x.get_wageotc(), records)
-        wages = itertools.chain(*wages_nest)
-        wages_raw = map(lambda x: x.get_wage(), wages)
-        return max(wages_raw)
+        runs = map(lambda x: x.get_wage_run(), records)
+        runs_wages = map(lambda x: x.get_wages(), runs)
+        has_wages = filter(lambda x: len(x) > 0, runs_wages)
+        return max(map(lambda x: x[-1], has_wages))
 
     def get_max_unemployment(self):
         """Get the maximum unemployment rate across all records in the dataset.
@@ -534,7 +1128,7 @@ class Dataset:
         Returns:
             list: Sorted list of education level labels.
         """
-        return sorted(self._id_by_educ.keys())
+        return sorted(self._get_index('educ').keys())
 
     def get_docc03_vals(self):
         """Get all unique occupation classification values in the dataset.
@@ -542,7 +1136,7 @@ class Dataset:
         Returns:
             list: Sorted list of occupation classification labels.
         """
-        return sorted(self._id_by_docc03.keys())
+        return sorted(self._get_index('docc03').keys())
 
     def get_wbhaom_vals(self):
         """Get all unique race and ethnicity values in the dataset.
@@ -550,7 +1144,7 @@ class Dataset:
         Returns:
             list: Sorted list of race and ethnicity labels.
         """
-        return sorted(self._id_by_wbhaom.keys())
+        return sorted(self._get_index('wbhaom').keys())
 
     def get_female_vals(self):
         """Get all unique gender values in the dataset.
@@ -558,7 +1152,7 @@ class Dataset:
         Returns:
             list: Sorted list of gender values (typically [False, True]).
         """
-        return sorted(self._id_by_female.keys())
+        return sorted(self._get_index('female').keys())
 
     def get_region_vals(self):
         """Get all unique geographic region values in the dataset.
@@ -566,7 +1160,7 @@ class Dataset:
         Returns:
             list: Sorted list of region labels.
         """
-        return sorted(self._id_by_region.keys())
+        return sorted(self._get_index('region').keys())
 
     def get_age_vals(self):
         """Get all unique age group values in the dataset.
@@ -574,7 +1168,7 @@ class Dataset:
         Returns:
             list: Sorted list of age group labels.
         """
-        return sorted(self._id_by_age.keys())
+        return sorted(self._get_index('age').keys())
 
     def get_hoursuint_vals(self):
         """Get all unique hours worked category values in the dataset.
@@ -582,7 +1176,7 @@ class Dataset:
         Returns:
             list: Sorted list of hours worked category labels.
         """
-        return sorted(self._id_by_hoursuint.keys())
+        return sorted(self._get_index('hoursuint').keys())
 
     def get_citistat_vals(self):
         """Get all unique citizenship status values in the dataset.
@@ -590,103 +1184,1017 @@ class Dataset:
         Returns:
             list: Sorted list of citizenship status labels.
         """
-        return sorted(self._id_by_citistat.keys())
-
-    def _get_subpopulation(self, query):
-        """Retrieves part of the dataset based on the given query filters.
+        return sorted(self._get_index('citistat').keys())
 
-        This method filters the dataset according to the dimensions specified in
-        the query object and returns only the subset of records that match all
-        the provided filtering criteria.
+    def _run_query(self, method_name, query):
+        """Filter and summarize a population, profiling if enabled.
 
         Args:
-            query (Query): A Query object containing the filter settings for
-                each dimension (e.g., education, occupation, race/ethnicity,
-                gender, etc.). Each filter can be set to None to imply no
-                filtering on that dimension.
+            method_name (str): The name of the statistic like get_wageotc.
+            query (Query): A Query object describing the population.
+
+        Returns:
+            The value of the statistic for the population.
+        """
+        summarizer = getattr(self, BATCH_SUMMARIZERS[method_name])
+
+        if self._profiler is None:
+            return summarizer(self._get_subpopulation(query))
+
+        profile = QueryProfile(method_name)
+        start = time.perf_counter()
+
+        try:
+            ids = self._get_subpopulation_ids(query, DIMENSION_GETTERS.keys())
+            profile.add_phase('filter', time.perf_counter() - start)
+
+            phase_start = time.perf_counter()
+            records = list(map(lambda x: self._records_by_id[x], ids))
+            profile.set_rows(len(records))
+            if method_name == 'get_wageotc':
+                runs = map(lambda x: x.get_wage_run(), records)
+                profile.set_tuples(sum(map(lambda x: len(x.get_wages()), runs)))
+            profile.add_phase('gather', time.perf_counter() - phase_start)
+
+            phase_start = time.perf_counter()
+            result = summarizer(records)
+            profile.add_phase('aggregate', time.perf_counter() - phase_start)
+            return result
+        finally:
+            profile.set_duration(time.perf_counter() - start)
+            self._profiler.record(profile)
+
+    def _summarize_wageotc(self, subpopulation):
+        """Get the median wage of some records.
+
+        Populations of at least SORTED_WAGES_MIN_SHARE of records are answered
+        from all wages sorted once (see SortedWages) if numpy is installed.
+        Smaller populations combine the wage runs of their records.
+
+        Args:
+            subpopulation (iterable): The InputRecords to summarize.
+
+        Returns:
+            float: The estimated median wage in USD.
+        """
+        subpopulation = list(subpopulation)
+
+        min_records = len(self._records_by_id) * SORTED_WAGES_MIN_SHARE
+        if len(subpopulation) >= min_records:
+            sorted_wages = self._get_sorted_wages()
+            if sorted_wages is not None:
+                ids = map(lambda x: x.get_index(), subpopulation)
+                return sorted_wages.get_median(ids)
+
+        runs = map(lambda x: x.get_wage_run(), subpopulation)
+        return get_weighted_median(runs)
+
+    def _get_sorted_wages(self):
+        """Get all wages sorted once, building them on first request.
+
+        Returns:
+            SortedWages: The sorted wages or None if numpy is not installed.
+        """
+        if self._sorted_wages is None:
+            try:
+                self._sorted_wages = SortedWages(self._records_by_id.values())
+            except ImportError:
+                return None
+
+        return self._sorted_wages
+
+    def _summarize_unemp(self, subpopulation):
+        """Get the unemployment rate of some records.
+
+        Args:
+            subpopulation (iterable): The InputRecords to summarize.
+
+        Returns:
+            float: The estimated unemployment rate as a percentage.
+        """
+        reduced = self._sum_unemp(subpopulation)
+
+        if reduced[0] == 0:
+            raise RuntimeError('Unable to get unemployment.')
+
+        return reduced[1] / reduced[0]
+
+    def _sum_unemp(self, subpopulation):
+        """Sum the unemployment counts of some records.
+
+        Args:
+            subpopulation (iterable): The InputRecords to summarize.
+
+        Returns:
+            tuple: The summed unemployment count and summed count weighted by
+                unemployment rate.
+        """
+        unemp_tuples = map(
+            lambda x: (x.get_unemp_count(), x.get_unemp()),
+            subpopulation
+        )
+        weighted_tuples = map(lambda x: (x[0], x[0] * x[1]), unemp_tuples)
+        return functools.reduce(
+            lambda a, b: (a[0] + b[0], a[1] + b[1]),
+            weighted_tuples,
+            (0, 0)
+        )
+
+    def _summarize_size(self, subpopulation):
+        """Get the size of some records as summed census weight.
+
+        Args:
+            subpopulation (iterable): The InputRecords to summarize.
+
+        Returns:
+            float: Estimated size of this population using the wage count.
+        """
+        wage_counts = map(lambda x: x.get_wage_count(), subpopulation)
+        return sum(wage_counts)
+
+    def _get_subpopulation(self, query):
+        """Retrieves part of the dataset based on the given query filters.
+
+        This method filters the dataset according to the dimensions specified in
+        the query object and returns only the subset of records that match all
+        the provided filtering criteria.
+
+        Args:
+            query (Query): A Query object containing the filter settings for
+                each dimension (e.g., education, occupation, race/ethnicity,
+                gender, etc.). Each filter can be set to None to imply no
+                filtering on that dimension.
 
         Returns:
             map: A map object containing the records that match all the filter
                 criteria, where each record is an instance of InputRecord.
         """
-        def filter_value(accumulator_index, filter_index, filter_value):
-            if filter_value is None:
-                return accumulator_index
+        ret_index = self._get_subpopulation_ids(query, DIMENSION_GETTERS.keys())
+        return map(lambda x: self._records_by_id[x], ret_index)
+
+    def _get_subpopulation_ids(self, query, dimensions, start_index=None):
+        """Find the IDs of records matching a query on some dimensions.
+
+        Args:
+            query (Query): A Query object containing the filter settings.
+            dimensions (iterable): The names of the dimensions whose filters
+                should be applied. Filters on other dimensions are ignored.
+            start_index (set): The record IDs from which to start filtering or
+                None to start from all records. Defaults to None.
+
+        Returns:
+            set: The IDs of records in start_index matching the filters.
+        """
+        def filter_value(accumulator_index, dimension, filter_value):
+            if filter_value is None:
+                return accumulator_index
+
+            filter_index = self._get_index(dimension)
+            values = get_filter_values(dimension, filter_value, filter_index)
+
+            allowed_sets = sorted(
+                map(lambda x: filter_index[x], values),
+                key=len
+            )
+            if len(allowed_sets) == 1:
+                allowed = allowed_sets[0]
+            else:
+                allowed = set().union(*allowed_sets)
+
+            return allowed.intersection(accumulator_index)
+
+        if start_index is None:
+            ret_index = set(self._records_by_id.keys())
+        else:
+            ret_index = start_index
+
+        for dimension in dimensions:
+            ret_index = filter_value(
+                ret_index,
+                dimension,
+                DIMENSION_GETTERS[dimension](query)
+            )
+
+        return ret_index
+
+    def _get_index(self, dimension):
+        """Get the index for a dimension, building it if needed.
+
+        Args:
+            dimension (str): The name of the dimension like educ.
+
+        Returns:
+            dict: A dictionary where each key is a distinct attribute value
+                and each value is a set of record IDs that have that attribute.
+        """
+        if dimension in self._indexes:
+            return self._indexes[dimension]
+
+        index = None
+        if self._index_store:
+            index = self._index_store.get(dimension)
+
+        if index is None:
+            getter = DIMENSION_GETTERS[dimension]
+            index = self._make_index(getter, self._records_by_id.values())
+
+            if self._index_store:
+                self._index_store.put(dimension, index)
+
+        self._indexes[dimension] = index
+        return index
+
+    def _make_index(self, getter, records):
+        """Create an index mapping distinct attribute values to record IDs.
+
+        Args:
+            getter (callable): A function to extract the desired attribute for
+                indexing from a record.
+            records (iterable): A collection of records to index based on the
+                extracted attribute.
+
+        Returns:
+            dict: A dictionary where each key is a distinct attribute value
+                and each value is a set of record IDs that have that attribute.
+        """
+        index = {}
+
+        for record in records:
+            value = getter(record)
+            sub_index = index.get(value, set())
+            sub_index.add(record.get_index())
+            index[value] = sub_index
+
+        return index
+
+
+class QueryProfile:
+    """Timings and sizes observed during a single Dataset query."""
+
+    def __init__(self, method_name):
+        """Create a new profile with no phases recorded.
+
+        Args:
+            method_name (str): The name of the Dataset method like get_wageotc.
+        """
+        self._method_name = method_name
+        self._phases = {}
+        self._rows = 0
+        self._tuples = 0
+        self._duration = 0
+
+    def get_method_name(self):
+        """Get the name of the method profiled.
+
+        Returns:
+            str: The name of the Dataset method like get_wageotc.
+        """
+        return self._method_name
+
+    def add_phase(self, name, duration):
+        """Record the time taken by a phase of the query.
+
+        Args:
+            name (str): The name of the phase: filter, gather, or aggregate.
+            duration (float): The time taken in seconds.
+        """
+        self._phases[name] = duration
+
+    def get_phases(self):
+        """Get the time taken by each phase completed.
+
+        Returns:
+            dict: Mapping from phase name (filter, gather, aggregate) to time
+                taken in seconds. Phases not reached due to an error are
+                omitted.
+        """
+        return self._phases
+
+    def set_rows(self, rows):
+        """Record how many records matched the query.
+
+        Args:
+            rows (int): The number of InputRecords in the population.
+        """
+        self._rows = rows
+
+    def get_rows(self):
+        """Get how many records matched the query.
+
+        Returns:
+            int: The number of InputRecords in the population.
+        """
+        return self._rows
+
+    def set_tuples(self, tuples):
+        """Record how many wage tuples were considered.
+
+        Args:
+            tuples (int): The number of wage tuples across matched records.
+        """
+        self._tuples = tuples
+
+    def get_tuples(self):
+        """Get how many wage tuples were considered.
+
+        Returns:
+            int: The number of wage tuples across matched records or zero for
+                methods which do not use wages.
+        """
+        return self._tuples
+
+    def set_duration(self, duration):
+        """Record the total time taken by the query.
+
+        Args:
+            duration (float): The time taken in seconds.
+        """
+        self._duration = duration
+
+    def get_duration(self):
+        """Get the total time taken by the query.
+
+        Returns:
+            float: The time taken in seconds.
+        """
+        return self._duration
+
+
+class Profiler:
+    """Rolling latency histograms of Dataset queries by method."""
+
+    def __init__(self, callback=None, max_samples=MAX_PROFILE_SAMPLES):
+        """Create a new profiler with no samples.
+
+        Args:
+            callback (callable): Function called with each QueryProfile as it
+                is recorded like to export to another metrics system or None
+                to only keep histograms. Defaults to None.
+            max_samples (int): The maximum number of recent samples to retain
+                per method. Older samples are discarded first.
+        """
+        self._callback = callback
+        self._max_samples = max_samples
+        self._samples = {}
+
+    def record(self, profile):
+        """Record a completed query.
+
+        Args:
+            profile (QueryProfile): The profile of the query.
+        """
+        method_name = profile.get_method_name()
+        if method_name not in self._samples:
+            samples = collections.deque(maxlen=self._max_samples)
+            self._samples[method_name] = samples
+
+        self._samples[method_name].append(profile)
+
+        if self._callback:
+            self._callback(profile)
+
+    def get_profiles(self, method_name):
+        """Get the recent profiles for a method.
+
+        Args:
+            method_name (str): The name of the Dataset method like get_wageotc.
+
+        Returns:
+            list of QueryProfile: Recent profiles from oldest to newest.
+        """
+        return list(self._samples.get(method_name, []))
+
+    def get_histogram(self, method_name):
+        """Get a histogram of recent latencies for a method.
+
+        Args:
+            method_name (str): The name of the Dataset method like get_wageotc.
+
+        Returns:
+            list of tuple: Upper bound in milliseconds and count for each
+                bucket from HISTOGRAM_BOUNDS_MS followed by a final bucket with
+                an upper bound of infinity.
+        """
+        counts = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+
+        for profile in self._samples.get(method_name, []):
+            duration_ms = profile.get_duration() * 1000
+            counts[bisect.bisect_left(HISTOGRAM_BOUNDS_MS, duration_ms)] += 1
+
+        bounds = HISTOGRAM_BOUNDS_MS + [float('inf')]
+        return list(zip(bounds, counts))
+
+    def get_summary(self):
+        """Summarize recent queries by method.
+
+        Returns:
+            dict: Mapping from method name to dictionary with count of recent
+                samples, mean milliseconds for each phase among queries
+                reaching it, and mean rows and tuples.
+        """
+        def summarize(method_name):
+            profiles = self._samples[method_name]
+            count = len(profiles)
+
+            phase_totals = collections.Counter()
+            phase_counts = collections.Counter()
+            for profile in profiles:
+                phase_totals.update(profile.get_phases())
+                phase_counts.update(profile.get_phases().keys())
+
+            return {
+                'count': count,
+                'phasesMs': dict(map(
+                    lambda x: (x[0], x[1] / phase_counts[x[0]] * 1000),
+                    phase_totals.items()
+                )),
+                'rows': sum(map(lambda x: x.get_rows(), profiles)) / count,
+                'tuples': sum(map(lambda x: x.get_tuples(), profiles)) / count
+            }
+
+        return dict(map(lambda x: (x, summarize(x)), self._samples.keys()))
+
+
+class QueryCoalescer:
+    """Collects queries arriving close together to run them as one batch."""
+
+    def __init__(self, dataset, window=COALESCE_WINDOW):
+        """Create a new coalescer with no pending queries.
+
+        Args:
+            dataset (Dataset): The dataset to query.
+            window (float): The number of seconds to wait after the first
+                pending query for others before running the batch. Defaults to
+                COALESCE_WINDOW.
+        """
+        self._dataset = dataset
+        self._window = window
+        self._pending = []
+        self._flush_handle = None
+
+    async def submit(self, query, method_name):
+        """Add a query to the next batch and wait for its result.
+
+        Args:
+            query (Query): The query to run. This is copied such that it may
+                be changed after submitting.
+            method_name (str): The name of the statistic to compute like
+                get_wageotc.
+
+        Returns:
+            The same value as calling method_name on the dataset with query.
+        """
+        if method_name not in BATCH_SUMMARIZERS:
+            raise RuntimeError('Unknown statistic: %s' % method_name)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((method_name, copy.copy(query), future))
+
+        if self._flush_handle is None:
+            self._flush_handle = loop.call_later(self._window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        """Run all pending queries and resolve their futures."""
+        pending = self._pending
+        self._pending = []
+        self._flush_handle = None
+
+        requests = list(map(lambda x: (x[0], x[1]), pending))
+        try:
+            results = self._dataset.run_batch(requests)
+        except Exception as e:
+            for method_name, query, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (method_name, query, future), result in zip(pending, results):
+            if future.done():
+                continue
+            elif isinstance(result, RuntimeError):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+class DatasetSnapshot:
+    """Immutable columnar copy of a Dataset whose queries run in numpy.
+
+    All state is held in read-only numpy arrays built at construction so
+    queries do not mutate anything and may run concurrently from many threads.
+    Filtering, sums, and the weighted median are numpy operations which release
+    the GIL for much of their work. Wages across all records are sorted once at
+    construction so the median requires a cumulative sum rather than a sort.
+    """
+
+    def __init__(self, input_records):
+        """Create a new snapshot.
+
+        Args:
+            input_records (iterable): Iterable over InputRecord to copy.
+        """
+        import numpy
+
+        records = sorted(input_records, key=lambda x: x.get_index())
+
+        def freeze(array):
+            array.flags.writeable = False
+            return array
+
+        self._values_by_dimension = {}
+        self._codes_by_dimension = {}
+        for dimension, getter in DIMENSION_GETTERS.items():
+            labels = list(map(getter, records))
+            values = sorted(set(labels))
+            codes_by_value = dict(map(
+                lambda x: (x[1], x[0]),
+                enumerate(values)
+            ))
+            codes = numpy.fromiter(
+                map(lambda x: codes_by_value[x], labels),
+                dtype=numpy.int32,
+                count=len(labels)
+            )
+            self._values_by_dimension[dimension] = codes_by_value
+            self._codes_by_dimension[dimension] = freeze(codes)
+
+        def get_floats(getter):
+            return freeze(numpy.fromiter(
+                map(getter, records),
+                dtype=numpy.float64,
+                count=len(records)
+            ))
+
+        self._unemp = get_floats(lambda x: x.get_unemp())
+        self._wage_count = get_floats(lambda x: x.get_wage_count())
+        self._unemp_count = get_floats(lambda x: x.get_unemp_count())
+        self._num_records = len(records)
+
+        self._sorted_wages = SortedWages(records)
+        self._wages = self._sorted_wages.get_wages()
+        self._weights = self._sorted_wages.get_weights()
+        self._owners = self._sorted_wages.get_owners()
+
+    def get_wageotc(self, query):
+        """Get median wage for a group with overtime, tips, and comissions.
+
+        Args:
+            query (Query): A Query object describing the population for which
+                the median wage should be returned.
+
+        Returns:
+            float: The estimated median wage for the given population in USD.
+        """
+        return self._sorted_wages.get_masked_median(self._get_mask(query))
+
+    def get_unemp(self, query):
+        """Get the overall unemployment rate for a group.
+
+        Args:
+            query (Query): A Query object describing the population for which
+                the unemployemnt rate should be returned.
+
+        Returns:
+            float: The estimated unemployment rate for the specified group as
+                a percentage between 0 and 100.
+        """
+        mask = self._get_mask(query)
+        counts = self._unemp_count[mask]
+        total = counts.sum()
+        if total == 0:
+            raise RuntimeError('Unable to get unemployment.')
+
+        return float((counts * self._unemp[mask]).sum() / total)
+
+    def get_size(self, query):
+        """Get the size of a population as summed census weight.
+
+        Args:
+            query (Query): A Query object describing the population for which
+                the size should be returned.
+
+        Returns:
+            float: Estimated size of this population as a weight using the
+                wage count.
+        """
+        mask = self._get_mask(query)
+        return float(self._wage_count[mask].sum())
+
+    def get_wage_sample(self, query):
+        """Get the wages and weights of a population.
+
+        Args:
+            query (Query): A Query object describing the population.
+
+        Returns:
+            tuple: Read-only numpy arrays of wages sorted ascending and their
+                weights.
+        """
+        import numpy
+
+        mask = self._get_mask(query)
+        positions = numpy.flatnonzero(mask[self._owners])
+        return (self._wages[positions], self._weights[positions])
+
+    def get_unemp_sample(self, query):
+        """Get the unemployment rates and counts of records in a population.
+
+        Args:
+            query (Query): A Query object describing the population.
+
+        Returns:
+            tuple: Numpy arrays of unemployment rate (0 - 100) and unemployment
+                count for each matching record.
+        """
+        mask = self._get_mask(query)
+        return (self._unemp[mask], self._unemp_count[mask])
+
+    def get_max_wage(self):
+        """Get the maximum wage value across all records in the dataset.
+
+        Returns:
+            float: The maximum hourly wage value in USD found in the dataset.
+        """
+        return float(self._wages[-1])
+
+    def get_max_unemployment(self):
+        """Get the maximum unemployment rate across all records in the dataset.
+
+        Returns:
+            float: The maximum unemployment rate as a percentage (0-100)
+                found in the dataset.
+        """
+        return float(self._unemp.max())
+
+    def get_educ_vals(self):
+        """Get all unique education level values in the dataset.
+
+        Returns:
+            list: Sorted list of education level labels.
+        """
+        return sorted(self._values_by_dimension['educ'].keys())
+
+    def get_docc03_vals(self):
+        """Get all unique occupation classification values in the dataset.
+
+        Returns:
+            list: Sorted list of occupation classification labels.
+        """
+        return sorted(self._values_by_dimension['docc03'].keys())
+
+    def get_wbhaom_vals(self):
+        """Get all unique race and ethnicity values in the dataset.
+
+        Returns:
+            list: Sorted list of race and ethnicity labels.
+        """
+        return sorted(self._values_by_dimension['wbhaom'].keys())
+
+    def get_female_vals(self):
+        """Get all unique gender values in the dataset.
+
+        Returns:
+            list: Sorted list of gender values (typically [False, True]).
+        """
+        return sorted(self._values_by_dimension['female'].keys())
+
+    def get_region_vals(self):
+        """Get all unique geographic region values in the dataset.
+
+        Returns:
+            list: Sorted list of region labels.
+        """
+        return sorted(self._values_by_dimension['region'].keys())
+
+    def get_age_vals(self):
+        """Get all unique age group values in the dataset.
+
+        Returns:
+            list: Sorted list of age group labels.
+        """
+        return sorted(self._values_by_dimension['age'].keys())
+
+    def get_hoursuint_vals(self):
+        """Get all unique hours worked category values in the dataset.
+
+        Returns:
+            list: Sorted list of hours worked category labels.
+        """
+        return sorted(self._values_by_dimension['hoursuint'].keys())
+
+    def get_citistat_vals(self):
+        """Get all unique citizenship status values in the dataset.
+
+        Returns:
+            list: Sorted list of citizenship status labels.
+        """
+        return sorted(self._values_by_dimension['citistat'].keys())
+
+    def _get_mask(self, query):
+        """Find the records matching a query.
+
+        Args:
+            query (Query): A Query object containing the filter settings for
+                each dimension.
+
+        Returns:
+            numpy.ndarray: Boolean array which is True for matching records.
+        """
+        import numpy
+
+        mask = numpy.ones(self._num_records, dtype=bool)
+
+        for dimension, getter in DIMENSION_GETTERS.items():
+            filter_value = getter(query)
+            if filter_value is None:
+                continue
+
+            codes_by_value = self._values_by_dimension[dimension]
+            values = get_filter_values(dimension, filter_value, codes_by_value)
+            codes = list(map(lambda x: codes_by_value[x], values))
+
+            dimension_codes = self._codes_by_dimension[dimension]
+            if len(codes) == 1:
+                mask &= dimension_codes == codes[0]
+            else:
+                mask &= numpy.isin(dimension_codes, codes)
+
+        return mask
+
+
+class TimeSeriesDataset(DatasetSnapshot):
+    """Snapshot holding many periods which answers queries for each period.
+
+    Records from all periods share the dictionary encoded columns of
+    DatasetSnapshot with an additional column giving the period of each record.
+    Query methods inherited from DatasetSnapshot pool all periods while the
+    series methods return a value per period from a single vectorized pass.
+    """
+
+    def __init__(self, input_records, periods_by_index):
+        """Create a new time series.
+
+        Args:
+            input_records (iterable): Iterable over InputRecord to copy.
+            periods_by_index (dict): Mapping from record index to the period
+                of that record like 2023-03.
+        """
+        import numpy
 
-            if filter_value not in filter_index:
-                filter_str = str(filter_value)
-                message = 'Cannot find the provided value: %s' % filter_str
-                raise RuntimeError(message)
+        records = list(input_records)
+        super().__init__(records)
 
-            allowed = filter_index[filter_value]
-            return allowed.intersection(accumulator_index)
+        indices = sorted(map(lambda x: x.get_index(), records))
+        record_periods = list(map(lambda x: periods_by_index[x], indices))
 
-        ret_index = set(self._records_by_id.keys())
-        ret_index = filter_value(
-            ret_index,
-            self._id_by_educ,
-            query.get_educ()
-        )
-        ret_index = filter_value(
-            ret_index,
-            self._id_by_docc03,
-            query.get_docc03()
-        )
-        ret_index = filter_value(
-            ret_index,
-            self._id_by_wbhaom,
-            query.get_wbhaom()
-        )
-        ret_index = filter_value(
-            ret_index,
-            self._id_by_female,
-            query.get_female()
-        )
-        ret_index = filter_value(
-            ret_index,
-            self._id_by_region,
-            query.get_region()
+        self._periods = sorted(set(record_periods))
+        codes_by_period = dict(map(
+            lambda x: (x[1], x[0]),
+            enumerate(self._periods)
+        ))
+        period_codes = numpy.fromiter(
+            map(lambda x: codes_by_period[x], record_periods),
+            dtype=numpy.int32,
+            count=len(record_periods)
         )
-        ret_index = filter_value(
-            ret_index,
-            self._id_by_age,
-            query.get_age()
+        period_codes.flags.writeable = False
+        self._period_codes = period_codes
+
+    def get_periods(self):
+        """Get all periods in the dataset.
+
+        Returns:
+            list: Sorted list of period labels like 2023-03.
+        """
+        return list(self._periods)
+
+    def get_wageotc_series(self, query):
+        """Get the median wage of a group in each period.
+
+        Args:
+            query (Query): A Query object describing the population.
+
+        Returns:
+            dict: Mapping from period to median wage in USD for each period in
+                which the population has wages.
+        """
+        import numpy
+
+        mask = self._get_mask(query)
+        positions = numpy.flatnonzero(mask[self._owners])
+        wage_periods = self._period_codes[self._owners[positions]]
+
+        by_period = numpy.argsort(wage_periods, kind='stable')
+        positions = positions[by_period]
+        wage_periods = wage_periods[by_period]
+
+        num_periods = len(self._periods)
+        counts = numpy.bincount(wage_periods, minlength=num_periods)
+        ends = numpy.cumsum(counts)
+        starts = ends - counts
+
+        # Period totals come from the same cumulative sum as the running
+        # weights so a period's last wage is never below its own midpoint.
+        cumulative = numpy.concatenate([[0], numpy.cumsum(self._weights[positions])])
+        prior_totals = cumulative[starts]
+        totals = cumulative[ends] - prior_totals
+        within_period = cumulative[1:] - prior_totals[wage_periods]
+        below_mid = within_period < totals[wage_periods] / 2
+        num_below = numpy.bincount(
+            wage_periods,
+            weights=below_mid,
+            minlength=num_periods
+        ).astype(numpy.int64)
+
+        has_wages = numpy.flatnonzero(counts > 0)
+        median_offsets = numpy.minimum(num_below, counts - 1)[has_wages]
+        median_positions = positions[starts[has_wages] + median_offsets]
+        medians = self._wages[median_positions]
+        return dict(zip(
+            map(lambda x: self._periods[x], has_wages),
+            medians.tolist()
+        ))
+
+    def get_unemp_series(self, query):
+        """Get the unemployment rate of a group in each period.
+
+        Args:
+            query (Query): A Query object describing the population.
+
+        Returns:
+            dict: Mapping from period to unemployment rate (0 - 100) for each
+                period in which the population has unemployment counts.
+        """
+        import numpy
+
+        mask = self._get_mask(query)
+        counts = self._unemp_count[mask]
+        periods = self._period_codes[mask]
+        num_periods = len(self._periods)
+
+        totals = numpy.bincount(periods, weights=counts, minlength=num_periods)
+        weighted = numpy.bincount(
+            periods,
+            weights=counts * self._unemp[mask],
+            minlength=num_periods
         )
-        ret_index = filter_value(
-            ret_index,
-            self._id_by_hoursuint,
-            query.get_hoursuint()
+
+        has_counts = numpy.flatnonzero(totals > 0)
+        rates = weighted[has_counts] / totals[has_counts]
+        return dict(zip(
+            map(lambda x: self._periods[x], has_counts),
+            rates.tolist()
+        ))
+
+    def get_size_series(self, query):
+        """Get the size of a population as summed census weight in each period.
+
+        Args:
+            query (Query): A Query object describing the population.
+
+        Returns:
+            dict: Mapping from period to size using the wage count for every
+                period in the dataset.
+        """
+        import numpy
+
+        mask = self._get_mask(query)
+        sizes = numpy.bincount(
+            self._period_codes[mask],
+            weights=self._wage_count[mask],
+            minlength=len(self._periods)
         )
-        ret_index = filter_value(
-            ret_index,
-            self._id_by_citistat,
-            query.get_citistat()
+        return dict(zip(self._periods, map(float, sizes)))
+
+
+class QueryExecutor:
+    """Thread pool running many queries against a DatasetSnapshot."""
+
+    def __init__(self, snapshot, max_workers=None):
+        """Create a new executor.
+
+        Args:
+            snapshot (DatasetSnapshot): The snapshot to query.
+            max_workers (int): The number of threads to use or None to use the
+                concurrent.futures default. Defaults to None.
+        """
+        self._snapshot = snapshot
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers
         )
 
-        return map(lambda x: self._records_by_id[x], ret_index)
+    def submit(self, method_name, query):
+        """Start a single query.
 
-    def _make_index(self, getter, records):
-        """Create an index mapping distinct attribute values to record IDs.
+        Args:
+            method_name (str): The snapshot method to call like get_wageotc.
+            query (Query): The query to run. This is copied such that it may
+                be changed after submitting.
+
+        Returns:
+            concurrent.futures.Future: Future resolving to the query result.
+        """
+        method = getattr(self._snapshot, method_name)
+        return self._pool.submit(method, copy.copy(query))
+
+    def map_queries(self, method_name, queries):
+        """Run many queries concurrently.
 
         Args:
-            getter (callable): A function to extract the desired attribute for
-                indexing from a record.
-            records (iterable): A collection of records to index based on the
-                extracted attribute.
+            method_name (str): The snapshot method to call like get_wageotc.
+            queries (iterable): The queries to run.
 
         Returns:
-            dict: A dictionary where each key is a distinct attribute value
-                and each value is a set of record IDs that have that attribute.
+            list: Results in the same order as queries.
         """
-        index = {}
+        futures = list(map(lambda x: self.submit(method_name, x), queries))
+        return list(map(lambda x: x.result(), futures))
 
-        for record in records:
-            value = getter(record)
-            sub_index = index.get(value, set())
-            sub_index.add(record.get_index())
-            index[value] = sub_index
+    def shutdown(self):
+        """Stop the thread pool after running queries already submitted."""
+        self._pool.shutdown(wait=True)
 
-        return index
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+
+class IndexStore:
+    """Directory in which Dataset indexes are persisted between loads.
+
+    Each dimension is kept in its own file along with a fingerprint of the data
+    it indexes such that indexes are ignored if the data file has changed since
+    they were written. Files are replaced atomically and any which cannot be
+    read (like after a crash part way through an older write) are rebuilt.
+    """
+
+    def __init__(self, loc, fingerprint):
+        """Create a new store.
+
+        Args:
+            loc (str): The directory in which to persist indexes. Created on
+                first write. A file at this location from an older version is
+                replaced.
+            fingerprint: Value describing the indexed data (like the data file
+                size and modification time) which changes if the data change.
+        """
+        self._loc = loc
+        self._fingerprint = fingerprint
+
+    def get(self, dimension):
+        """Get a persisted index.
+
+        Args:
+            dimension (str): The name of the dimension like educ.
+
+        Returns:
+            dict or None: The index for the dimension or None if not persisted,
+                persisted for other data, or unreadable.
+        """
+        path = self._get_path(dimension)
+        if not os.path.isfile(path):
+            return None
+
+        try:
+            with open(path, 'rb') as f:
+                persisted = pickle.load(f)
+
+            if persisted['fingerprint'] != self._fingerprint:
+                return None
+
+            return persisted['index']
+        except (EOFError, pickle.UnpicklingError, KeyError, TypeError, ValueError,
+                AttributeError, IndexError):
+            return None
+
+    def put(self, dimension, index):
+        """Persist an index, replacing the prior file only once fully written.
+
+        Args:
+            dimension (str): The name of the dimension like educ.
+            index (dict): The index to persist.
+        """
+        if os.path.isfile(self._loc):
+            os.remove(self._loc)
+
+        if not os.path.exists(self._loc):
+            os.makedirs(self._loc)
+
+        path = self._get_path(dimension)
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+
+        with open(temp_path, 'wb') as f:
+            pickle.dump({'fingerprint': self._fingerprint, 'index': index}, f)
+
+        os.replace(temp_path, path)
+
+    def _get_path(self, dimension):
+        return os.path.join(self._loc, dimension + '.pickle')
 
 
 def parse_wage_otc(wage_otc_string):
@@ -696,6 +2204,130 @@ def parse_wage_otc(wage_otc_string):
     return map(lambda x: WageTuple(x[0], x[1]), tuple_parsed)
 
 
+def parse_wage_otc_bulk(wage_otc_strings):
+    """Decode many wageotc strings in a single vectorized pass.
+
+    Args:
+        wage_otc_strings (list of str): The wageotc field for each record.
+
+    Returns:
+        tuple: Flat numpy arrays of wages and weights along with a list of
+            offsets such that the tuples for record i are found between
+            offsets[i] and offsets[i + 1].
+    """
+    import numpy
+
+    joined = ';'.join(wage_otc_strings).replace(';', ' ')
+    numbers = numpy.fromstring(joined, sep=' ')
+    wages = numbers[0::2]
+    weights = numbers[1::2]
+
+    counts = map(lambda x: x.count(';') + 1, wage_otc_strings)
+    offsets = [0] + list(itertools.accumulate(counts))
+
+    if offsets[-1] != len(wages) or len(wages) != len(weights):
+        raise RuntimeError('Unable to parse wageotc.')
+
+    return (wages, weights, offsets)
+
+
+def parse_female(value):
+    """Interpret a female value given as a label or as a boolean.
+
+    Args:
+        value: Either the label written to the CSV file (Female or Male) or a
+            boolean like from a data frame column of type bool.
+
+    Returns:
+        bool: True if female and False if male. Other labels like a rollup
+            label (All genders) raise a RuntimeError rather than being read as
+            male.
+    """
+    if isinstance(value, str):
+        if value not in FEMALE_LABELS:
+            raise RuntimeError('Unexpected female value: %s' % value)
+        return FEMALE_LABELS[value]
+    elif isinstance(value, bool):
+        return bool(value)
+    else:
+        raise RuntimeError('Unexpected female value: %s' % value)
+
+
+def parse_frame(frame):
+    """Parse records from a data frame read from the CSV file.
+
+    Args:
+        frame (pandas.DataFrame): Data frame with the columns of the CSV file
+            with label columns read as strings.
+
+    Returns:
+        Iterable over InputRecord.
+    """
+    wages, weights, offsets = parse_wage_otc_bulk(frame['wageotc'].tolist())
+    wages_list = wages.tolist()
+    weights_list = weights.tolist()
+
+    def get_wageotc(position):
+        start = offsets[position]
+        end = offsets[position + 1]
+        return LazyWageTuples(wages_list[start:end], weights_list[start:end])
+
+    female = map(parse_female, frame['female'].tolist())
+
+    return map(
+        InputRecord,
+        frame['index'].tolist(),
+        frame['educ'].tolist(),
+        frame['docc03'].tolist(),
+        map(get_wageotc, range(len(frame.index))),
+        frame['unemp'].tolist(),
+        frame['wageCount'].tolist(),
+        frame['unempCount'].tolist(),
+        frame['wbhaom'].tolist(),
+        female,
+        frame['region'].tolist(),
+        frame['age'].tolist(),
+        frame['hoursuint'].tolist(),
+        frame['citistat'].tolist()
+    )
+
+
+def read_frame(loc):
+    """Read the CSV file using the pandas C tokenizer.
+
+    Args:
+        loc (str): The location of the CSV file.
+
+    Returns:
+        pandas.DataFrame: Data frame with labels and wageotc as strings and
+            other columns as numbers.
+    """
+    import pandas
+
+    return pandas.read_csv(
+        loc,
+        dtype={
+            'index': 'int64',
+            'educ': str,
+            'docc03': str,
+            'wageotc': str,
+            'unemp': 'float64',
+            'wageCount': 'float64',
+            'unempCount': 'float64',
+            'wbhaom': str,
+            'female': str,
+            'region': str,
+            'age': str,
+            'hoursuint': str,
+            'citistat': str,
+            'period': str
+        },
+        keep_default_na=False,
+        float_precision='round_trip',
+        engine='c'
+    )
+
+
 def parse_record(record_raw):
     index = int(record_raw['index'])
     educ = str(record_raw['educ'])
@@ -705,7 +2337,7 @@ def parse_record(record_raw):
     wage_count = float(record_raw['wageCount'])
     unemp_count = float(record_raw['unempCount'])
     wbhaom = str(record_raw['wbhaom'])
-    female = str(record_raw['female']) == 'Female'
+    female = parse_female(str(record_raw['female']))
     region = str(record_raw['region'])
     age = str(record_raw['age'])
     hoursuint = str(record_raw['hoursuint'])
@@ -728,14 +2360,22 @@ def parse_record(record_raw):
     )
 
 
-def load_from_file(loc, sketch=None):
+def load_from_file(loc, sketch=None, persist_index=False):
     """Load a dataset from a CSV file.
 
+    If pandas and numpy are installed and no sketch is given, the file is
+    tokenized in bulk and wages are decoded in a single vectorized pass.
+    Otherwise, the file is parsed with the csv module.
+
     Args:
         loc (str): The location of the CSV file from which to parse
             InputRecords.
         sketch (sketchingpy.Sketch2D): The sketch to use to load the file or,
             if None, uses a regular file. Defaults to None.
+        persist_index (bool): If True, indexes are saved next to the data file
+            (in the loc + .idx directory with one file per dimension) as they
+            are built and reused by later loads of an unchanged file. Ignored
+            if a sketch is given. Defaults to False.
 
     Returns:
         Dataset parsed from the given location.
@@ -743,10 +2383,393 @@ def load_from_file(loc, sketch=None):
     if sketch:
         data_layer = sketch.get_data_layer()
         records = data_layer.get_csv(loc)
+        return Dataset(map(parse_record, records))
+
+    if persist_index:
+        stat = os.stat(loc)
+        fingerprint = (stat.st_size, stat.st_mtime_ns)
+        index_store = IndexStore(loc + INDEX_EXTENSION, fingerprint)
     else:
+        index_store = None
+
+    return Dataset(read_records(loc), index_store=index_store)
+
+
+def read_records(loc):
+    """Read records from a CSV file.
+
+    If pandas and numpy are installed, the file is tokenized in bulk and wages
+    are decoded in a single vectorized pass. Otherwise, the file is parsed with
+    the csv module.
+
+    Args:
+        loc (str): The location of the CSV file from which to parse
+            InputRecords.
+
+    Returns:
+        Iterable over InputRecord yielding records as they are parsed.
+    """
+    try:
+        frame = read_frame(loc)
+    except ImportError:
+        frame = None
+
+    if frame is not None:
+        yield from parse_frame(frame)
+        return
+
+    with open(loc) as f:
+        yield from map(parse_record, csv.DictReader(f))
+
+
+def check_sample_fraction(fraction):
+    """Ensure a sample fraction is usable.
+
+    Args:
+        fraction (float): The share of wage tuples to keep.
+    """
+    if fraction <= 0 or fraction > 1:
+        raise RuntimeError('Sample fraction must be between 0 and 1: %s' % fraction)
+
+
+def sample_wages(wages, weights, fraction, rng):
+    """Keep a random share of wages scaled to the same total weight.
+
+    Args:
+        wages (list of float): The wage amounts sorted ascending.
+        weights (list of float): The weight associated with each wage.
+        fraction (float): The share of wages to keep between 0 and 1.
+        rng (random.Random): Source of randomness.
+
+    Returns:
+        tuple: Lists of kept wages (still sorted) and their scaled weights.
+    """
+    num_kept = max(1, round(len(wages) * fraction))
+    positions = sorted(rng.sample(range(len(wages)), min(num_kept, len(wages))))
+    kept_weight = sum(map(lambda x: weights[x], positions))
+
+    if kept_weight > 0:
+        scale = sum(weights) / kept_weight
+    else:
+        scale = 1
+
+    return (
+        list(map(lambda x: wages[x], positions)),
+        list(map(lambda x: weights[x] * scale, positions))
+    )
+
+
+def sample_records(records, fraction, seed=None):
+    """Take a weight preserving sample of the wages in each record.
+
+    Each record is a single group (stratum) of the eight dimensions so every
+    group is kept with its unemployment and counts unchanged. Within a group, a
+    random fraction of wage tuples (at least one) is kept and their weights
+    scaled such that they sum to the original wage count. Group proportions
+    and sizes are therefore unchanged while medians are estimated from fewer
+    wages.
+
+    Args:
+        records (iterable of InputRecord): The records to sample.
+        fraction (float): The share of wage tuples to keep between 0 and 1.
+        seed (int): Seed for a reproducible sample or None for fresh
+            randomness. Defaults to None.
+
+    Returns:
+        list of InputRecord: New records with sampled wages.
+    """
+    check_sample_fraction(fraction)
+    rng = random.Random(seed)
+
+    def sample_record(record):
+        wage_run = record.get_wage_run()
+        wages, weights = sample_wages(
+            wage_run.get_wages(),
+            wage_run.get_weights(),
+            fraction,
+            rng
+        )
+
+        return InputRecord(
+            record.get_index(),
+            record.get_educ(),
+            record.get_docc03(),
+            LazyWageTuples(wages, weights),
+            record.get_unemp(),
+            record.get_wage_count(),
+            record.get_unemp_count(),
+            record.get_wbhaom(),
+            record.get_female(),
+            record.get_region(),
+            record.get_age(),
+            record.get_hoursuint(),
+            record.get_citistat()
+        )
+
+    return list(map(sample_record, records))
+
+
+def write_sample(loc, sample_loc, fraction, seed=None):
+    """Write a copy of a CSV file keeping a sample of wages in each group.
+
+    Rows are streamed from the source and sampled as in sample_records without
+    building records. The output replaces sample_loc only once fully written.
+
+    Args:
+        loc (str): The location of the CSV file to sample.
+        sample_loc (str): The location at which to write the sampled file.
+        fraction (float): The share of wage tuples to keep between 0 and 1.
+        seed (int): Seed for a reproducible sample or None for fresh
+            randomness. Defaults to None.
+    """
+    check_sample_fraction(fraction)
+    rng = random.Random(seed)
+    temp_loc = '%s.%d.tmp' % (sample_loc, os.getpid())
+
+    with open(loc) as f_in:
+        with open(temp_loc, 'w', newline='') as f_out:
+            reader = csv.DictReader(f_in)
+            writer = csv.DictWriter(f_out, fieldnames=reader.fieldnames)
+            writer.writeheader()
+
+            for row in reader:
+                wage_tuples = list(parse_wage_otc(row['wageotc']))
+                wages, weights = sample_wages(
+                    list(map(lambda x: x.get_wage(), wage_tuples)),
+                    list(map(lambda x: x.get_weight(), wage_tuples)),
+                    fraction,
+                    rng
+                )
+                row['wageotc'] = ';'.join(map(lambda x: '%f %f' % x, zip(wages, weights)))
+                writer.writerow(row)
+
+    os.replace(temp_loc, sample_loc)
+
+
+def get_sample_loc(loc, fraction, seed):
+    """Determine where the pre-sampled copy of a CSV file is kept.
+
+    Args:
+        loc (str): The location of the CSV file to sample.
+        fraction (float): The share of wage tuples to keep between 0 and 1.
+        seed (int): Seed for the sample.
+
+    Returns:
+        str: Location in the loc + .samples directory whose name includes the
+            sample parameters and the size and modification time of the source
+            such that a changed source is sampled again.
+    """
+    stat = os.stat(loc)
+    filename = '%r-%d-%d-%d.csv' % (fraction, seed, stat.st_size, stat.st_mtime_ns)
+    return os.path.join(loc + SAMPLE_EXTENSION, filename)
+
+
+def load_sample_from_file(loc, fraction, seed=None):
+    """Load a dataset from a CSV file keeping a sample of wages in each group.
+
+    If a seed is given, the sample is written once by write_sample to the loc +
+    .samples directory and later loads with the same arguments read that
+    smaller file instead of the source. Otherwise, the source is streamed and
+    sampled without caching.
+
+    Args:
+        loc (str): The location of the CSV file from which to parse
+            InputRecords.
+        fraction (float): The share of wage tuples to keep between 0 and 1.
+        seed (int): Seed for a reproducible and cached sample or None for
+            fresh randomness. Defaults to None.
+
+    Returns:
+        Dataset with sampled records as described in sample_records.
+    """
+    if seed is None:
         with open(loc) as f:
-            records = list(csv.DictReader(f))
+            records = map(parse_record, csv.DictReader(f))
+            return Dataset(sample_records(records, fraction, seed))
+
+    sample_loc = get_sample_loc(loc, fraction, seed)
+
+    if not os.path.exists(sample_loc):
+        sample_dir = os.path.dirname(sample_loc)
+        if not os.path.exists(sample_dir):
+            os.makedirs(sample_dir)
+
+        write_sample(loc, sample_loc, fraction, seed)
+
+    return Dataset(read_records(sample_loc))
+
+
+def load_series_from_file(loc):
+    """Load a multi-period dataset from a CSV file with a period column.
+
+    Requires pandas and numpy.
+
+    Args:
+        loc (str): The location of the CSV file as written by the series
+            command of process_epi_data.
+
+    Returns:
+        TimeSeriesDataset parsed from the given location.
+    """
+    frame = read_frame(loc)
+
+    if 'period' not in frame.columns:
+        raise RuntimeError('No period column found in: %s' % loc)
+
+    periods_by_index = dict(zip(
+        frame['index'].tolist(),
+        frame['period'].tolist()
+    ))
+    return TimeSeriesDataset(parse_frame(frame), periods_by_index)
+
+
+def parse_rows(rows):
+    """Parse records from groups summarized in memory.
+
+    Args:
+        rows (iterable of dict): Dictionaries with the columns of the CSV file
+            like those returned by process_epi_data.summarize_agg. The
+            wageotc value may be a list of (wage, weight) tuples, in which case
+            it is used without building text, or the string written to the CSV
+            file. Records are numbered in order unless an index is given.
+
+    Returns:
+        Iterable over InputRecord.
+    """
+    def parse_row(position, row):
+        wages_raw = row['wageotc']
+        if isinstance(wages_raw, str):
+            wageotc = parse_wage_otc(wages_raw)
+        else:
+            wageotc = LazyWageTuples(
+                list(map(lambda x: float(x[0]), wages_raw)),
+                list(map(lambda x: float(x[1]), wages_raw))
+            )
+
+        return InputRecord(
+            int(row.get('index', position)),
+            str(row['educ']),
+            str(row['docc03']),
+            wageotc,
+            float(row['unemp']),
+            float(row['wageCount']),
+            float(row['unempCount']),
+            str(row['wbhaom']),
+            parse_female(row['female']),
+            str(row['region']),
+            str(row['age']),
+            str(row['hoursuint']),
+            str(row['citistat'])
+        )
+
+    return itertools.starmap(parse_row, enumerate(rows))
+
+
+def load_from_rows(rows):
+    """Load a dataset from groups summarized in memory.
+
+    Args:
+        rows (iterable of dict): The groups as described in parse_rows.
+
+    Returns:
+        Dataset with a record per row.
+    """
+    return Dataset(parse_rows(rows))
+
+
+def load_from_frame(frame):
+    """Load a dataset from a data frame with the columns of the CSV file.
+
+    The frame may be built in memory (like by process_epi_data with an index
+    named index) or converted from another columnar table. Label and number
+    columns are read column by column and wages given as strings are decoded
+    in a single vectorized pass. The female column may hold labels (Female or
+    Male) or booleans.
+
+    Args:
+        frame (pandas.DataFrame): Data frame with the columns of the CSV file
+            and either an index column or index.
+
+    Returns:
+        Dataset with a record per row.
+    """
+    if 'index' not in frame.columns:
+        frame = frame.reset_index()
+
+    wages_raw = frame['wageotc'].tolist()
+    if not all(map(lambda x: isinstance(x, str), wages_raw)):
+        return load_from_rows(frame.to_dict('records'))
+
+    label_columns = [
+        'educ',
+        'docc03',
+        'wbhaom',
+        'region',
+        'age',
+        'hoursuint',
+        'citistat'
+    ]
+    frame = frame.astype(dict(map(lambda x: (x, str), label_columns)))
+    return Dataset(parse_frame(frame))
+
+
+def parse_compact(document):
+    """Parse records from a dictionary encoded document.
+
+    Args:
+        document (dict): Document with columns, dictionaries, and rows as
+            written by process_epi_data.write_compact.
+
+    Returns:
+        Iterable over InputRecord.
+    """
+    columns = document['columns']
+    dictionaries = document['dictionaries']
+
+    def parse_row(index, row):
+        values = dict(zip(columns, row))
+
+        def get_label(name):
+            return dictionaries[name][values[name]]
+
+        wages_flat = values['wageotc']
+        wageotc = map(
+            lambda x: WageTuple(wages_flat[x], wages_flat[x + 1]),
+            range(0, len(wages_flat), 2)
+        )
+
+        return InputRecord(
+            index,
+            get_label('educ'),
+            get_label('docc03'),
+            wageotc,
+            values['unemp'],
+            values['wageCount'],
+            values['unempCount'],
+            get_label('wbhaom'),
+            parse_female(get_label('female')),
+            get_label('region'),
+            get_label('age'),
+            get_label('hoursuint'),
+            get_label('citistat')
+        )
 
-    records_parsed = map(parse_record, records)
+    return itertools.starmap(parse_row, enumerate(document['rows']))
+
+
+def load_from_compact(loc):
+    """Load a dataset from a dictionary encoded JSON file.
+
+    Args:
+        loc (str): The location of the JSON file written by
+            process_epi_data.write_compact. Files ending in .gz are
+            decompressed while reading.
+
+    Returns:
+        Dataset parsed from the given location.
+    """
+    opener = gzip.open if loc.endswith('.gz') else open
+    with opener(loc, 'rt') as f:
+        document = json.load(f)
 
-    return Dataset(records_parsed)
+    return Dataset(parse_compact(document))
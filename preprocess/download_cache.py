@@ -0,0 +1,324 @@
+"""Cache for large downloads like the EPI microdata archive.
+
+Files are stored by the SHA-256 of their contents with a small metadata file per
+URL recording the validators (ETag / Last-Modified) sent by the server. Cached
+files are revalidated with a conditional request so a new release is picked up
+without re-downloading an unchanged one and interrupted downloads resume with
+HTTP Range requests. A cached file is hashed again before use if it was
+modified since it was last verified.
+
+License: MIT
+Author: A Samuel Pottinger
+"""
+import hashlib
+import json
+import os
+import sys
+import time
+import typing
+
+import requests
+import urllib3
+
+CHUNK_SIZE = 1024 * 1024
+PROGRESS_INTERVAL = 5
+HASH_ALGORITHM = 'sha256'
+
+ProgressCallback = typing.Callable[[int, typing.Optional[int], float], None]
+
+
+class IncompleteDownloadError(RuntimeError):
+    """Raised when a response ends before the expected number of bytes."""
+    pass
+
+
+TRANSFER_ERRORS = (
+    requests.RequestException,
+    urllib3.exceptions.HTTPError,
+    IncompleteDownloadError
+)
+
+
+def print_progress(bytes_done: int, bytes_total: typing.Optional[int], bytes_per_second: float):
+    """Report download progress to standard error.
+
+    Args:
+        bytes_done: The number of bytes of the file available locally.
+        bytes_total: The expected size of the file in bytes or None if unknown.
+        bytes_per_second: The recent transfer rate.
+    """
+    megabytes_done = bytes_done / 1024 / 1024
+    megabytes_per_second = bytes_per_second / 1024 / 1024
+
+    if bytes_total:
+        percent = bytes_done / bytes_total * 100
+        message = 'Downloaded %.1f MB (%.1f%%) at %.1f MB/s' % (
+            megabytes_done,
+            percent,
+            megabytes_per_second
+        )
+    else:
+        message = 'Downloaded %.1f MB at %.1f MB/s' % (
+            megabytes_done,
+            megabytes_per_second
+        )
+
+    print(message, file=sys.stderr)
+
+
+class DownloadCache:
+    """Content addressed cache of downloaded files keyed by URL."""
+
+    def __init__(self, directory: str, session: typing.Optional[requests.Session] = None,
+        progress: typing.Optional[ProgressCallback] = print_progress,
+        progress_interval: float = PROGRESS_INTERVAL):
+        """Create a new cache.
+
+        Args:
+            directory: The directory in which cached files and metadata are
+                kept. Created if it does not exist.
+            session: The requests session to use or None to create one.
+            progress: Function called periodically with bytes done, bytes total
+                (or None if unknown), and bytes per second. None to disable
+                progress reporting. Defaults to print_progress.
+            progress_interval: Minimum number of seconds between progress
+                reports.
+        """
+        self._directory = directory
+        self._session = session if session is not None else requests.Session()
+        self._progress = progress
+        self._progress_interval = progress_interval
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def fetch(self, url: str) -> str:
+        """Get a local path containing the current contents of a URL.
+
+        Revalidates any cached copy with the server, downloading only if the
+        server reports a change. Resumes a previously interrupted download if
+        the server still reports the same version of the file. If the server
+        cannot be reached or the transfer fails part way, the cached copy is
+        used if available.
+
+        Args:
+            url: The URL to fetch.
+        Returns:
+            Path to the verified local copy of the file.
+        """
+        metadata = self._read_metadata(self._get_metadata_path(url))
+        cached_path = self._get_valid_cached_path(metadata)
+
+        headers = {}
+        if cached_path:
+            if metadata.get('etag'):
+                headers['If-None-Match'] = metadata['etag']
+            if metadata.get('lastModified'):
+                headers['If-Modified-Since'] = metadata['lastModified']
+
+        try:
+            return self._download(url, headers, cached_path)
+        except TRANSFER_ERRORS:
+            if cached_path:
+                print('Unable to revalidate %s, using cache.' % url, file=sys.stderr)
+                return cached_path
+            raise
+
+    def _download(self, url: str, headers: typing.Dict[str, str],
+        cached_path: typing.Optional[str]) -> str:
+        """Download a URL into the cache, resuming a partial file if possible.
+
+        Args:
+            url: The URL to fetch.
+            headers: Conditional request headers for the cached copy if any.
+            cached_path: The path to the valid cached copy or None if not
+                available.
+        Returns:
+            Path to the verified local copy of the file.
+        """
+        partial_path = self._get_partial_path(url)
+        partial_metadata_path = partial_path + '.json'
+        partial_metadata = self._read_metadata(partial_metadata_path)
+        partial_size = self._get_size(partial_path)
+
+        validator = partial_metadata.get('etag') or partial_metadata.get('lastModified')
+        can_resume = partial_size > 0 and validator
+        if can_resume:
+            headers['Range'] = 'bytes=%d-' % partial_size
+            headers['If-Range'] = validator
+
+        with self._session.get(url, headers=headers, stream=True) as response:
+            if response.status_code == 304:
+                return cached_path
+
+            response.raise_for_status()
+
+            resuming = can_resume and response.status_code == 206
+            if not resuming:
+                partial_size = 0
+
+            self._write_metadata(partial_metadata_path, {
+                'url': url,
+                'etag': response.headers.get('ETag'),
+                'lastModified': response.headers.get('Last-Modified')
+            })
+
+            content_length = response.headers.get('Content-Length')
+            if content_length is None:
+                bytes_total = None
+            else:
+                bytes_total = partial_size + int(content_length)
+
+            hasher = hashlib.new(HASH_ALGORITHM)
+            if resuming:
+                self._hash_file(partial_path, hasher)
+
+            mode = 'ab' if resuming else 'wb'
+            with open(partial_path, mode) as f:
+                bytes_done = self._stream(response, f, hasher, partial_size, bytes_total)
+
+            if bytes_total is not None and bytes_done != bytes_total:
+                raise IncompleteDownloadError('Incomplete download of %s.' % url)
+
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+
+        digest = hasher.hexdigest()
+        final_path = self._get_content_path(digest)
+        os.replace(partial_path, final_path)
+        os.remove(partial_metadata_path)
+
+        metadata_path = self._get_metadata_path(url)
+        prior_digest = self._read_metadata(metadata_path).get('hash')
+
+        self._write_metadata(metadata_path, {
+            'url': url,
+            'etag': etag,
+            'lastModified': last_modified,
+            'hash': digest,
+            'size': bytes_done,
+            'verifiedMtime': os.stat(final_path).st_mtime_ns
+        })
+
+        if prior_digest and prior_digest != digest:
+            self._remove_if_unreferenced(prior_digest)
+
+        return final_path
+
+    def _remove_if_unreferenced(self, digest: str):
+        """Delete a cached file if no URL's metadata still refers to it.
+
+        Args:
+            digest: The content hash of the file to consider removing.
+        """
+        filenames = os.listdir(self._directory)
+        metadata_filenames = filter(lambda x: x.endswith('.json'), filenames)
+        metadata_paths = map(
+            lambda x: os.path.join(self._directory, x),
+            metadata_filenames
+        )
+        referenced = map(
+            lambda x: self._read_metadata(x).get('hash') == digest,
+            metadata_paths
+        )
+
+        path = self._get_content_path(digest)
+        if not any(referenced) and os.path.exists(path):
+            os.remove(path)
+
+    def _stream(self, response: requests.Response, target: typing.BinaryIO, hasher,
+        bytes_done: int, bytes_total: typing.Optional[int]) -> int:
+        """Copy a response body to a file while hashing and reporting progress.
+
+        Args:
+            response: The streaming response to read.
+            target: The file to which bytes should be written.
+            hasher: The hashlib object to update with each chunk.
+            bytes_done: The number of bytes already in the file.
+            bytes_total: The expected final size of the file or None if
+                unknown.
+        Returns:
+            Number of bytes in the file after copying.
+        """
+        last_report_time = time.monotonic()
+        last_report_bytes = bytes_done
+
+        for chunk in response.raw.stream(CHUNK_SIZE, decode_content=False):
+            target.write(chunk)
+            hasher.update(chunk)
+            bytes_done += len(chunk)
+
+            now = time.monotonic()
+            elapsed = now - last_report_time
+            if self._progress and elapsed >= self._progress_interval:
+                rate = (bytes_done - last_report_bytes) / elapsed
+                self._progress(bytes_done, bytes_total, rate)
+                last_report_time = now
+                last_report_bytes = bytes_done
+
+        return bytes_done
+
+    def _get_valid_cached_path(self, metadata: typing.Dict) -> typing.Optional[str]:
+        """Find the cached copy described by metadata if it is intact.
+
+        The file is hashed again unless its modification time matches the one
+        recorded when it was last verified.
+
+        Args:
+            metadata: The metadata recorded for a URL or empty if none.
+        Returns:
+            Path to the cached file if it exists with the recorded size and
+            hash or None otherwise.
+        """
+        if 'hash' not in metadata:
+            return None
+
+        path = self._get_content_path(metadata['hash'])
+        if self._get_size(path) != metadata['size']:
+            return None
+
+        mtime = os.stat(path).st_mtime_ns
+        if metadata.get('verifiedMtime') == mtime:
+            return path
+
+        hasher = hashlib.new(HASH_ALGORITHM)
+        self._hash_file(path, hasher)
+        if hasher.hexdigest() != metadata['hash']:
+            return None
+
+        verified_metadata = dict(metadata)
+        verified_metadata['verifiedMtime'] = mtime
+        self._write_metadata(self._get_metadata_path(metadata['url']), verified_metadata)
+
+        return path
+
+    def _get_metadata_path(self, url: str) -> str:
+        return os.path.join(self._directory, self._get_url_key(url) + '.json')
+
+    def _get_partial_path(self, url: str) -> str:
+        return os.path.join(self._directory, self._get_url_key(url) + '.part')
+
+    def _get_content_path(self, digest: str) -> str:
+        return os.path.join(self._directory, digest)
+
+    def _get_url_key(self, url: str) -> str:
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def _get_size(self, path: str) -> int:
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def _hash_file(self, path: str, hasher):
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                hasher.update(chunk)
+
+    def _read_metadata(self, path: str) -> typing.Dict:
+        if not os.path.exists(path):
+            return {}
+
+        with open(path) as f:
+            return json.load(f)
+
+    def _write_metadata(self, path: str, metadata: typing.Dict):
+        with open(path, 'w') as f:
+            json.dump(metadata, f)
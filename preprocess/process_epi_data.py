@@ -4,123 +4,640 @@ Script which takes in the data location file, year for which to filter, month fo
 and the output CSV location after processing. Assumes educ, docc03, wageotc, wbhaom, female are
 present.
 
+The pipeline is split into commands (download, load, aggregate, export) which persist their results
+so that each can be run or resumed on its own. The run command executes all of them. Heavy
+dependencies like pandas are only imported by the steps which need them.
+
 License: MIT
 Author: A Samuel Pottinger
 """
+from __future__ import annotations
+
+import gzip
+import hashlib
+import itertools
+import json
 import os
+import pickle
+import re
 import shutil
 import statistics
 import sys
 import typing
+import zipfile
 
-import bs4
-import numpy
-import pandas
-import requests
+if typing.TYPE_CHECKING:
+    import data_model
+    import numpy
+    import pandas
 
 EPI_MICRODATA_LOC = 'https://microdata.epi.org'
-USAGE_STR = 'USAGE: python process_epi_data.py [auto or dat file loc] [start year] [start month] [end year] [end month] [output loc]'
-NUM_ARGS = 6
+DOWNLOAD_CACHE_DIR = '/tmp/epi_microdata_cache'
+COLUMN_CACHE_DIR = '/tmp/epi_column_cache'
+USED_COLUMNS = [
+    'educ',
+    'docc03',
+    'wageotc',
+    'lfstat',
+    'wage',
+    'wbhaom',
+    'female',
+    'orgwgt',
+    'region',
+    'citistat',
+    'hoursuint',
+    'age'
+]
+SOURCE_COLUMNS = ['year', 'month'] + USED_COLUMNS
+FLOAT_COLUMNS = ['wageotc', 'wage', 'orgwgt']
+RUN_ARGS_STR = '[auto or dat file loc] [start year] [start month] [end year] [end month] [output loc] [optional partition dir or none] [optional compact loc or none] [optional config loc]'
+COMMAND_ARGS_STRS = {
+    'download': '[start year] [end year] [output dir]',
+    'load': '[auto or dat file loc] [start year] [start month] [end year] [end month] [output loc] [optional config loc]',
+    'aggregate': '[loaded loc] [output loc] [optional dedupe precision or none]',
+    'prune': '[aggregated loc] [output loc] [min share] [optional rollup dimensions]',
+    'export': '[aggregated loc] [output loc] [optional partition dir or none] [optional compact loc]',
+    'run': RUN_ARGS_STR,
+    'views': '[aggregated loc] [output loc]',
+    'series': '[auto or dat file loc] [start year] [start month] [end year] [end month] [output loc] [optional config loc]'
+}
+LOAD_NUMERIC_ARGS = {1: int, 2: int, 3: int, 4: int}
+COMMAND_NUMERIC_ARGS = {
+    'download': {0: int, 1: int},
+    'load': LOAD_NUMERIC_ARGS,
+    'prune': {2: float},
+    'run': LOAD_NUMERIC_ARGS,
+    'series': LOAD_NUMERIC_ARGS
+}
+USAGE_STR = 'USAGE: python process_epi_data.py [command] [args]\n' + '\n'.join(map(
+    lambda x: '  %s %s' % x,
+    COMMAND_ARGS_STRS.items()
+))
 DUMP = False
+EXCLUDED_OCCUPATIONS = ['Armed Forces', 'nan']
+DEFAULT_FILTERS = [{'column': 'docc03', 'exclude': EXCLUDED_OCCUPATIONS}]
+DEFAULT_CONFIG = {'filters': DEFAULT_FILTERS}
+ALL_OCCUPATIONS_LABEL = 'All occupations'
+PERIOD_COLUMN = 'period'
+STRATA_COLUMNS = [
+    'educ',
+    'docc03',
+    'wbhaom',
+    'female',
+    'region',
+    'citistat',
+    'age',
+    'hoursuint'
+]
+SAMPLE_SEED = 0
+SAMPLE_CACHE_SUBDIR = 'samples'
+SAMPLE_CACHE_VERSION = 2
+ROLLUP_DIMENSIONS = ['citistat', 'hoursuint']
+RESIDUAL_DIMENSIONS = ['citistat', 'hoursuint', 'age', 'region', 'wbhaom', 'educ']
+# Female is not included as loaders read it as a bool (see data_model.parse_female).
+ROLLUP_LABELS = {
+    'educ': 'All education levels',
+    'docc03': ALL_OCCUPATIONS_LABEL,
+    'wbhaom': 'All races and ethnicities',
+    'region': 'All regions',
+    'age': 'All ages',
+    'hoursuint': 'All hours',
+    'citistat': 'All citizenship statuses'
+}
+MANIFEST_FILENAME = 'manifest.json'
+OVERVIEW_FILENAME = 'overview.csv'
+LABEL_COLUMNS = [
+    'educ',
+    'docc03',
+    'wbhaom',
+    'female',
+    'region',
+    'age',
+    'hoursuint',
+    'citistat'
+]
+COMPACT_COLUMNS = [
+    'educ',
+    'docc03',
+    'wageotc',
+    'unemp',
+    'wageCount',
+    'unempCount',
+    'wbhaom',
+    'female',
+    'region',
+    'age',
+    'hoursuint',
+    'citistat'
+]
+WAGE_DECIMALS = 2
+WEIGHT_DECIMALS = 1
+UNEMP_DECIMALS = 4
+
+
+def read_config(loc: typing.Optional[str]) -> typing.Dict:
+    """Read the pipeline configuration describing which rows to keep.
+
+    The configuration is a JSON object whose filters attribute is a list of
+    objects each with a column and either an include or exclude list of values.
+    Values are compared as strings (missing values are nan). Filters are
+    applied with the date range while loading, before any recoding or
+    aggregation, and their columns are read only for filtering. An optional
+    sample attribute with a fraction (0 - 1) and optional seed keeps a
+    stratified sample of the filtered rows as described in sample_frame.
+
+    Args:
+        loc: The location of the JSON file or None to use DEFAULT_CONFIG which
+            excludes Armed Forces and missing occupations.
+    Returns:
+        Dictionary with a filters list and, if sampling, a sample dictionary
+        with fraction and seed.
+    """
+    if loc is None:
+        return DEFAULT_CONFIG
+
+    with open(loc) as f:
+        config = json.load(f)
 
+    filters = config.get('filters', [])
+    for config_filter in filters:
+        if 'column' not in config_filter:
+            raise RuntimeError('Filter missing column: %s' % config_filter)
 
-def load_data(locs: typing.List[str], start_year: int, start_month: int, end_year: int,
-    end_month: int) -> pandas.DataFrame:
+        num_predicates = ('include' in config_filter) + ('exclude' in config_filter)
+        if num_predicates != 1:
+            raise RuntimeError('Filter needs one of include or exclude: %s' % config_filter)
+
+    if 'sample' not in config:
+        return {'filters': filters}
+
+    sample = {
+        'fraction': float(config['sample']['fraction']),
+        'seed': int(config['sample'].get('seed', SAMPLE_SEED))
+    }
+    return {'filters': filters, 'sample': sample}
+
+
+def get_source_columns(config: typing.Dict) -> typing.List[str]:
+    """Determine which columns to read from the Stata files.
+
+    Args:
+        config: The pipeline configuration as returned by read_config.
+    Returns:
+        SOURCE_COLUMNS followed by any other columns needed by filters.
+    """
+    filter_columns = map(lambda x: x['column'], config['filters'])
+    extra_columns = filter(lambda x: x not in SOURCE_COLUMNS, filter_columns)
+    return SOURCE_COLUMNS + sorted(set(extra_columns))
+
+
+def get_filter_mask(source: pandas.DataFrame, config_filter: typing.Dict) -> numpy.ndarray:
+    """Determine which rows pass a configured filter.
+
+    Args:
+        source: The data frame to filter.
+        config_filter: Dictionary with a column and either an include or an
+            exclude list of values as described in read_config.
+    Returns:
+        Boolean array which is True for rows to keep.
+    """
+    import numpy
+    import pandas
+
+    series = source[config_filter['column']]
+    excluding = 'exclude' in config_filter
+    values = config_filter['exclude'] if excluding else config_filter['include']
+    values_strs = set(map(str, values))
+
+    if isinstance(series.dtype, pandas.CategoricalDtype):
+        categories_match = map(lambda x: str(x) in values_strs, series.cat.categories)
+        missing_match = 'nan' in values_strs
+        lookup = numpy.array(list(categories_match) + [missing_match], dtype=bool)
+        matches = lookup[series.cat.codes.to_numpy()]
+    else:
+        matches = series.astype(str).isin(values_strs).to_numpy()
+
+    return ~matches if excluding else matches
+
+
+def read_source(loc, cache_dir: typing.Optional[str] = None,
+    columns: typing.List[str] = SOURCE_COLUMNS) -> pandas.DataFrame:
+    """Read the needed columns from a single Stata file.
+
+    Args:
+        loc: The path to the dta file or a zipfile.Path referring to a dta file
+            within an archive which is read without extracting it.
+        cache_dir: Directory of the column_cache.ColumnCache to use or None to
+            always decode the Stata file.
+        columns: The columns to read. Defaults to SOURCE_COLUMNS.
+    Returns:
+        Data frame with the requested columns of the file.
+    """
+    import pandas
+
+    if cache_dir:
+        import column_cache
+        return column_cache.ColumnCache(cache_dir).read(loc, columns)
+
+    if isinstance(loc, zipfile.Path):
+        with loc.open('rb') as f:
+            return pandas.read_stata(
+                f,
+                convert_missing=False,
+                preserve_dtypes=False,
+                columns=columns
+            )
+    else:
+        return pandas.read_stata(
+            loc,
+            convert_missing=False,
+            preserve_dtypes=False,
+            columns=columns
+        )
+
+
+def determine_age(age_raw_str: str) -> str:
+    """Bucket an age as given in the source data.
+
+    Args:
+        age_raw_str: The age like 34 or 80+.
+    Returns:
+        The age group label like 25-35 yr.
+    """
+    if age_raw_str == "80+":
+        age_raw = 80
+    else:
+        age_raw = float(age_raw_str)
+
+    if age_raw <= 25:
+        return "<25 yr"
+    elif age_raw <= 35:
+        return "25-35 yr"
+    elif age_raw <= 45:
+        return "35-45 yr"
+    elif age_raw <= 55:
+        return "45-55 yr"
+    elif age_raw <= 65:
+        return "55-65 yr"
+    else:
+        return "65+ yr"
+
+
+def determine_hours(target: str) -> str:
+    """Bucket usual hours worked as given in the source data.
+
+    Args:
+        target: The hours label like 40 hours.
+    Returns:
+        The hours group label like At Least 35 Hours.
+    """
+    return {
+        '0-20 hours': 'Less than 35 Hours',
+        '21-34 hours': 'Less than 35 Hours',
+        '35-39 hours': 'At Least 35 Hours',
+        '40 hours': 'At Least 35 Hours',
+        '41-49 hours': 'At Least 35 Hours',
+        '50 or more hours': 'At Least 35 Hours',
+        'Hours vary: full-time': 'Varies or Other',
+        'Hours vary: part-time': 'Varies or Other'
+    }.get(target, 'Varies or Other')
+
+
+def load_data(locs: typing.List, start_year: int, start_month: int, end_year: int,
+    end_month: int, cache_dir: typing.Optional[str] = None,
+    keep_period: bool = False, config: typing.Dict = DEFAULT_CONFIG) -> pandas.DataFrame:
     """Load and filter EPI data.
 
     Args:
-        loc: The locations of the dat files.
+        locs: The locations of the dat files as paths or zipfile.Path.
         start_year: Integer year for which to start filtering.
         start_month: Integer month for which to start filtering.
         end_year: Integer year for which to end filtering.
         end_month: Integer month for which to end filtering.
+        cache_dir: Directory in which to cache decoded columns and samples or
+            None to disable caching.
+        keep_period: If True, include a categorical period column with the
+            year and month of each response like 2023-03.
+        config: The pipeline configuration as returned by read_config whose
+            filters are applied along with the date range before recoding. If
+            it has a sample, only a stratified sample of rows is kept before
+            recoding. Defaults to DEFAULT_CONFIG.
     Returns:
         Filtered data frame for the target year / month with educ, docc03,
         wageotc, wbhaom, female included. Only returns those with a finite
         non-None number for wageotc.
     """
-    all_data = None
-    for loc in locs:
-        sub_frame = pandas.read_stata(
-            loc,
-            convert_missing=False,
-            preserve_dtypes=False
+    select = read_sample if 'sample' in config else select_rows
+    with_wage = select(
+        locs,
+        start_year,
+        start_month,
+        end_year,
+        end_month,
+        cache_dir=cache_dir,
+        keep_period=keep_period,
+        config=config
+    )
+
+    with_wage['age'] = recode_categorical(with_wage['age'], determine_age)
+    with_wage['hoursuint'] = recode_categorical(
+        with_wage['hoursuint'],
+        determine_hours
+    )
+
+    for column in FLOAT_COLUMNS:
+        with_wage[column] = downcast_float(with_wage[column])
+
+    return with_wage
+
+
+def select_rows(locs: typing.List, start_year: int, start_month: int, end_year: int,
+    end_month: int, cache_dir: typing.Optional[str] = None,
+    keep_period: bool = False, config: typing.Dict = DEFAULT_CONFIG) -> pandas.DataFrame:
+    """Read the rows within the date range which pass the configured filters.
+
+    Args:
+        locs: The locations of the dat files as paths or zipfile.Path.
+        start_year: Integer year for which to start filtering.
+        start_month: Integer month for which to start filtering.
+        end_year: Integer year for which to end filtering.
+        end_month: Integer month for which to end filtering.
+        cache_dir: Directory in which to cache decoded columns or None to
+            disable caching.
+        keep_period: If True, include a categorical period column.
+        config: The pipeline configuration as returned by read_config.
+    Returns:
+        Data frame with USED_COLUMNS (and the period if requested) before
+        recoding.
+    """
+    import pandas
+
+    source_columns = get_source_columns(config)
+    sub_frames = map(lambda x: read_source(x, cache_dir, source_columns), locs)
+    all_data = concat_frames(list(sub_frames))
+
+    min_period = start_year * 100 + start_month
+    max_period = end_year * 100 + end_month
+    periods = all_data['year'] * 100 + all_data['month']
+    in_range = ((periods >= min_period) & (periods <= max_period)).to_numpy()
+
+    for config_filter in config['filters']:
+        in_range = in_range & get_filter_mask(all_data, config_filter)
+
+    with_wage = all_data.loc[in_range, USED_COLUMNS].reset_index()
+    del all_data
+
+    if keep_period:
+        period_codes = pandas.Categorical(periods[in_range].astype(int))
+        with_wage[PERIOD_COLUMN] = period_codes.rename_categories(
+            lambda x: '%04d-%02d' % (x // 100, x % 100)
         )
-        if all_data is None:
-            all_data = sub_frame
-        else:
-            all_data = pandas.concat([all_data, sub_frame], axis=0)
 
-    def get_month_str(target: int) -> str:
-        if target < 10:
-            return '0' + str(target)
-        else:
-            return str(target)
+    return with_wage
+
+
+def read_sample(locs: typing.List, start_year: int, start_month: int, end_year: int,
+    end_month: int, cache_dir: typing.Optional[str] = None,
+    keep_period: bool = False, config: typing.Dict = DEFAULT_CONFIG) -> pandas.DataFrame:
+    """Select rows as in select_rows and keep the sample described by the config.
+
+    If a cache directory is given, the sample is saved in its samples
+    subdirectory keyed by the source file hashes, date range, period option,
+    and configuration. Later loads with the same arguments read it instead of
+    the full sources such that only recoding and aggregation are repeated.
+
+    Args:
+        locs: The locations of the dat files as paths or zipfile.Path.
+        start_year: Integer year for which to start filtering.
+        start_month: Integer month for which to start filtering.
+        end_year: Integer year for which to end filtering.
+        end_month: Integer month for which to end filtering.
+        cache_dir: Directory in which to cache decoded columns and samples or
+            None to disable caching.
+        keep_period: If True, include a categorical period column.
+        config: The pipeline configuration as returned by read_config with a
+            sample.
+    Returns:
+        Data frame as described in sample_frame before recoding.
+    """
+    sample = config['sample']
+
+    def make_sample() -> pandas.DataFrame:
+        selected = select_rows(
+            locs,
+            start_year,
+            start_month,
+            end_year,
+            end_month,
+            cache_dir,
+            keep_period,
+            config
+        )
+        return sample_frame(selected, sample['fraction'], sample['seed'])
+
+    if not cache_dir:
+        return make_sample()
+
+    import column_cache
+
+    source_hashes = map(column_cache.ColumnCache(cache_dir).get_source_hash, locs)
+    key_pieces = [
+        str(SAMPLE_CACHE_VERSION),
+        '%d-%d-%d-%d' % (start_year, start_month, end_year, end_month),
+        str(keep_period),
+        json.dumps(config, sort_keys=True)
+    ] + list(source_hashes)
+    key = hashlib.sha256('\t'.join(key_pieces).encode('utf-8')).hexdigest()
+
+    sample_dir = os.path.join(cache_dir, SAMPLE_CACHE_SUBDIR)
+    sample_loc = os.path.join(sample_dir, key + '.pickle')
+
+    if os.path.exists(sample_loc):
+        return read_pickle(sample_loc)
+
+    sampled = make_sample()
+
+    if not os.path.exists(sample_dir):
+        os.makedirs(sample_dir)
+
+    write_pickle(sampled, sample_loc)
+    return sampled
+
+
+def sample_frame(frame: pandas.DataFrame, fraction: float, seed: int = SAMPLE_SEED
+    ) -> pandas.DataFrame:
+    """Take a weight preserving stratified sample of rows.
+
+    Rows are stratified on STRATA_COLUMNS (and the period if present) with age
+    and hours bucketed as in load_data such that strata are the groups later
+    built by agg_data while the rows themselves are returned before recoding.
+    Each stratum keeps its size times the fraction of rows, rounded up or down
+    at random in proportion to the remainder. The orgwgt of kept rows is scaled
+    such that strata of at least one over the fraction rows keep their exact
+    total weight. Smaller strata are kept with probability of their size times
+    the fraction and are scaled up by its inverse when kept so their weight,
+    and so the overall total, is preserved in expectation.
+
+    Args:
+        frame: The rows as returned by select_rows.
+        fraction: The share of rows to keep between 0 and 1.
+        seed: Seed for the random selection. Defaults to SAMPLE_SEED.
+    Returns:
+        Data frame with the kept rows in their original order.
+    """
+    import numpy
+
+    if fraction <= 0 or fraction > 1:
+        raise RuntimeError('Sample fraction must be between 0 and 1: %s' % fraction)
+
+    strata_columns = list(STRATA_COLUMNS)
+    if PERIOD_COLUMN in frame.columns:
+        strata_columns.append(PERIOD_COLUMN)
+
+    strata = frame[strata_columns].copy()
+    strata['age'] = recode_categorical(strata['age'], determine_age)
+    strata['hoursuint'] = recode_categorical(strata['hoursuint'], determine_hours)
 
-    start_month_str = get_month_str(start_month)
-    end_month_str = get_month_str(end_month)
-    min_date_str = str(start_year) + '-' + start_month_str
-    max_date_str = str(end_year) + '-' + end_month_str
+    codes = strata.groupby(
+        strata_columns,
+        observed=True,
+        sort=False,
+        dropna=False
+    ).ngroup().to_numpy()
+    counts = numpy.bincount(codes)
 
-    def get_in_range(date_str: typing.Dict) -> bool:
-        return date_str >= min_date_str and date_str <= max_date_str
+    rng = numpy.random.default_rng(seed)
+    shuffled = rng.permutation(len(codes))
+    positions = shuffled[numpy.argsort(codes[shuffled], kind='stable')]
+    sorted_codes = codes[positions]
+    stratum_starts = numpy.cumsum(counts) - counts
+    ranks = numpy.arange(len(positions)) - stratum_starts[sorted_codes]
 
-    all_data['dateStr'] = all_data.apply(
-        lambda x: str(x['year']) + '-' + get_month_str(x['month']),
-        axis=1
+    targets = numpy.floor(counts * fraction + rng.random(len(counts)))
+    kept = numpy.sort(positions[ranks < targets[sorted_codes]])
+    kept_codes = codes[kept]
+
+    weights = numpy.nan_to_num(frame['orgwgt'].to_numpy(dtype='float64'))
+    stratum_weights = numpy.bincount(codes, weights=weights, minlength=len(counts))
+    kept_weights = numpy.bincount(kept_codes, weights=weights[kept], minlength=len(counts))
+    kept_counts = numpy.bincount(kept_codes, minlength=len(counts))
+
+    inclusion = numpy.minimum(counts * fraction, 1)
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        scales = numpy.where(
+            kept_weights > 0,
+            stratum_weights / kept_weights,
+            counts / numpy.maximum(kept_counts, 1)
+        ) / inclusion
+
+    sampled = frame.iloc[kept].reset_index(drop=True)
+    sampled['orgwgt'] = sampled['orgwgt'].to_numpy(dtype='float64') * scales[kept_codes]
+    return sampled
+
+
+def concat_frames(frames: typing.List[pandas.DataFrame]) -> pandas.DataFrame:
+    """Concatenate data frames in a single copy while keeping categoricals.
+
+    Categorical columns whose categories differ between frames are given the
+    union of those categories first as pandas would otherwise convert them to
+    object columns of repeated strings.
+
+    Args:
+        frames: The data frames to combine which share columns.
+    Returns:
+        Single data frame with the rows of all frames.
+    """
+    import pandas
+
+    if len(frames) == 1:
+        return frames[0]
+
+    for column in frames[0].columns:
+        dtypes = list(map(lambda x: x[column].dtype, frames))
+        is_categorical = map(lambda x: isinstance(x, pandas.CategoricalDtype), dtypes)
+        if not all(is_categorical):
+            continue
+
+        categories = []
+        seen = set()
+        for dtype in dtypes:
+            for category in dtype.categories:
+                if category not in seen:
+                    seen.add(category)
+                    categories.append(category)
+
+        for frame in frames:
+            frame[column] = frame[column].cat.set_categories(categories)
+
+    return pandas.concat(frames, axis=0, copy=False)
+
+
+def recode_categorical(series: pandas.Series, recoder: typing.Callable) -> pandas.Series:
+    """Recode values by applying a function once per distinct value.
+
+    Args:
+        series: The values to recode.
+        recoder: Function taking an original value and returning its new
+            label. Missing values are recoded by passing NaN.
+    Returns:
+        Categorical series with the recoded labels.
+    """
+    import numpy
+    import pandas
+
+    categorical = pandas.Categorical(series)
+    labels = list(map(recoder, categorical.categories)) + [recoder(numpy.nan)]
+    new_categories = sorted(set(labels))
+
+    label_codes = numpy.array(
+        list(map(lambda x: new_categories.index(x), labels)),
+        dtype=numpy.int32
     )
-    target_date = all_data[all_data['dateStr'].apply(get_in_range) == True]
+    new_codes = label_codes[categorical.codes]
 
-    with_wage = target_date[[
-        'educ',
-        'docc03',
-        'wageotc',
-        'lfstat',
-        'wage',
-        'wbhaom',
-        'female',
-        'orgwgt',
-        'region',
-        'citistat',
-        'hoursuint',
-        'age'
-    ]].copy().reset_index()
+    recoded = pandas.Categorical.from_codes(new_codes, categories=new_categories)
+    return pandas.Series(recoded, index=series.index)
 
-    def determine_age(age_raw_str: str) -> str:
-        if age_raw_str == "80+":
-            age_raw = 80
-        else:
-            age_raw = float(age_raw_str)
-
-        if age_raw <= 25:
-            return "<25 yr"
-        elif age_raw <= 35:
-            return "25-35 yr"
-        elif age_raw <= 45:
-            return "35-45 yr"
-        elif age_raw <= 55:
-            return "45-55 yr"
-        elif age_raw <= 65:
-            return "55-65 yr"
-        else:
-            return "65+ yr"
 
-    def determine_hours(target):
-        return {
-            '0-20 hours': 'Less than 35 Hours',
-            '21-34 hours': 'Less than 35 Hours',
-            '35-39 hours': 'At Least 35 Hours',
-            '40 hours': 'At Least 35 Hours',
-            '41-49 hours': 'At Least 35 Hours',
-            '50 or more hours': 'At Least 35 Hours',
-            'Hours vary: full-time': 'Varies or Other',
-            'Hours vary: part-time': 'Varies or Other'
-        }.get(target, 'Varies or Other')
-
-    with_wage['age'] = with_wage['age'].apply(determine_age)
-    with_wage['hoursuint'] = with_wage['hoursuint'].apply(determine_hours)
+def downcast_float(series: pandas.Series) -> pandas.Series:
+    """Use single precision for a float column if no values would change.
 
-    return with_wage
+    Args:
+        series: The float values to consider downcasting.
+    Returns:
+        The values as float32 if lossless and the original series otherwise.
+    """
+    import numpy
+
+    values = series.to_numpy()
+    if values.dtype != numpy.float64:
+        return series
+
+    downcast = values.astype(numpy.float32)
+    matches = (downcast == values) | (numpy.isnan(downcast) & numpy.isnan(values))
+    if matches.all():
+        return series.astype(numpy.float32)
+    else:
+        return series
+
+
+def get_peak_memory_mb() -> typing.Optional[float]:
+    """Get the peak resident memory of this process.
+
+    Returns:
+        Peak memory in megabytes or None if not available on this platform.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak / 1024 / 1024
+    else:
+        return peak / 1024
 
 
 def get_key(row: typing.Dict) -> str:
@@ -130,37 +647,47 @@ def get_key(row: typing.Dict) -> str:
         row: The row for which to get a key.
     Returns:
         Key describing the group represented by a row. This key has educ,
-        docc03, wbhaom, and female.
-    """
-    key_pieces = map(
-        lambda key: row[key],
-        [
-            'educ',
-            'docc03',
-            'wbhaom',
-            'female',
-            'region',
-            'citistat',
-            'age',
-            'hoursuint'
-        ]
-    )
+        docc03, wbhaom, and female along with the period if present.
+    """
+    key_columns = [
+        'educ',
+        'docc03',
+        'wbhaom',
+        'female',
+        'region',
+        'citistat',
+        'age',
+        'hoursuint'
+    ]
+    if PERIOD_COLUMN in row:
+        key_columns.append(PERIOD_COLUMN)
+
+    key_pieces = map(lambda key: row[key], key_columns)
     key_pieces_str = map(lambda x: str(x), key_pieces)
     return '-'.join(key_pieces_str)
 
 
-def agg_data(source: pandas.DataFrame) -> typing.Dict:
+def agg_data(source: pandas.DataFrame, dedupe: bool = False,
+    wage_decimals: typing.Optional[int] = None) -> typing.Dict:
     """Aggregate into groups.
 
     Aggregate wage info by "group" where a group is the combination of educ,
-    docc03, wbhaom, ad female variables.
+    docc03, wbhaom, ad female variables. If the source has a period column,
+    each period is kept as a separate group.
 
     Args:
         source: The data frame to aggregate.
+        dedupe: If True, combine wage tuples with the same wage within each
+            group by summing their weights as described in dedupe_wages.
+        wage_decimals: If deduplicating, the number of decimal places to
+            which wages are rounded first or None to only combine exactly
+            equal wages.
     Returns:
         Dictionary mapping from group key to dictionary describing the group
         with individual wage info.
     """
+    import numpy
+
     agg = {}
 
     for index, row in source.iterrows():
@@ -180,6 +707,9 @@ def agg_data(source: pandas.DataFrame) -> typing.Dict:
                 'wageCount': 0,
                 'unempCount': 0
             }
+            if PERIOD_COLUMN in row:
+                agg[key][PERIOD_COLUMN] = row[PERIOD_COLUMN]
+
         weight = row['orgwgt'] if numpy.isfinite(row['orgwgt']) else 0
 
         agg[key]['unemp'].append(
@@ -191,12 +721,73 @@ def agg_data(source: pandas.DataFrame) -> typing.Dict:
             agg[key]['wageotc'].append((row['wageotc'], weight))
             agg[key]['wageCount'] += weight
 
+    if dedupe:
+        for record in agg.values():
+            record['wageotc'] = dedupe_wages(record['wageotc'], wage_decimals)
+
     return agg
 
 
+def dedupe_wages(wages: typing.List[typing.Tuple], decimals: typing.Optional[int] = None
+    ) -> typing.List[typing.Tuple]:
+    """Combine wage tuples with the same wage by summing their weights.
+
+    Weighted medians are unchanged when combining exactly equal wages. Rounding
+    first moves each wage by at most half of the last decimal place.
+
+    Args:
+        wages: The (wage, weight) tuples of a group.
+        decimals: The number of decimal places to which wages are rounded
+            before combining or None to only combine exactly equal wages.
+    Returns:
+        List of (wage, weight) tuples with one tuple per distinct wage sorted
+        by wage.
+    """
+    weights_by_wage: typing.Dict = {}
+
+    for wage, weight in wages:
+        if decimals is not None:
+            wage = round(float(wage), decimals)
+        weights_by_wage[wage] = weights_by_wage.get(wage, 0) + weight
+
+    return sorted(weights_by_wage.items(), key=lambda x: x[0])
+
+
+def get_group_wages(record: typing.Dict) -> typing.List[typing.Tuple]:
+    """Get the wages of a group from agg_data sorted by value.
+
+    Args:
+        record: One group of the aggregate produced by agg_data.
+    Returns:
+        List of (wage, weight) tuples sorted by wage with a single zero wage of
+        zero weight if the group has no wages.
+    """
+    if record['wageCount'] == 0:
+        wages = [(0, 0)]
+    else:
+        wages = record['wageotc']
+
+    wages.sort(key=lambda x: x[0])
+    return wages
+
+
+def get_group_unemp(record: typing.Dict) -> float:
+    """Get the unemployment rate of a group from agg_data.
+
+    Args:
+        record: One group of the aggregate produced by agg_data.
+    Returns:
+        The unemployment rate as a percentage between 0 and 100.
+    """
+    return (sum(record['unemp']) + 0.0) / record['unempCount'] * 100
+
+
 def summarize_agg(agg: typing.Dict) -> typing.List[typing.Dict]:
     """Get mean wage and count for groups produced by agg_data.
 
+    Wages within each group are sorted by value so that readers can find
+    medians across groups without sorting again.
+
     Args:
         agg: The aggregate to summarize.
     Returns:
@@ -208,24 +799,15 @@ def summarize_agg(agg: typing.Dict) -> typing.List[typing.Dict]:
     has_records = filter(lambda x: x['unempCount'] > 0, all_records)
 
     for record in has_records:
-        if record['wageCount'] == 0:
-            wages = [(0, 0)]
-        else:
-            wages = record['wageotc']
-        
-        wages.sort(key=lambda x: x[1])
+        wages = get_group_wages(record)
         wages_strs = map(lambda x: '%f %f' % x, wages)
         wages_str = ';'.join(wages_strs)
 
-        mean_unemployemnt = (
-            sum(record['unemp']) + 0.0
-        ) / record['unempCount'] * 100
-
-        output_rows.append({
+        output_row = {
             'educ': record['educ'],
             'docc03': record['docc03'],
             'wageotc': wages_str,
-            'unemp': mean_unemployemnt,
+            'unemp': get_group_unemp(record),
             'wageCount': record['wageCount'],
             'unempCount': record['unempCount'],
             'wbhaom': record['wbhaom'],
@@ -234,11 +816,386 @@ def summarize_agg(agg: typing.Dict) -> typing.List[typing.Dict]:
             'age': record['age'],
             'hoursuint': record['hoursuint'],
             'citistat': record['citistat']
-        })
+        }
+        if PERIOD_COLUMN in record:
+            output_row[PERIOD_COLUMN] = record[PERIOD_COLUMN]
+
+        output_rows.append(output_row)
 
     return output_rows
 
 
+def make_dataset(agg: typing.Dict) -> data_model.Dataset:
+    """Build a queryable dataset from an aggregate without writing a CSV file.
+
+    Records are built directly from each group without an intermediate row.
+    Wages are handed to data_model as numbers so they are neither formatted as
+    text nor parsed again and match the aggregate at full precision rather
+    than the six decimal places written to the CSV file.
+
+    Args:
+        agg: The aggregate produced by agg_data.
+    Returns:
+        Dataset with the same records as would be loaded from the exported CSV
+        file.
+    """
+    import data_model
+
+    def make_record(index: int, record: typing.Dict) -> data_model.InputRecord:
+        wages = get_group_wages(record)
+        return data_model.InputRecord(
+            index,
+            str(record['educ']),
+            str(record['docc03']),
+            data_model.LazyWageTuples(
+                list(map(lambda x: float(x[0]), wages)),
+                list(map(lambda x: float(x[1]), wages))
+            ),
+            get_group_unemp(record),
+            float(record['wageCount']),
+            float(record['unempCount']),
+            str(record['wbhaom']),
+            data_model.parse_female(record['female']),
+            str(record['region']),
+            str(record['age']),
+            str(record['hoursuint']),
+            str(record['citistat'])
+        )
+
+    has_records = filter(lambda x: x['unempCount'] > 0, agg.values())
+    return data_model.Dataset(itertools.starmap(make_record, enumerate(has_records)))
+
+
+def collapse_agg(agg: typing.Dict, dimension: str, label: str) -> typing.Dict:
+    """Merge groups produced by agg_data which differ only in one dimension.
+
+    Args:
+        agg: The aggregate produced by agg_data.
+        dimension: The name of the dimension like docc03 to collapse.
+        label: The value to report for the collapsed dimension like "All
+            occupations".
+    Returns:
+        New aggregate in the same format as agg_data where groups differing
+        only in the given dimension are combined.
+    """
+    collapsed = {}
+
+    for record in agg.values():
+        merged_record = dict(record)
+        merged_record[dimension] = label
+        key = get_key(merged_record)
+
+        if key not in collapsed:
+            merged_record['wageotc'] = []
+            merged_record['unemp'] = []
+            merged_record['wageCount'] = 0
+            merged_record['unempCount'] = 0
+            collapsed[key] = merged_record
+
+        target = collapsed[key]
+        target['wageotc'].extend(record['wageotc'])
+        target['unemp'].extend(record['unemp'])
+        target['wageCount'] += record['wageCount']
+        target['unempCount'] += record['unempCount']
+
+    return collapsed
+
+
+def prune_agg(agg: typing.Dict, min_share: float,
+    rollup_dimensions: typing.List[str] = ROLLUP_DIMENSIONS) -> typing.Dict:
+    """Merge small groups into coarser groups until large enough.
+
+    Groups whose unemployment count (total weight) is below the threshold are
+    collapsed across the first rollup dimension, labeled as in ROLLUP_LABELS.
+    Merged groups still below the threshold are collapsed across the next
+    dimension and so on, continuing through RESIDUAL_DIMENSIONS after the
+    requested dimensions. Groups still below the threshold at that point are
+    kept anyway such that no weight is dropped. Unless docc03 is rolled up,
+    these residual groups differ only by occupation and gender.
+
+    Args:
+        agg: The aggregate produced by agg_data.
+        min_share: The minimum size of a group as a share (0 - 1) of the total
+            weight of all groups like 0.00025.
+        rollup_dimensions: The dimensions to collapse in order. Each must be in
+            ROLLUP_LABELS. Defaults to ROLLUP_DIMENSIONS.
+    Returns:
+        New aggregate in the same format as agg_data with the same total
+        weight.
+    """
+    for dimension in rollup_dimensions:
+        if dimension not in ROLLUP_LABELS:
+            raise RuntimeError('Cannot roll up dimension: %s' % dimension)
+
+    total_weight = sum(map(lambda x: x['unempCount'], agg.values()))
+    min_weight = min_share * total_weight
+
+    def is_large(record: typing.Dict) -> bool:
+        return record['unempCount'] >= min_weight
+
+    residual_dimensions = filter(
+        lambda x: x not in rollup_dimensions,
+        RESIDUAL_DIMENSIONS
+    )
+
+    pruned = dict(filter(lambda x: is_large(x[1]), agg.items()))
+    pending = dict(filter(lambda x: not is_large(x[1]), agg.items()))
+
+    for dimension in itertools.chain(rollup_dimensions, residual_dimensions):
+        collapsed = collapse_agg(pending, dimension, ROLLUP_LABELS[dimension])
+        pruned.update(filter(lambda x: is_large(x[1]), collapsed.items()))
+        pending = dict(filter(lambda x: not is_large(x[1]), collapsed.items()))
+
+    pruned.update(pending)
+    return pruned
+
+
+def make_output_frame(rows: typing.List[typing.Dict]) -> pandas.DataFrame:
+    """Create the data frame written for a list of summarized groups.
+
+    Args:
+        rows: The groups as returned by summarize_agg.
+    Returns:
+        Data frame with an index column named index.
+    """
+    import pandas
+
+    output_frame = pandas.DataFrame(rows)
+    output_frame.index.name = 'index'
+    return output_frame
+
+
+def get_shard_filename(value: str, taken: typing.Collection[str] = ()) -> str:
+    """Get the name of the file in which a partition should be written.
+
+    Args:
+        value: The value of the partition dimension like an occupation.
+        taken: Filenames already used by other values. If the value would slug
+            to one of these (or to nothing), a short hash of the value is added.
+    Returns:
+        Filename using only lowercase letters, numbers, and underscores.
+    """
+    slug = re.sub('[^a-z0-9]+', '_', str(value).lower()).strip('_')
+
+    if slug == '' or slug + '.csv' in taken:
+        digest = hashlib.sha256(str(value).encode('utf-8')).hexdigest()[:8]
+        slug = (slug + '_' + digest).strip('_')
+
+    return slug + '.csv'
+
+
+def get_weighted_median(wages: typing.List[typing.Tuple]) -> float:
+    """Find the smallest wage at which cumulative weight reaches half the total.
+
+    Args:
+        wages: The (wage, weight) tuples of a group sorted by wage.
+    Returns:
+        The weighted median wage as data_model.Dataset.get_wageotc finds it.
+    """
+    mid_count = sum(map(lambda x: x[1], wages)) / 2
+
+    weight_acc = 0
+    for wage, weight in wages:
+        if weight_acc + weight >= mid_count:
+            return wage
+        weight_acc += weight
+
+    raise RuntimeError('Unable to get median wage.')
+
+
+def summarize_overview(agg: typing.Dict, dimension: str = 'docc03') -> typing.List[typing.Dict]:
+    """Summarize the whole population and each value of the other dimensions.
+
+    Rather than groups, the overview has one row for everyone across the
+    partition dimension (labeled like All occupations) and one row for each
+    value of every other label column with all remaining dimensions collapsed.
+    Each row has precomputed statistics instead of wage tuples.
+
+    Args:
+        agg: The aggregate produced by agg_data.
+        dimension: The partition dimension. Defaults to docc03.
+    Returns:
+        Rows each with the dimension and value described along with
+        wageMedian, unemp, wageCount, and unempCount.
+    """
+    records = list(filter(lambda x: x['unempCount'] > 0, agg.values()))
+
+    def summarize_margin(margin_dimension: str, value: str,
+        margin_records: typing.List[typing.Dict]) -> typing.Dict:
+        wages = sorted(
+            itertools.chain(*map(lambda x: x['wageotc'], margin_records)),
+            key=lambda x: x[0]
+        )
+        wage_count = sum(map(lambda x: x['wageCount'], margin_records))
+        unemp_count = sum(map(lambda x: x['unempCount'], margin_records))
+        unemp_total = sum(itertools.chain(*map(lambda x: x['unemp'], margin_records)))
+
+        return {
+            'dimension': margin_dimension,
+            'value': value,
+            'wageMedian': get_weighted_median(wages) if wage_count > 0 else 0,
+            'unemp': unemp_total / unemp_count * 100,
+            'wageCount': wage_count,
+            'unempCount': unemp_count
+        }
+
+    total_label = ALL_OCCUPATIONS_LABEL if dimension == 'docc03' else 'All'
+    rows = [summarize_margin(dimension, total_label, records)]
+
+    other_dimensions = filter(lambda x: x != dimension, LABEL_COLUMNS)
+    for margin_dimension in other_dimensions:
+        by_value: typing.Dict = {}
+        for record in records:
+            value = str(record[margin_dimension])
+            by_value.setdefault(value, []).append(record)
+
+        for value in sorted(by_value.keys()):
+            rows.append(summarize_margin(margin_dimension, value, by_value[value]))
+
+    return rows
+
+
+def write_partitioned(output_frame: pandas.DataFrame, overview_frame: pandas.DataFrame,
+    directory: str, dimension: str = 'docc03'):
+    """Write output split into shards with a manifest describing them.
+
+    Writes a small overview file containing groups collapsed across the
+    partition dimension along with one shard per value of that dimension so that
+    clients can fetch only the subset of the data required for a view. The
+    overview has statistics for the whole population and each value of the
+    other dimensions as described in summarize_overview. The shards
+    concatenated together are equivalent to the full output. Values
+    whose filenames would collide are given a short hash suffix.
+
+    Args:
+        output_frame: Data frame of the summarized groups as returned by
+            make_output_frame.
+        overview_frame: Data frame of the rows returned by
+            summarize_overview.
+        directory: The directory in which to write the manifest and shards.
+        dimension: The name of the dimension on which to partition. Defaults to
+            docc03.
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    overview_frame.to_csv(os.path.join(directory, OVERVIEW_FILENAME))
+
+    shards = {}
+    filenames = set()
+    for value, shard_frame in output_frame.groupby(dimension, sort=True):
+        filename = get_shard_filename(value, filenames)
+        filenames.add(filename)
+        shard_frame.to_csv(os.path.join(directory, filename))
+        shards[str(value)] = {
+            'file': filename,
+            'rows': len(shard_frame.index),
+            'wageCount': float(shard_frame['wageCount'].sum()),
+            'unempCount': float(shard_frame['unempCount'].sum())
+        }
+
+    manifest = {
+        'dimension': dimension,
+        'columns': ['index'] + list(output_frame.columns),
+        'overview': OVERVIEW_FILENAME,
+        'overviewColumns': ['index'] + list(overview_frame.columns),
+        'shards': shards
+    }
+
+    with open(os.path.join(directory, MANIFEST_FILENAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def encode_compact(rows: typing.List[typing.Dict]) -> typing.Dict:
+    """Dictionary encode summarized groups.
+
+    Labels are stored once per column and rows refer to them by integer code.
+    Wage tuples are flattened to alternating wage and weight numbers with
+    wages rounded to cents and weights to WEIGHT_DECIMALS places.
+
+    Args:
+        rows: The groups as returned by summarize_agg.
+    Returns:
+        JSON-serializable dictionary with columns, dictionaries, and rows.
+    """
+    dictionaries = {}
+    for column in LABEL_COLUMNS:
+        values = set(map(lambda x: str(x[column]), rows))
+        dictionaries[column] = sorted(values)
+
+    codes = {}
+    for column in LABEL_COLUMNS:
+        labels = dictionaries[column]
+        codes[column] = dict(map(lambda x: (x[1], x[0]), enumerate(labels)))
+
+    def encode_wages(wages_str: str) -> typing.List[float]:
+        flat = []
+        for tuple_str in wages_str.split(';'):
+            wage_str, weight_str = tuple_str.split(' ')
+            flat.append(round(float(wage_str), WAGE_DECIMALS))
+            flat.append(round(float(weight_str), WEIGHT_DECIMALS))
+        return flat
+
+    def encode_value(row: typing.Dict, column: str):
+        if column in codes:
+            return codes[column][str(row[column])]
+        elif column == 'wageotc':
+            return encode_wages(row[column])
+        elif column == 'unemp':
+            return round(row[column], UNEMP_DECIMALS)
+        else:
+            return round(row[column], WEIGHT_DECIMALS)
+
+    encoded_rows = map(
+        lambda row: [encode_value(row, x) for x in COMPACT_COLUMNS],
+        rows
+    )
+
+    return {
+        'columns': COMPACT_COLUMNS,
+        'dictionaries': dictionaries,
+        'rows': list(encoded_rows)
+    }
+
+
+def write_compact(rows: typing.List[typing.Dict], loc: str) -> typing.List[str]:
+    """Write dictionary encoded groups along with precompressed copies.
+
+    Writes a JSON file as described by encode_compact along with a gzip
+    sibling (loc + .gz) and, if the optional brotli module is installed, a
+    brotli sibling (loc + .br) so static file servers can skip compressing on
+    each request.
+
+    Args:
+        rows: The groups as returned by summarize_agg.
+        loc: The location at which to write the uncompressed JSON.
+    Returns:
+        List of paths written.
+    """
+    encoded = encode_compact(rows)
+    payload = json.dumps(encoded, separators=(',', ':')).encode('utf-8')
+
+    with open(loc, 'wb') as f:
+        f.write(payload)
+
+    with open(loc + '.gz', 'wb') as f:
+        f.write(gzip.compress(payload, compresslevel=9))
+
+    written = [loc, loc + '.gz']
+
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+
+    if brotli:
+        with open(loc + '.br', 'wb') as f:
+            f.write(brotli.compress(payload))
+        written.append(loc + '.br')
+
+    return written
+
+
 def find_download_url(url: str = EPI_MICRODATA_LOC) -> str:
     """Find the URL where the CPS zip file can be found.
 
@@ -248,6 +1205,9 @@ def find_download_url(url: str = EPI_MICRODATA_LOC) -> str:
     Returns:
         Path to CPS zip file.
     """
+    import bs4
+    import requests
+
     source = requests.get(url).text
     soup = bs4.BeautifulSoup(source, features="html.parser")
 
@@ -268,77 +1228,190 @@ def find_download_url(url: str = EPI_MICRODATA_LOC) -> str:
     return download_url
 
 
-def download_to_tmp(url: str, output_file: str) -> str:
-    """Download a file to local. If file already exists, skips.
+def find_matching_members(names: typing.Iterable[str], start_year: int,
+    end_year: int) -> typing.List[str]:
+    """Find the Stata files within an archive for a range of years.
+
+    Args:
+        names: The names of the members of the archive.
+        start_year: The first year inclusive to include.
+        end_year: The last year inclusive to include.
+    Returns:
+        Names of the .dta members whose filename contains a matching year.
+    """
+    years_range = range(start_year, end_year+1)
+    years = set(map(lambda x: str(x), years_range))
+    def in_matching_year(name: str) -> bool:
+        filename = os.path.basename(name)
+        years_found = filter(lambda x: x in filename, years)
+        num_found = sum(map(lambda x: 1, years_found))
+        return num_found > 0
+
+    dta_members = filter(lambda x: x.endswith('.dta'), names)
+    matching_members = filter(in_matching_year, dta_members)
+    return sorted(matching_members)
+
+
+def is_unsafe_member(name: str) -> bool:
+    """Determine if an archive member name could point outside a directory.
 
     Args:
-        output_file: Where to write the file.
+        name: The name of the member within the archive.
     Returns:
-        Path to file where downloaded.
+        True if the name is absolute (including a drive letter) or has a
+        parent directory component and False otherwise.
     """
-    if os.path.exists(output_file):
-        return output_file
+    normalized = name.replace('\\', '/')
+    is_absolute = normalized.startswith('/') or ':' in normalized.split('/')[0]
+    return is_absolute or '..' in normalized.split('/')
+
+
+def extract_members(zip_loc: str, start_year: int, end_year: int,
+    directory: str) -> typing.List[str]:
+    """Extract only the Stata files needed for a range of years.
+
+    Members are written flat into the directory and are skipped if a file of the
+    same name and size was already extracted. Raises a RuntimeError without
+    extracting anything if a needed member has an absolute path or a parent
+    directory (..) component.
+
+    Args:
+        zip_loc: The path to the zip archive.
+        start_year: The first year inclusive to include.
+        end_year: The last year inclusive to include.
+        directory: The directory to where the files should be extracted.
+    Returns:
+        Paths to the extracted files.
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    paths = []
+    with zipfile.ZipFile(zip_loc) as archive:
+        names = find_matching_members(archive.namelist(), start_year, end_year)
+
+        unsafe_names = list(filter(is_unsafe_member, names))
+        if len(unsafe_names) > 0:
+            raise RuntimeError('Unsafe member path: %s' % unsafe_names[0])
 
-    with requests.get(url, stream=True) as inbound:
-        with open(output_file, 'wb') as outbound:
-            shutil.copyfileobj(inbound.raw, outbound)
+        for name in names:
+            info = archive.getinfo(name)
+            path = os.path.join(directory, os.path.basename(name))
 
-    return output_file
+            already_extracted = os.path.exists(path) and \
+                os.path.getsize(path) == info.file_size
+            if not already_extracted:
+                with archive.open(info) as inbound:
+                    with open(path, 'wb') as outbound:
+                        shutil.copyfileobj(inbound, outbound)
 
+            paths.append(path)
 
-def download_data(start_year: int, end_year: int, zip_file_loc: str = '/tmp/epi_microdata.zip',
-    directory: str = '/tmp/epi_microdata') -> typing.List[str]:
-    """Download latest EPI microdata and extract in /tmp directory.
+    return paths
+
+
+def list_members(zip_loc: str, start_year: int, end_year: int) -> typing.List[zipfile.Path]:
+    """Refer to the Stata files needed for a range of years without extracting.
+
+    Args:
+        zip_loc: The path to the zip archive.
+        start_year: The first year inclusive to include.
+        end_year: The last year inclusive to include.
+    Returns:
+        Paths within the archive which load_data can read directly.
+    """
+    with zipfile.ZipFile(zip_loc) as archive:
+        names = archive.namelist()
+
+    matching = find_matching_members(names, start_year, end_year)
+    return list(map(lambda x: zipfile.Path(zip_loc, at=x), matching))
+
+
+def download_data(start_year: int, end_year: int, cache_dir: str = DOWNLOAD_CACHE_DIR,
+    directory: typing.Optional[str] = '/tmp/epi_microdata') -> typing.List:
+    """Download latest EPI microdata and extract needed years in /tmp directory.
 
     Args:
         start_year: The first year inclusive to include in the data reported to
             the rest of the script.
         end_year: The last year inclusive to include in the data reported to the
             rest of the script.
-        zip_file_loc: The location to where the zip file should be written.
-        directory: The directory to where the files should be extracted. If not
-            given, uses default.
+        cache_dir: The directory in which the zip file should be cached. The
+            cached copy is reused if the server reports it is unchanged.
+        directory: The directory to where the files should be extracted. If
+            None, files are read directly from the archive without extracting.
+            If not given, uses default.
     Returns:
         Path to input files for the rest of the script.
     """
+    import download_cache
+
     target_url = find_download_url()
-    actual_zip_loc = download_to_tmp(target_url, zip_file_loc)
+    actual_zip_loc = download_cache.DownloadCache(cache_dir).fetch(target_url)
 
-    if not os.path.exists(directory):
-        os.makedirs(directory)
+    if directory is None:
+        return list_members(actual_zip_loc, start_year, end_year)
+    else:
+        return extract_members(actual_zip_loc, start_year, end_year, directory)
 
-    shutil.unpack_archive(actual_zip_loc, directory)
 
-    years_range = range(start_year, end_year+1)
-    years = set(map(lambda x: str(x), years_range))
-    def in_matching_year(filename: str) -> bool:
-        years_found = filter(lambda x: x in filename, years)
-        num_found = sum(map(lambda x: 1, years_found))
-        return num_found > 0
+def write_pickle(target, loc: str):
+    """Persist an intermediate result so that later commands can resume from it.
 
-    files_available = os.listdir(directory)
-    dta_files = filter(lambda x: '.dta' in x, files_available)
-    matching_files = filter(in_matching_year, dta_files)
-    full_path_files = map(lambda x: os.path.join(directory, x), matching_files)
-    return list(full_path_files)
+    Args:
+        target: The object to persist like a data frame or aggregate.
+        loc: The location at which to write the file.
+    """
+    with open(loc, 'wb') as f:
+        pickle.dump(target, f, protocol=pickle.HIGHEST_PROTOCOL)
 
 
-def main():
-    """Run the summarization script using CLI arguments."""
-    if len(sys.argv) != NUM_ARGS + 1:
-        print(USAGE_STR)
-        return
+def read_pickle(loc: str):
+    """Read an intermediate result written by write_pickle.
 
-    input_loc = sys.argv[1]
-    start_year = int(sys.argv[2])
-    start_month = int(sys.argv[3])
-    end_year = int(sys.argv[4])
-    end_month = int(sys.argv[5])
-    output_loc = sys.argv[6]
+    Args:
+        loc: The location of the file.
+    Returns:
+        The persisted object.
+    """
+    with open(loc, 'rb') as f:
+        return pickle.load(f)
 
+
+def run_download(start_year: int, end_year: int, directory: str) -> typing.List[str]:
+    """Download microdata and extract the needed years.
+
+    Args:
+        start_year: The first year inclusive to include.
+        end_year: The last year inclusive to include.
+        directory: The directory to where the files should be extracted.
+    Returns:
+        Paths to the extracted files.
+    """
+    return download_data(start_year, end_year, directory=directory)
+
+
+def run_load(input_loc: str, start_year: int, start_month: int, end_year: int,
+    end_month: int, keep_period: bool = False,
+    config_loc: typing.Optional[str] = None) -> pandas.DataFrame:
+    """Load microdata from a local file or, if input_loc is auto, from EPI.
+
+    Args:
+        input_loc: The dta file to load or auto to download from EPI.
+        start_year: Integer year for which to start filtering.
+        start_month: Integer month for which to start filtering.
+        end_year: Integer year for which to end filtering.
+        end_month: Integer month for which to end filtering.
+        keep_period: If True, keep the year and month of each response in a
+            period column.
+        config_loc: The pipeline configuration file as described in
+            read_config or None to use DEFAULT_CONFIG.
+    Returns:
+        Data frame as described in load_data.
+    """
     auto_load_data = input_loc == 'auto'
     if auto_load_data:
-        input_locs = download_data(start_year, end_year)
+        input_locs = download_data(start_year, end_year, directory=None)
     else:
         input_locs = [input_loc]
 
@@ -347,24 +1420,198 @@ def main():
         start_year,
         start_month,
         end_year,
-        end_month
+        end_month,
+        cache_dir=COLUMN_CACHE_DIR,
+        keep_period=keep_period,
+        config=read_config(config_loc)
     )
 
     if DUMP:
         loaded_data.to_csv('dump.csv')
 
-    aggregated_data = agg_data(loaded_data)
-    summarized = summarize_agg(aggregated_data)
+    return loaded_data
 
-    filtered = list(filter(
-        lambda x: x['docc03'] != 'Armed Forces' and str(x['docc03']) != 'nan',
-        summarized
-    ))
 
-    output_frame = pandas.DataFrame(filtered)
-    output_frame.index.name = 'index'
+def run_export(aggregated_data: typing.Dict, output_loc: str, partition_dir: str = 'none',
+    compact_loc: typing.Optional[str] = None):
+    """Summarize an aggregate and write the outputs.
+
+    Args:
+        aggregated_data: The aggregate produced by agg_data.
+        output_loc: The location at which to write the output CSV.
+        partition_dir: The directory in which to write a partitioned copy of
+            the output or none to skip.
+        compact_loc: The location at which to write the dictionary encoded
+            output or None (or none) to skip.
+    """
+    summarized = summarize_agg(aggregated_data)
+
+    output_frame = make_output_frame(summarized)
     output_frame.to_csv(output_loc)
 
+    if partition_dir != 'none':
+        overview_frame = make_output_frame(summarize_overview(aggregated_data))
+        write_partitioned(output_frame, overview_frame, partition_dir)
+
+    if compact_loc and compact_loc != 'none':
+        write_compact(summarized, compact_loc)
+
+
+def parse_load_args(args: typing.List[str]) -> typing.Tuple:
+    """Parse the arguments shared by the load and run commands.
+
+    Args:
+        args: The input location, start year, start month, end year, and end
+            month as strings.
+    Returns:
+        Tuple of input location followed by integer years and months.
+    """
+    return (
+        args[0],
+        int(args[1]),
+        int(args[2]),
+        int(args[3]),
+        int(args[4])
+    )
+
+
+def parse_dedupe_arg(value: str) -> typing.Tuple[bool, typing.Optional[int]]:
+    """Parse the optional wage deduplication argument of the aggregate command.
+
+    Args:
+        value: None to skip deduplicating, exact to combine equal wages, or an
+            integer number of decimal places to which wages are rounded before
+            combining.
+    Returns:
+        Tuple of dedupe and wage_decimals as accepted by agg_data.
+    """
+    if value == 'none':
+        return (False, None)
+    elif value == 'exact':
+        return (True, None)
+    else:
+        return (True, int(value))
+
+
+def execute_command(command: str, args: typing.List[str]):
+    """Execute a single command.
+
+    Args:
+        command: The name of the command like aggregate.
+        args: The arguments following the command.
+    """
+    if command == 'download':
+        paths = run_download(int(args[0]), int(args[1]), args[2])
+        print('\n'.join(paths))
+    elif command == 'load':
+        config_loc = args[6] if len(args) > 6 else None
+        loaded_data = run_load(*parse_load_args(args), config_loc=config_loc)
+        write_pickle(loaded_data, args[5])
+    elif command == 'aggregate':
+        dedupe, wage_decimals = parse_dedupe_arg(args[2] if len(args) > 2 else 'none')
+        aggregated_data = agg_data(
+            read_pickle(args[0]),
+            dedupe=dedupe,
+            wage_decimals=wage_decimals
+        )
+        write_pickle(aggregated_data, args[1])
+    elif command == 'prune':
+        if len(args) > 3:
+            rollup_dimensions = args[3].split(',')
+        else:
+            rollup_dimensions = ROLLUP_DIMENSIONS
+        pruned = prune_agg(read_pickle(args[0]), float(args[2]), rollup_dimensions)
+        write_pickle(pruned, args[1])
+    elif command == 'export':
+        run_export(read_pickle(args[0]), *args[1:])
+    elif command == 'run':
+        config_loc = args[8] if len(args) > 8 else None
+        loaded_data = run_load(*parse_load_args(args), config_loc=config_loc)
+        aggregated_data = agg_data(loaded_data)
+        run_export(aggregated_data, *args[5:8])
+    elif command == 'views':
+        import views
+        views.write_views(summarize_agg(read_pickle(args[0])), args[1])
+    elif command == 'series':
+        config_loc = args[6] if len(args) > 6 else None
+        loaded_data = run_load(
+            *parse_load_args(args),
+            keep_period=True,
+            config_loc=config_loc
+        )
+        run_export(agg_data(loaded_data), args[5])
+    else:
+        raise RuntimeError('Unknown command: %s' % command)
+
+
+def get_num_args_range(command: str) -> typing.Tuple[int, int]:
+    """Determine how many arguments a command accepts.
+
+    Args:
+        command: The name of the command.
+    Returns:
+        Tuple of minimum and maximum number of arguments.
+    """
+    args_str = COMMAND_ARGS_STRS[command]
+    num_total = args_str.count('[')
+    num_optional = args_str.count('[optional')
+    return (num_total - num_optional, num_total)
+
+
+def are_args_parsable(command: str, args: typing.List[str]) -> bool:
+    """Determine if the numeric arguments of a command can be parsed.
+
+    Args:
+        command: The name of the command.
+        args: The arguments following the command.
+    Returns:
+        True if each argument given in COMMAND_NUMERIC_ARGS for the command
+        and the optional dedupe argument of aggregate can be parsed and False
+        otherwise.
+    """
+    parsers = COMMAND_NUMERIC_ARGS.get(command, {})
+    present = filter(lambda x: x[0] < len(args), parsers.items())
+
+    try:
+        for index, parser in present:
+            parser(args[index])
+
+        if command == 'aggregate' and len(args) > 2:
+            parse_dedupe_arg(args[2])
+    except ValueError:
+        return False
+
+    return True
+
+
+def main():
+    """Run the summarization script using CLI arguments."""
+    if len(sys.argv) < 2:
+        print(USAGE_STR)
+        return
+
+    if sys.argv[1] in COMMAND_ARGS_STRS:
+        command = sys.argv[1]
+        args = sys.argv[2:]
+    else:
+        command = 'run'
+        args = sys.argv[1:]
+
+    min_args, max_args = get_num_args_range(command)
+    if len(args) < min_args or len(args) > max_args:
+        print(USAGE_STR)
+        return
+
+    if not are_args_parsable(command, args):
+        print(USAGE_STR)
+        return
+
+    execute_command(command, args)
+
+    peak_memory = get_peak_memory_mb()
+    if peak_memory is not None:
+        print('Peak memory: %.1f MB' % peak_memory, file=sys.stderr)
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,405 @@
+"""Small asyncio HTTP server answering queries against preprocessed EPI data.
+
+The dataset is loaded once at startup and shared by all connections. Filters
+are provided as URL parameters named after the Query dimensions like
+/query?educ=College&region=West and statistics are returned as JSON. Repeated
+parameters like educ=College&educ=Advanced match any of the values and values
+like age=25-35 yr..45-55 yr match an inclusive range.
+
+Author: A Samuel Pottinger
+License: MIT License
+"""
+import asyncio
+import collections
+import gzip
+import json
+import sys
+import time
+import traceback
+import urllib.parse
+
+import data_model
+
+USAGE_STR = 'python query_server.py [csv loc] [port]'
+NUM_ARGS = 2
+DEFAULT_HOST = '0.0.0.0'
+MAX_LATENCY_SAMPLES = 10000
+MIN_COMPRESS_SIZE = 512
+RANGE_SEPARATOR = '..'
+PERCENTILES = [50, 90, 99]
+DIMENSIONS = [
+    'educ',
+    'docc03',
+    'wbhaom',
+    'female',
+    'region',
+    'age',
+    'hoursuint',
+    'citistat'
+]
+STATUS_TEXT = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    500: 'Internal Server Error'
+}
+FEMALE_VALUES = {'Female': True, 'Male': False}
+ROUTES = ['/query', '/metrics']
+OTHER_ROUTE = 'other'
+
+
+class LatencyRecorder:
+    """Rolling record of request latencies by route."""
+
+    def __init__(self, max_samples=MAX_LATENCY_SAMPLES):
+        """Create a new recorder with no samples.
+
+        Args:
+            max_samples (int): The maximum number of recent samples to retain
+                per route. Older samples are discarded first.
+        """
+        self._max_samples = max_samples
+        self._samples = {}
+        self._counts = collections.Counter()
+
+    def record(self, route, duration):
+        """Record the latency of a single request.
+
+        Paths other than those in ROUTES share the OTHER_ROUTE bucket such that
+        arbitrary URLs do not each add a route.
+
+        Args:
+            route (str): The path requested like /query.
+            duration (float): The time taken to respond in seconds.
+        """
+        if route not in ROUTES:
+            route = OTHER_ROUTE
+
+        if route not in self._samples:
+            self._samples[route] = collections.deque(maxlen=self._max_samples)
+
+        self._samples[route].append(duration)
+        self._counts[route] += 1
+
+    def get_summary(self):
+        """Summarize latencies observed so far.
+
+        Returns:
+            dict: Mapping from route to dictionary with count and percentile
+                latencies in milliseconds (p50, p90, p99) over recent samples.
+        """
+        def summarize(route):
+            samples = sorted(self._samples[route])
+            num_samples = len(samples)
+
+            def get_percentile(percentile):
+                position = int(num_samples * percentile / 100)
+                index = min(num_samples - 1, position)
+                return samples[index] * 1000
+
+            summary = {'count': self._counts[route]}
+            for percentile in PERCENTILES:
+                summary['p%d' % percentile] = get_percentile(percentile)
+
+            return summary
+
+        return dict(map(lambda x: (x, summarize(x)), self._samples.keys()))
+
+
+class QueryServer:
+    """HTTP server exposing a Dataset through JSON endpoints."""
+
+    def __init__(self, dataset):
+        """Create a new server around an already loaded dataset.
+
+        Args:
+            dataset (data_model.Dataset): The dataset to query.
+        """
+        self._dataset = dataset
+        self._latencies = LatencyRecorder()
+
+    def get_latencies(self):
+        """Get the latency recorder used by this server.
+
+        Returns:
+            LatencyRecorder: Recorder tracking response times by route.
+        """
+        return self._latencies
+
+    async def serve(self, host, port):
+        """Listen for connections until cancelled.
+
+        Args:
+            host (str): The interface on which to listen.
+            port (int): The port on which to listen.
+        """
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        """Respond to requests on a connection, keeping it alive if requested.
+
+        Args:
+            reader (asyncio.StreamReader): Stream from the client.
+            writer (asyncio.StreamWriter): Stream to the client.
+        """
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    request_line = await reader.readline()
+                    if not request_line.strip():
+                        break
+
+                    headers = await self._read_headers(reader)
+                except ValueError:
+                    error_body = {'error': 'Request line or header too long.'}
+                    self._write_response(writer, 400, error_body, {}, False)
+                    await writer.drain()
+                    break
+
+                start = time.perf_counter()
+
+                pieces = request_line.decode('latin-1').split()
+                if len(pieces) != 3:
+                    error_body = {'error': 'Malformed request line.'}
+                    self._write_response(writer, 400, error_body, headers, False)
+                    await writer.drain()
+                    break
+
+                method, target, version = pieces
+                keep_alive = self._get_keep_alive(version, headers)
+
+                try:
+                    route, status, body = await self._respond(method, target)
+                except Exception:
+                    traceback.print_exc()
+                    route = target.split('?', 1)[0]
+                    status = 500
+                    body = {'error': 'Internal server error.'}
+
+                self._write_response(writer, status, body, headers, keep_alive)
+                await writer.drain()
+                self._latencies.record(route, time.perf_counter() - start)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_headers(self, reader):
+        """Read request headers up to the blank line ending them.
+
+        Args:
+            reader (asyncio.StreamReader): Stream from the client.
+
+        Returns:
+            dict: Mapping from lowercase header name to value.
+        """
+        headers = {}
+
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                return headers
+
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+    def _get_keep_alive(self, version, headers):
+        """Determine if a connection should stay open after a response.
+
+        Args:
+            version (str): The HTTP version given in the request line.
+            headers (dict): The request headers.
+
+        Returns:
+            bool: True if the connection should be reused and False otherwise.
+        """
+        connection = headers.get('connection', '').lower()
+        if version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        else:
+            return connection != 'close'
+
+    async def _respond(self, method, target):
+        """Build the response for a request.
+
+        Args:
+            method (str): The HTTP method like GET.
+            target (str): The path and query string requested.
+
+        Returns:
+            tuple: The route, integer status code, and JSON-serializable body.
+        """
+        parsed = urllib.parse.urlsplit(target)
+        route = parsed.path
+
+        if method != 'GET':
+            return (route, 405, {'error': 'Only GET is supported.'})
+
+        if route == '/query':
+            params = urllib.parse.parse_qs(parsed.query)
+            return (route,) + await self._respond_query(params)
+        elif route == '/metrics':
+            return (route, 200, self._latencies.get_summary())
+        else:
+            return (route, 404, {'error': 'Unknown route: %s' % route})
+
+    async def _respond_query(self, params):
+        """Run a query described by URL parameters.
+
+        Statistics are requested through Dataset.aquery such that queries from
+        concurrent connections are batched together. Errors other than
+        RuntimeError are raised to be reported as internal errors.
+
+        Args:
+            params (dict): Mapping from parameter name to list of values as
+                returned by urllib.parse.parse_qs.
+
+        Returns:
+            tuple: The integer status code and JSON-serializable body.
+        """
+        try:
+            query = build_query(params)
+        except ValueError as e:
+            return (400, {'error': str(e)})
+
+        results = await asyncio.gather(
+            self._dataset.aquery(query, 'get_size'),
+            self._dataset.aquery(query, 'get_wageotc'),
+            self._dataset.aquery(query, 'get_unemp'),
+            return_exceptions=True
+        )
+        size, wageotc, unemp = results
+
+        errors = list(filter(lambda x: isinstance(x, BaseException), results))
+        unexpected = list(filter(lambda x: not isinstance(x, RuntimeError), errors))
+        if len(unexpected) > 0:
+            raise unexpected[0]
+
+        if isinstance(size, RuntimeError):
+            return (400, {'error': str(size)})
+
+        if size == 0:
+            return (404, {'error': 'No records match the query.'})
+
+        if len(errors) > 0:
+            return (400, {'error': str(errors[0])})
+
+        return (200, {
+            'wageotc': wageotc,
+            'unemp': unemp,
+            'size': size
+        })
+
+    def _write_response(self, writer, status, body, headers, keep_alive):
+        """Serialize and write a JSON response, compressing when accepted.
+
+        Args:
+            writer (asyncio.StreamWriter): Stream to the client.
+            status (int): The HTTP status code.
+            body: JSON-serializable response body.
+            headers (dict): The request headers.
+            keep_alive (bool): True if the connection will be reused.
+        """
+        payload = json.dumps(body).encode('utf-8')
+        response_headers = [
+            ('Content-Type', 'application/json'),
+            ('Connection', 'keep-alive' if keep_alive else 'close')
+        ]
+
+        accepted = headers.get('accept-encoding', '')
+        if 'gzip' in accepted and len(payload) >= MIN_COMPRESS_SIZE:
+            payload = gzip.compress(payload)
+            response_headers.append(('Content-Encoding', 'gzip'))
+
+        response_headers.append(('Content-Length', str(len(payload))))
+
+        lines = ['HTTP/1.1 %d %s' % (status, STATUS_TEXT[status])]
+        lines.extend(map(lambda x: '%s: %s' % x, response_headers))
+        head = '\r\n'.join(lines) + '\r\n\r\n'
+
+        writer.write(head.encode('latin-1') + payload)
+
+
+def parse_value(name, value_str):
+    """Parse a single URL parameter value for a dimension.
+
+    Args:
+        name (str): The name of the dimension like age.
+        value_str (str): The value given in the URL. Values like
+            25-35 yr..45-55 yr describe an inclusive range.
+
+    Returns:
+        The value to provide to the Query setter.
+
+    Raises:
+        ValueError: Raised if female is given a value other than Female or
+            Male.
+    """
+    if name == 'female':
+        if value_str not in FEMALE_VALUES:
+            raise ValueError('Unknown value for female: %s' % value_str)
+        return FEMALE_VALUES[value_str]
+
+    if RANGE_SEPARATOR in value_str:
+        start, end = value_str.split(RANGE_SEPARATOR, 1)
+        return data_model.ValueRange(start, end)
+
+    return value_str
+
+
+def build_query(params):
+    """Build a Query from URL parameters.
+
+    Args:
+        params (dict): Mapping from dimension name (like educ) to list of
+            values as returned by urllib.parse.parse_qs. Repeating a parameter
+            matches any of its values.
+
+    Returns:
+        data_model.Query: Query with a filter set for each parameter.
+
+    Raises:
+        ValueError: Raised if a parameter is not a dimension, has an unknown
+            value for female, or combines a range with other values.
+    """
+    query = data_model.Query()
+
+    for name, values_strs in params.items():
+        if name not in DIMENSIONS:
+            raise ValueError('Unknown dimension: %s' % name)
+
+        values = list(map(lambda x: parse_value(name, x), values_strs))
+
+        if len(values) == 1:
+            value = values[0]
+        elif any(map(lambda x: isinstance(x, data_model.ValueRange), values)):
+            message = 'Cannot combine a range with other values: %s' % name
+            raise ValueError(message)
+        else:
+            value = set(values)
+
+        getattr(query, 'set_' + name)(value)
+
+    return query
+
+
+def main():
+    """Main entrypoint to the script."""
+    if len(sys.argv) != NUM_ARGS + 1:
+        print(USAGE_STR)
+        sys.exit(1)
+
+    loc = sys.argv[1]
+    port = int(sys.argv[2])
+
+    dataset = data_model.load_from_file(loc)
+    server = QueryServer(dataset)
+    asyncio.run(server.serve(DEFAULT_HOST, port))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,498 @@
+"""Dataset facade splitting records across worker processes.
+
+Records are partitioned by occupation (docc03) or by a hash of their group and
+each partition is held by a Dataset in its own process. Each worker streams the
+source file itself and parses only the rows of its shard so the full dataset
+is never held by the parent or decoded by every worker. Queries for a single occupation are sent only to
+the shard holding it while others are sent to every shard with partial results
+merged: sizes and unemployment counts are summed and wages are merged from
+per-shard summaries with one tuple per distinct wage so medians match a single
+Dataset.
+
+Author: A Samuel Pottinger
+License: MIT License
+"""
+import concurrent.futures
+import csv
+import zlib
+
+import data_model
+
+PARTITIONS = ['docc03', 'hash']
+
+_shard_dataset = None
+
+
+class ShardedDataset:
+    """Dataset answering queries by scatter-gather across worker processes."""
+
+    def __init__(self, loc, num_shards, partition='docc03'):
+        """Create a new sharded dataset, starting a process per shard.
+
+        Args:
+            loc (str): The location of the CSV file which each worker reads,
+                keeping only the records of its own shard.
+            num_shards (int): The number of worker processes.
+            partition (str): How records are assigned to shards: docc03 to keep
+                each occupation within a single shard or hash to spread records
+                by a hash of their group. Defaults to docc03.
+        """
+        if partition not in PARTITIONS:
+            raise RuntimeError('Unknown partition: %s' % partition)
+
+        if partition == 'docc03':
+            counts = count_occupations(loc)
+            self._shard_by_occupation = assign_occupations(counts, num_shards)
+        else:
+            self._shard_by_occupation = None
+
+        self._pools = list(map(
+            lambda x: concurrent.futures.ProcessPoolExecutor(
+                max_workers=1,
+                initializer=_set_shard_dataset,
+                initargs=(loc, x, num_shards, self._shard_by_occupation)
+            ),
+            range(num_shards)
+        ))
+
+        futures = list(map(lambda x: x.submit(_get_shard_summary), self._pools))
+        summaries = list(map(lambda x: x.result(), futures))
+
+        self._values_by_dimension = {}
+        for dimension in data_model.DIMENSION_GETTERS:
+            self._values_by_dimension[dimension] = set().union(
+                *map(lambda x: x['values'][dimension], summaries)
+            )
+
+        self._max_wage = max(filter(
+            lambda x: x is not None,
+            map(lambda x: x['maxWage'], summaries)
+        ))
+        self._max_unemployment = max(filter(
+            lambda x: x is not None,
+            map(lambda x: x['maxUnemployment'], summaries)
+        ))
+
+    def get_wageotc(self, query):
+        """Get median wage for a group with overtime, tips, and comissions.
+
+        Args:
+            query (Query): A Query object describing the population for which
+                the median wage should be returned.
+
+        Returns:
+            float: The estimated median wage for the given population in USD.
+        """
+        summaries = self._scatter('get_wage_summary', query)
+        return data_model.get_weighted_median(summaries)
+
+    def get_unemp(self, query):
+        """Get the overall unemployment rate for a group.
+
+        Args:
+            query (Query): A Query object describing the population for which
+                the unemployemnt rate should be returned.
+
+        Returns:
+            float: The estimated unemployment rate for the specified group as
+                a percentage between 0 and 100.
+        """
+        summaries = self._scatter('get_unemp_summary', query)
+        count = sum(map(lambda x: x[0], summaries))
+        weighted = sum(map(lambda x: x[1], summaries))
+
+        if count == 0:
+            raise RuntimeError('Unable to get unemployment.')
+
+        return weighted / count
+
+    def get_size(self, query):
+        """Get the size of a population as summed census weight.
+
+        Args:
+            query (Query): A Query object describing the population for which
+                the size should be returned.
+
+        Returns:
+            float: Estimated size of this population as a weight using the
+                wage count.
+        """
+        return sum(self._scatter('get_size', query))
+
+    def get_max_wage(self):
+        """Get the maximum wage value across all records in the dataset.
+
+        Returns:
+            float: The maximum hourly wage value in USD found in the dataset.
+        """
+        return self._max_wage
+
+    def get_max_unemployment(self):
+        """Get the maximum unemployment rate across all records in the dataset.
+
+        Returns:
+            float: The maximum unemployment rate as a percentage (0-100)
+                found in the dataset.
+        """
+        return self._max_unemployment
+
+    def get_educ_vals(self):
+        """Get all unique education level values in the dataset.
+
+        Returns:
+            list: Sorted list of education level labels.
+        """
+        return sorted(self._values_by_dimension['educ'])
+
+    def get_docc03_vals(self):
+        """Get all unique occupation classification values in the dataset.
+
+        Returns:
+            list: Sorted list of occupation classification labels.
+        """
+        return sorted(self._values_by_dimension['docc03'])
+
+    def get_wbhaom_vals(self):
+        """Get all unique race and ethnicity values in the dataset.
+
+        Returns:
+            list: Sorted list of race and ethnicity labels.
+        """
+        return sorted(self._values_by_dimension['wbhaom'])
+
+    def get_female_vals(self):
+        """Get all unique gender values in the dataset.
+
+        Returns:
+            list: Sorted list of gender values (typically [False, True]).
+        """
+        return sorted(self._values_by_dimension['female'])
+
+    def get_region_vals(self):
+        """Get all unique geographic region values in the dataset.
+
+        Returns:
+            list: Sorted list of region labels.
+        """
+        return sorted(self._values_by_dimension['region'])
+
+    def get_age_vals(self):
+        """Get all unique age group values in the dataset.
+
+        Returns:
+            list: Sorted list of age group labels.
+        """
+        return sorted(self._values_by_dimension['age'])
+
+    def get_hoursuint_vals(self):
+        """Get all unique hours worked category values in the dataset.
+
+        Returns:
+            list: Sorted list of hours worked category labels.
+        """
+        return sorted(self._values_by_dimension['hoursuint'])
+
+    def get_citistat_vals(self):
+        """Get all unique citizenship status values in the dataset.
+
+        Returns:
+            list: Sorted list of citizenship status labels.
+        """
+        return sorted(self._values_by_dimension['citistat'])
+
+    def get_num_shards(self):
+        """Get the number of worker processes.
+
+        Returns:
+            int: The number of shards.
+        """
+        return len(self._pools)
+
+    def get_shards_for_query(self, query):
+        """Determine which shards may hold records matching a query.
+
+        Args:
+            query (Query): A Query object describing the population.
+
+        Returns:
+            list of int: The IDs of shards to which the query is sent.
+        """
+        all_shards = list(range(len(self._pools)))
+
+        occupation_filter = query.get_docc03()
+        if self._shard_by_occupation is None or occupation_filter is None:
+            return all_shards
+
+        occupations = data_model.get_filter_values(
+            'docc03',
+            occupation_filter,
+            self._values_by_dimension['docc03']
+        )
+        shards = set(map(lambda x: self._shard_by_occupation[x], occupations))
+        return sorted(shards)
+
+    def close(self):
+        """Stop the worker processes."""
+        for pool in self._pools:
+            pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _scatter(self, method_name, query):
+        """Run a Dataset method on each shard which may match a query.
+
+        Args:
+            method_name (str): The name of the Dataset method like get_size.
+            query (Query): A Query object describing the population.
+
+        Returns:
+            list: The result from each shard queried.
+        """
+        local_query = self._resolve_query(query)
+        shard_ids = self.get_shards_for_query(local_query)
+
+        futures = list(map(
+            lambda x: self._pools[x].submit(
+                _run_on_shard,
+                method_name,
+                local_query
+            ),
+            shard_ids
+        ))
+        return list(map(lambda x: x.result(), futures))
+
+    def _resolve_query(self, query):
+        """Validate a query against all shards and make it safe to scatter.
+
+        A value present in one shard is often missing from another which
+        Dataset would report as an error. Each filter is checked against the
+        values of all shards and replaced with the set of values it matches so
+        that shards only need to consider values they hold.
+
+        Args:
+            query (Query): A Query object describing the population.
+
+        Returns:
+            Query: New query with each filter given as a set of values.
+        """
+        resolved = data_model.Query()
+
+        for dimension, getter in data_model.DIMENSION_GETTERS.items():
+            filter_value = getter(query)
+            if filter_value is None:
+                continue
+
+            values = data_model.get_filter_values(
+                dimension,
+                filter_value,
+                self._values_by_dimension[dimension]
+            )
+            getattr(resolved, 'set_' + dimension)(set(values))
+
+        return resolved
+
+
+def count_occupations(loc):
+    """Count the records of each occupation in a CSV file.
+
+    Only the docc03 column is kept while streaming through the file.
+
+    Args:
+        loc (str): The location of the CSV file.
+
+    Returns:
+        dict: Mapping from occupation to number of records.
+    """
+    counts = {}
+
+    with open(loc) as f:
+        for row in csv.DictReader(f):
+            occupation = str(row['docc03'])
+            counts[occupation] = counts.get(occupation, 0) + 1
+
+    return counts
+
+
+def assign_occupations(counts, num_shards):
+    """Assign occupations to shards balancing the number of records.
+
+    Args:
+        counts (dict): Mapping from occupation to number of records as
+            returned by count_occupations.
+        num_shards (int): The number of shards.
+
+    Returns:
+        dict: Mapping from occupation to shard ID.
+    """
+    shard_sizes = [0] * num_shards
+    shard_by_occupation = {}
+
+    by_size = sorted(counts.items(), key=lambda x: (-x[1], x[0]))
+    for occupation, count in by_size:
+        shard_id = shard_sizes.index(min(shard_sizes))
+        shard_by_occupation[occupation] = shard_id
+        shard_sizes[shard_id] += count
+
+    return shard_by_occupation
+
+
+def get_hash_shard(record, num_shards):
+    """Choose a shard for a record from a stable hash of its group.
+
+    Args:
+        record (InputRecord): The record to place.
+        num_shards (int): The number of shards.
+
+    Returns:
+        int: The shard ID.
+    """
+    values = map(lambda x: x(record), data_model.DIMENSION_GETTERS.values())
+    return get_values_hash_shard(values, num_shards)
+
+
+def get_values_hash_shard(values, num_shards):
+    """Choose a shard from a stable hash of the dimension values of a group.
+
+    Args:
+        values (iterable): The value of each dimension in the order of
+            data_model.DIMENSION_GETTERS with female as a bool.
+        num_shards (int): The number of shards.
+
+    Returns:
+        int: The shard ID.
+    """
+    key = '\t'.join(map(str, values)).encode('utf-8')
+    return zlib.crc32(key) % num_shards
+
+
+def load_sharded_from_file(loc, num_shards, partition='docc03'):
+    """Load a sharded dataset from a CSV file.
+
+    Args:
+        loc (str): The location of the CSV file.
+        num_shards (int): The number of worker processes.
+        partition (str): Either docc03 or hash as described in ShardedDataset.
+            Defaults to docc03.
+
+    Returns:
+        ShardedDataset: Dataset with records spread across workers.
+    """
+    return ShardedDataset(loc, num_shards, partition)
+
+
+def get_shard(record, num_shards, shard_by_occupation):
+    """Determine the shard holding a record.
+
+    Args:
+        record (InputRecord): The record to place.
+        num_shards (int): The number of shards.
+        shard_by_occupation (dict): Mapping from occupation to shard ID or None
+            if partitioning by hash.
+
+    Returns:
+        int: The shard ID.
+    """
+    if shard_by_occupation is None:
+        return get_hash_shard(record, num_shards)
+    else:
+        return shard_by_occupation[record.get_docc03()]
+
+
+def get_row_shard(row, num_shards, shard_by_occupation):
+    """Determine the shard holding a CSV row without parsing its wages.
+
+    Args:
+        row (dict): The row as read by csv.DictReader.
+        num_shards (int): The number of shards.
+        shard_by_occupation (dict): Mapping from occupation to shard ID or None
+            if partitioning by hash.
+
+    Returns:
+        int: The shard ID, matching get_shard for the parsed record.
+    """
+    if shard_by_occupation is None:
+        def get_value(dimension):
+            if dimension == 'female':
+                return data_model.parse_female(str(row['female']))
+            else:
+                return str(row[dimension])
+
+        values = map(get_value, data_model.DIMENSION_GETTERS.keys())
+        return get_values_hash_shard(values, num_shards)
+    else:
+        return shard_by_occupation[str(row['docc03'])]
+
+
+def _set_shard_dataset(loc, shard_id, num_shards, shard_by_occupation):
+    """Build the Dataset for a worker process from its share of a file.
+
+    Rows are streamed and assigned to shards from their dimension columns such
+    that only the rows of this worker's shard are parsed into records.
+
+    Args:
+        loc (str): The location of the CSV file.
+        shard_id (int): The ID of this worker's shard.
+        num_shards (int): The number of shards.
+        shard_by_occupation (dict): Mapping from occupation to shard ID or None
+            if partitioning by hash.
+    """
+    global _shard_dataset
+
+    with open(loc) as f:
+        rows = filter(
+            lambda x: get_row_shard(x, num_shards, shard_by_occupation) == shard_id,
+            csv.DictReader(f)
+        )
+        _shard_dataset = data_model.Dataset(map(data_model.parse_record, rows))
+
+
+def _get_shard_summary():
+    """Describe the records held by a worker for the parent to combine.
+
+    Returns:
+        dict: The set of values for each dimension under values along with
+            maxWage and maxUnemployment which are None if the shard has no
+            wages or no records respectively.
+    """
+    values = {}
+    for dimension in data_model.DIMENSION_GETTERS:
+        values[dimension] = set(getattr(_shard_dataset, 'get_%s_vals' % dimension)())
+
+    def get_max(getter):
+        try:
+            return getter()
+        except ValueError:
+            return None
+
+    return {
+        'values': values,
+        'maxWage': get_max(_shard_dataset.get_max_wage),
+        'maxUnemployment': get_max(_shard_dataset.get_max_unemployment)
+    }
+
+
+def _run_on_shard(method_name, query):
+    """Run a Dataset method in a worker, ignoring values the shard lacks.
+
+    Args:
+        method_name (str): The name of the Dataset method like get_size.
+        query (Query): Query with each filter given as a set of values.
+
+    Returns:
+        The result of the method.
+    """
+    local_query = data_model.Query()
+
+    for dimension, getter in data_model.DIMENSION_GETTERS.items():
+        values = getter(query)
+        if values is None:
+            continue
+
+        available = set(getattr(_shard_dataset, 'get_%s_vals' % dimension)())
+        getattr(local_query, 'set_' + dimension)(values & available)
+
+    return getattr(_shard_dataset, method_name)(local_query)
@@ -0,0 +1,105 @@
+"""Tests for bootstrap confidence intervals.
+
+Author: A Samuel Pottinger
+License: MIT License
+"""
+import unittest
+
+import bootstrap
+import data_model
+
+from test_data_model import make_rows
+
+
+def make_snapshot(rows):
+    return data_model.load_from_rows(rows).snapshot()
+
+
+class IntervalTests(unittest.TestCase):
+
+    def setUp(self):
+        self._rows = make_rows(300)
+        self._snapshot = make_snapshot(self._rows)
+
+    def test_wage_interval(self):
+        query = data_model.Query()
+        query.set_educ('College')
+
+        low, high = bootstrap.get_interval(self._snapshot, query, seed=1)
+        median = self._snapshot.get_wageotc(query)
+        self.assertLessEqual(low, median)
+        self.assertGreaterEqual(high, median)
+        self.assertLess(low, high)
+
+    def test_unemp_interval(self):
+        query = data_model.Query()
+        query.set_educ('College')
+
+        low, high = bootstrap.get_interval(self._snapshot, query, 'get_unemp', seed=1)
+        unemp = self._snapshot.get_unemp(query)
+        self.assertLessEqual(low, unemp)
+        self.assertGreaterEqual(high, unemp)
+        self.assertLess(low, high)
+
+    def test_reproducible(self):
+        query = data_model.Query()
+        first = bootstrap.get_interval(self._snapshot, query, 'get_unemp', seed=3)
+        second = bootstrap.get_interval(self._snapshot, query, 'get_unemp', seed=3)
+        self.assertEqual(first, second)
+
+    def test_single_group_refused(self):
+        rows = make_rows(1)
+        rows[0]['wageotc'] = [(20.0, 1.0), (30.0, 1.0)]
+        snapshot = make_snapshot(rows)
+
+        with self.assertRaises(RuntimeError):
+            bootstrap.get_interval(snapshot, data_model.Query(), 'get_unemp', seed=1)
+
+        with self.assertRaises(RuntimeError):
+            bootstrap.get_interval(snapshot, data_model.Query(), 'get_wageotc', seed=1)
+
+    def test_zero_weight_group_refused(self):
+        rows = make_rows(20)
+        for row in rows:
+            row['wageotc'] = [(20.0, 0.0), (30.0, 0.0)]
+            row['wageCount'] = 0.0
+            row['unempCount'] = 0.0
+        snapshot = make_snapshot(rows)
+
+        for statistic in bootstrap.STATISTICS:
+            with self.assertRaises(RuntimeError):
+                bootstrap.get_interval(snapshot, data_model.Query(), statistic, seed=1)
+
+    def test_empty_group_refused(self):
+        query = data_model.Query()
+        query.set_educ('College')
+        query.set_region('North')
+        rows = make_rows(20)
+        rows[0]['region'] = 'North'
+        rows[0]['educ'] = 'High school'
+        snapshot = make_snapshot(rows)
+
+        for statistic in bootstrap.STATISTICS:
+            with self.assertRaises(RuntimeError):
+                bootstrap.get_interval(snapshot, query, statistic, seed=1)
+
+    def test_executor_returns_errors(self):
+        small = data_model.Query()
+        small.set_educ('College')
+        small.set_docc03('Healthcare')
+        small.set_region('West')
+        small.set_female(True)
+
+        with bootstrap.IntervalExecutor(make_snapshot(self._rows[:40]), max_workers=2) as executor:
+            results = executor.get_intervals(
+                [data_model.Query(), small],
+                'get_unemp',
+                seed=1
+            )
+
+        self.assertIsInstance(results[0], tuple)
+        self.assertIsInstance(results[1], RuntimeError)
+
+
+if __name__ == '__main__':
+    unittest.main()
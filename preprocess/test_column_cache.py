@@ -0,0 +1,130 @@
+"""Tests for the columnar cache of Stata columns.
+
+Author: A Samuel Pottinger
+License: MIT License
+"""
+import json
+import os
+import tempfile
+import unittest
+import zipfile
+
+import column_cache
+
+from test_process_epi_data import write_source
+
+COLUMNS = ['year', 'educ', 'age', 'wageotc']
+
+
+class CountingCache(column_cache.ColumnCache):
+    """Cache counting how often the Stata file is decoded."""
+
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.num_decoded = 0
+
+    def _read_stata(self, loc, columns):
+        self.num_decoded += 1
+        return super()._read_stata(loc, columns)
+
+
+class ColumnCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self._source_loc = os.path.join(self._directory.name, 'source.dta')
+        self._cache_dir = os.path.join(self._directory.name, 'cache')
+        write_source(self._source_loc, 200)
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def _get_entries(self):
+        return list(filter(
+            lambda x: os.path.isdir(os.path.join(self._cache_dir, x)),
+            os.listdir(self._cache_dir)
+        ))
+
+    def test_hit(self):
+        cache = CountingCache(self._cache_dir)
+        first = cache.read(self._source_loc, COLUMNS)
+        second = cache.read(self._source_loc, COLUMNS)
+
+        self.assertEqual(cache.num_decoded, 1)
+        self.assertTrue(first.equals(second))
+
+    def test_categorical_round_trip(self):
+        cache = CountingCache(self._cache_dir)
+        first = cache.read(self._source_loc, COLUMNS)
+        second = cache.read(self._source_loc, COLUMNS)
+
+        for column in COLUMNS:
+            self.assertEqual(second[column].dtype, first[column].dtype)
+
+        self.assertEqual(
+            second['educ'].cat.categories.tolist(),
+            first['educ'].cat.categories.tolist()
+        )
+        self.assertEqual(second['educ'].cat.ordered, first['educ'].cat.ordered)
+        self.assertEqual(second['age'].tolist(), first['age'].tolist())
+
+    def test_miss_after_file_change(self):
+        cache = CountingCache(self._cache_dir)
+        cache.read(self._source_loc, COLUMNS)
+        old_hash = cache.get_source_hash(self._source_loc)
+
+        write_source(self._source_loc, 200, seed=1)
+        os.utime(self._source_loc, ns=(0, 0))
+        changed = cache.read(self._source_loc, COLUMNS)
+
+        self.assertEqual(cache.num_decoded, 2)
+        self.assertNotEqual(cache.get_source_hash(self._source_loc), old_hash)
+        self.assertTrue(cache.get_source_hash(self._source_loc).startswith('sha256-'))
+        self.assertEqual(len(self._get_entries()), 2)
+        self.assertEqual(len(changed.index), 200)
+
+    def test_miss_after_archive_change(self):
+        zip_loc = os.path.join(self._directory.name, 'epi.zip')
+        cache = CountingCache(self._cache_dir)
+        hashes = []
+
+        for seed in [0, 1]:
+            write_source(self._source_loc, 200, seed=seed)
+            with zipfile.ZipFile(zip_loc, 'w') as archive:
+                archive.write(self._source_loc, 'epi_cpsorg_2023.dta')
+
+            member = zipfile.Path(zip_loc, at='epi_cpsorg_2023.dta')
+            hashes.append(cache.get_source_hash(member))
+            cache.read(member, COLUMNS)
+
+        self.assertTrue(hashes[0].startswith('crc32-'))
+        self.assertNotEqual(hashes[0], hashes[1])
+        self.assertEqual(cache.num_decoded, 2)
+
+    def test_corrupt_metadata(self):
+        cache = CountingCache(self._cache_dir)
+        expected = cache.read(self._source_loc, COLUMNS)
+
+        entry_dir = os.path.join(self._cache_dir, self._get_entries()[0])
+        with open(os.path.join(entry_dir, column_cache.METADATA_FILENAME), 'w') as f:
+            f.write('{"columns": [')
+
+        rebuilt = cache.read(self._source_loc, COLUMNS)
+        self.assertEqual(cache.num_decoded, 2)
+        self.assertTrue(rebuilt.equals(expected))
+
+        with open(os.path.join(entry_dir, column_cache.METADATA_FILENAME)) as f:
+            self.assertEqual(len(json.load(f)['columns']), len(COLUMNS))
+
+    def test_corrupt_hashes(self):
+        cache = CountingCache(self._cache_dir)
+        expected_hash = cache.get_source_hash(self._source_loc)
+
+        with open(os.path.join(self._cache_dir, column_cache.HASHES_FILENAME), 'w') as f:
+            f.write('{')
+
+        self.assertEqual(cache.get_source_hash(self._source_loc), expected_hash)
+
+
+if __name__ == '__main__':
+    unittest.main()
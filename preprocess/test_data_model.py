@@ -0,0 +1,628 @@
+"""Tests for loading and querying the preprocessed EPI data.
+
+Author: A Samuel Pottinger
+License: MIT License
+"""
+import asyncio
+import csv
+import os
+import random
+import tempfile
+import types
+import unittest
+
+import data_model
+
+EDUC_VALUES = ['High school', 'Some college', 'College', 'Advanced']
+OCCUPATIONS = ['Management occupations', 'Sales and related occupations', 'Healthcare']
+CSV_COLUMNS = [
+    'index',
+    'educ',
+    'docc03',
+    'wageotc',
+    'unemp',
+    'wageCount',
+    'unempCount',
+    'wbhaom',
+    'female',
+    'region',
+    'age',
+    'hoursuint',
+    'citistat'
+]
+
+
+def make_rows(num_rows, seed=0):
+    rng = random.Random(seed)
+
+    def make_row(index):
+        wages = sorted(map(
+            lambda x: (float(rng.randint(10, 60)), float(rng.randint(1, 5))),
+            range(rng.randint(1, 6))
+        ))
+        weight = sum(map(lambda x: x[1], wages))
+        return {
+            'index': index,
+            'educ': rng.choice(EDUC_VALUES),
+            'docc03': rng.choice(OCCUPATIONS),
+            'wageotc': wages,
+            'unemp': rng.choice([0.0, 10.0, 50.0]),
+            'wageCount': weight,
+            'unempCount': weight,
+            'wbhaom': rng.choice(['White', 'Black']),
+            'female': rng.choice(['Female', 'Male']),
+            'region': rng.choice(['West', 'South']),
+            'age': rng.choice(['25-35 yr', '35-45 yr']),
+            'hoursuint': 'At Least 35 Hours',
+            'citistat': 'native, born in US'
+        }
+
+    return list(map(make_row, range(num_rows)))
+
+
+def write_csv(loc, rows):
+    with open(loc, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            csv_row = dict(row)
+            csv_row['wageotc'] = ';'.join(map(lambda x: '%f %f' % x, row['wageotc']))
+            writer.writerow(csv_row)
+
+
+def get_brute_median(rows, predicate):
+    wages = sorted(
+        (wage for row in rows if predicate(row) for wage in row['wageotc']),
+        key=lambda x: x[0]
+    )
+    mid_count = sum(map(lambda x: x[1], wages)) / 2
+
+    weight_acc = 0
+    for wage, weight in wages:
+        if weight_acc + weight >= mid_count:
+            return wage
+        weight_acc += weight
+
+    return None
+
+
+class LoadTests(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self._loc = os.path.join(self._directory.name, 'data.csv')
+        self._rows = make_rows(200)
+        write_csv(self._loc, self._rows)
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test_read_records_streams(self):
+        records = data_model.read_records(self._loc)
+        self.assertIsInstance(records, types.GeneratorType)
+        self.assertEqual(len(list(records)), len(self._rows))
+
+    def test_persisted_index(self):
+        query = data_model.Query()
+        query.set_educ('College')
+
+        first = data_model.load_from_file(self._loc, persist_index=True)
+        expected = first.get_wageotc(query)
+
+        index_dir = self._loc + data_model.INDEX_EXTENSION
+        self.assertEqual(os.listdir(index_dir), ['educ.pickle'])
+
+        second = data_model.load_from_file(self._loc, persist_index=True)
+        self.assertEqual(second.get_wageotc(query), expected)
+
+    def test_corrupt_index_rebuilt(self):
+        query = data_model.Query()
+        query.set_educ('College')
+
+        first = data_model.load_from_file(self._loc, persist_index=True)
+        expected = first.get_wageotc(query)
+
+        index_path = os.path.join(self._loc + data_model.INDEX_EXTENSION, 'educ.pickle')
+        with open(index_path, 'rb') as f:
+            contents = f.read()
+
+        with open(index_path, 'wb') as f:
+            f.write(contents[:len(contents) // 2])
+
+        second = data_model.load_from_file(self._loc, persist_index=True)
+        self.assertEqual(second.get_wageotc(query), expected)
+
+        store = data_model.IndexStore(
+            self._loc + data_model.INDEX_EXTENSION,
+            (os.stat(self._loc).st_size, os.stat(self._loc).st_mtime_ns)
+        )
+        self.assertIsNotNone(store.get('educ'))
+
+    def test_legacy_index_file_replaced(self):
+        with open(self._loc + data_model.INDEX_EXTENSION, 'wb') as f:
+            f.write(b'not a pickle')
+
+        dataset = data_model.load_from_file(self._loc, persist_index=True)
+        query = data_model.Query()
+        query.set_educ('College')
+        dataset.get_wageotc(query)
+
+        self.assertTrue(os.path.isdir(self._loc + data_model.INDEX_EXTENSION))
+
+
+class SampleTests(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self._loc = os.path.join(self._directory.name, 'data.csv')
+        self._rows = make_rows(200)
+        write_csv(self._loc, self._rows)
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def _count_wages(self, loc):
+        with open(loc) as f:
+            return sum(map(lambda x: len(x['wageotc'].split(';')), csv.DictReader(f)))
+
+    def test_cached_sample(self):
+        full = data_model.load_from_file(self._loc)
+        sampled = data_model.load_sample_from_file(self._loc, 0.3, seed=1)
+
+        sample_dir = self._loc + data_model.SAMPLE_EXTENSION
+        filenames = os.listdir(sample_dir)
+        self.assertEqual(len(filenames), 1)
+
+        sample_loc = os.path.join(sample_dir, filenames[0])
+        self.assertLess(self._count_wages(sample_loc), self._count_wages(self._loc))
+        modified = os.stat(sample_loc).st_mtime_ns
+
+        query = data_model.Query()
+        query.set_educ('College')
+        self.assertAlmostEqual(sampled.get_size(query), full.get_size(query))
+
+        again = data_model.load_sample_from_file(self._loc, 0.3, seed=1)
+        self.assertEqual(again.get_wageotc(query), sampled.get_wageotc(query))
+        self.assertEqual(os.stat(sample_loc).st_mtime_ns, modified)
+
+    def test_changed_source_resampled(self):
+        data_model.load_sample_from_file(self._loc, 0.3, seed=1)
+        write_csv(self._loc, self._rows[:100])
+        os.utime(self._loc, ns=(0, 0))
+
+        sampled = data_model.load_sample_from_file(self._loc, 0.3, seed=1)
+        self.assertEqual(len(os.listdir(self._loc + data_model.SAMPLE_EXTENSION)), 2)
+        self.assertEqual(
+            sampled.get_size(data_model.Query()),
+            data_model.load_from_file(self._loc).get_size(data_model.Query())
+        )
+
+    def test_wage_weights_preserved(self):
+        records = list(data_model.read_records(self._loc))
+        sampled = data_model.sample_records(records, 0.3, seed=2)
+
+        for record, sampled_record in zip(records, sampled):
+            self.assertAlmostEqual(
+                sampled_record.get_wage_run().get_total_weight(),
+                record.get_wage_run().get_total_weight()
+            )
+
+
+class FilterTests(unittest.TestCase):
+
+    def setUp(self):
+        self._rows = make_rows(300, seed=9)
+        self._dataset = data_model.load_from_rows(self._rows)
+
+    def _check(self, query, predicate):
+        matching = list(filter(predicate, self._rows))
+        self.assertGreater(len(matching), 0)
+        self.assertEqual(
+            self._dataset.get_wageotc(query),
+            get_brute_median(self._rows, predicate)
+        )
+        self.assertAlmostEqual(
+            self._dataset.get_size(query),
+            sum(map(lambda x: x['wageCount'], matching))
+        )
+
+    def test_multiple_values(self):
+        query = data_model.Query()
+        query.set_educ(['College', 'Advanced'])
+        query.set_region({'West'})
+        self._check(
+            query,
+            lambda x: x['educ'] in ['College', 'Advanced'] and x['region'] == 'West'
+        )
+
+    def test_range(self):
+        query = data_model.Query()
+        query.set_educ(data_model.ValueRange('Some college', 'Advanced'))
+        self._check(query, lambda x: x['educ'] in ['Some college', 'College', 'Advanced'])
+
+    def test_range_skips_missing_values(self):
+        query = data_model.Query()
+        query.set_age(data_model.ValueRange('<25 yr', '25-35 yr'))
+        self._check(query, lambda x: x['age'] == '25-35 yr')
+
+    def test_single_value_range(self):
+        query = data_model.Query()
+        query.set_educ(data_model.ValueRange('College', 'College'))
+        self._check(query, lambda x: x['educ'] == 'College')
+
+    def test_reversed_range(self):
+        query = data_model.Query()
+        query.set_age(data_model.ValueRange('45-55 yr', '25-35 yr'))
+        with self.assertRaises(RuntimeError):
+            self._dataset.get_size(query)
+
+    def test_unknown_range_bound(self):
+        query = data_model.Query()
+        query.set_age(data_model.ValueRange('25-35 yr', '99 yr'))
+        with self.assertRaises(RuntimeError):
+            self._dataset.get_size(query)
+
+    def test_range_unordered_dimension(self):
+        query = data_model.Query()
+        query.set_region(data_model.ValueRange('South', 'West'))
+        with self.assertRaises(RuntimeError):
+            self._dataset.get_size(query)
+
+    def test_unknown_value(self):
+        query = data_model.Query()
+        query.set_educ(['College', 'Doctorate'])
+        with self.assertRaises(RuntimeError):
+            self._dataset.get_size(query)
+
+
+class MedianTests(unittest.TestCase):
+
+    def test_matches_brute_force(self):
+        rows = make_rows(400, seed=1)
+        dataset = data_model.load_from_rows(rows)
+        rng = random.Random(2)
+
+        for trial in range(200):
+            query = data_model.Query()
+            conditions = []
+
+            if rng.random() < 0.5:
+                educ = rng.choice(EDUC_VALUES)
+                query.set_educ(educ)
+                conditions.append(lambda x, educ=educ: x['educ'] == educ)
+
+            if rng.random() < 0.5:
+                docc03 = rng.choice(OCCUPATIONS)
+                query.set_docc03(docc03)
+                conditions.append(lambda x, docc03=docc03: x['docc03'] == docc03)
+
+            if rng.random() < 0.5:
+                female = rng.choice([True, False])
+                query.set_female(female)
+                conditions.append(lambda x, female=female: (x['female'] == 'Female') == female)
+
+            if rng.random() < 0.5:
+                region = rng.choice(['West', 'South'])
+                query.set_region(region)
+                conditions.append(lambda x, region=region: x['region'] == region)
+
+            expected = get_brute_median(rows, lambda x: all(map(lambda y: y(x), conditions)))
+            if expected is None:
+                with self.assertRaises(RuntimeError):
+                    dataset.get_wageotc(query)
+            else:
+                self.assertEqual(dataset.get_wageotc(query), expected)
+
+    def test_weighted_median_of_runs(self):
+        runs = [
+            data_model.WageRun([10.0, 30.0], [1.0, 1.0]),
+            data_model.WageRun([20.0], [0.0]),
+            data_model.WageRun([25.0, 40.0], [1.0, 1.0])
+        ]
+        self.assertEqual(data_model.get_weighted_median(runs), 25.0)
+
+    def test_weighted_median_zero_weights(self):
+        runs = [data_model.WageRun([0.0], [0.0]), data_model.WageRun([5.0], [0.0])]
+        self.assertEqual(data_model.get_weighted_median(runs), 0.0)
+
+    def test_weighted_median_empty(self):
+        with self.assertRaises(RuntimeError):
+            data_model.get_weighted_median([data_model.WageRun([], [])])
+
+
+class SeriesTests(unittest.TestCase):
+
+    def test_matches_brute_force(self):
+        rng = random.Random(4)
+        rows = make_rows(300, seed=3)
+        periods = ['2023-%02d' % x for x in range(1, 7)]
+
+        for row in rows:
+            row['period'] = rng.choice(periods)
+            row['wageotc'] = list(map(lambda x: (x[0], rng.uniform(0.1, 3.3)), row['wageotc']))
+
+        for row in filter(lambda x: x['period'] == '2023-02', rows):
+            row['wageotc'] = list(map(lambda x: (x[0], 0.0), row['wageotc']))
+
+        rows.append(dict(rows[0], index=len(rows), period='2023-07', wageotc=[(0.0, 0.0)]))
+
+        series = data_model.TimeSeriesDataset(
+            data_model.parse_rows(rows),
+            dict(map(lambda x: (x['index'], x['period']), rows))
+        )
+
+        for educ in [None] + EDUC_VALUES:
+            query = data_model.Query()
+            if educ is not None:
+                query.set_educ(educ)
+
+            results = series.get_wageotc_series(query)
+
+            for period in periods + ['2023-07']:
+                expected = get_brute_median(
+                    rows,
+                    lambda x: x['period'] == period and educ in (None, x['educ'])
+                )
+                self.assertEqual(results.get(period), expected)
+
+
+class FrameTests(unittest.TestCase):
+
+    def setUp(self):
+        import pandas
+
+        self._rows = make_rows(100, seed=7)
+        self._expected = data_model.load_from_rows(self._rows)
+
+        frame = pandas.DataFrame(self._rows)
+        frame['wageotc'] = list(map(
+            lambda x: ';'.join(map(lambda y: '%f %f' % y, x)),
+            frame['wageotc']
+        ))
+        self._frame = frame.set_index('index')
+
+    def _check(self, dataset):
+        for female in [True, False]:
+            query = data_model.Query()
+            query.set_female(female)
+            self.assertEqual(dataset.get_size(query), self._expected.get_size(query))
+            self.assertEqual(dataset.get_wageotc(query), self._expected.get_wageotc(query))
+
+        self.assertEqual(dataset.get_female_vals(), [False, True])
+
+    def test_label_female(self):
+        self._check(data_model.load_from_frame(self._frame))
+
+    def test_bool_female(self):
+        frame = self._frame.assign(female=self._frame['female'] == 'Female')
+        self.assertEqual(frame['female'].dtype, bool)
+        self._check(data_model.load_from_frame(frame))
+
+    def test_bool_female_rows(self):
+        frame = self._frame.assign(female=self._frame['female'] == 'Female')
+        frame['wageotc'] = list(map(lambda x: x['wageotc'], self._rows))
+        self._check(data_model.load_from_frame(frame))
+
+    def test_unexpected_female(self):
+        with self.assertRaises(RuntimeError):
+            data_model.parse_female(1.5)
+
+    def test_unknown_female_label(self):
+        self.assertTrue(data_model.parse_female('Female'))
+        self.assertFalse(data_model.parse_female('Male'))
+
+        for label in ['All genders', 'female', 'Femal', '']:
+            with self.assertRaises(RuntimeError):
+                data_model.parse_female(label)
+
+    def test_unknown_female_csv(self):
+        rows = make_rows(10, seed=8)
+        rows[3]['female'] = 'All genders'
+
+        with tempfile.TemporaryDirectory() as directory:
+            loc = os.path.join(directory, 'data.csv')
+            write_csv(loc, rows)
+
+            with self.assertRaises(RuntimeError):
+                data_model.load_from_file(loc)
+
+            with open(loc) as f:
+                raw_rows = list(csv.DictReader(f))
+
+        with self.assertRaises(RuntimeError):
+            data_model.parse_record(raw_rows[3])
+
+
+class SnapshotTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls._directory = tempfile.TemporaryDirectory()
+        loc = os.path.join(cls._directory.name, 'data.csv')
+        rows = make_rows(300, seed=10)
+        rows.append(dict(rows[0], index=len(rows), educ='High school', region='North'))
+        write_csv(loc, rows)
+
+        cls._dataset = data_model.load_from_file(loc)
+        cls._snapshot = cls._dataset.snapshot()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._directory.cleanup()
+
+    def _make_queries(self):
+        rng = random.Random(11)
+        queries = [data_model.Query()]
+
+        for trial in range(50):
+            query = data_model.Query()
+            if rng.random() < 0.5:
+                query.set_educ(rng.choice(EDUC_VALUES))
+            if rng.random() < 0.5:
+                query.set_docc03(rng.sample(OCCUPATIONS, 2))
+            if rng.random() < 0.5:
+                query.set_female(rng.choice([True, False]))
+            if rng.random() < 0.3:
+                query.set_age(data_model.ValueRange('<25 yr', '25-35 yr'))
+            queries.append(query)
+
+        empty = data_model.Query()
+        empty.set_educ('College')
+        empty.set_region('North')
+        queries.append(empty)
+
+        return queries
+
+    def _check_same(self, method_name, query):
+        outcomes = []
+        for target in [self._dataset, self._snapshot]:
+            try:
+                outcomes.append(getattr(target, method_name)(query))
+            except RuntimeError:
+                outcomes.append(RuntimeError)
+
+        expected, actual = outcomes
+        if expected is RuntimeError:
+            self.assertIs(actual, RuntimeError)
+        else:
+            self.assertAlmostEqual(actual, expected)
+
+    def test_matches_dataset(self):
+        for query in self._make_queries():
+            for method_name in ['get_wageotc', 'get_size', 'get_unemp']:
+                self._check_same(method_name, query)
+
+    def test_empty_result(self):
+        query = data_model.Query()
+        query.set_educ('College')
+        query.set_region('North')
+
+        self.assertEqual(self._snapshot.get_size(query), 0)
+        self.assertEqual(self._dataset.get_size(query), 0)
+        with self.assertRaises(RuntimeError):
+            self._snapshot.get_wageotc(query)
+
+    def test_executor(self):
+        queries = self._make_queries()
+        with data_model.QueryExecutor(self._snapshot, max_workers=4) as executor:
+            sizes = executor.map_queries('get_size', queries)
+            median = executor.submit('get_wageotc', queries[0]).result()
+
+        expected_sizes = list(map(self._dataset.get_size, queries))
+        for size, expected_size in zip(sizes, expected_sizes):
+            self.assertAlmostEqual(size, expected_size)
+
+        self.assertEqual(median, self._dataset.get_wageotc(queries[0]))
+
+
+class ProfilerTests(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        loc = os.path.join(self._directory.name, 'data.csv')
+        self._rows = make_rows(200, seed=12)
+        write_csv(loc, self._rows)
+        self._dataset = data_model.load_from_file(loc)
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def _make_query(self):
+        query = data_model.Query()
+        query.set_educ('College')
+        return query
+
+    def test_result_unchanged(self):
+        query = self._make_query()
+        method_names = ['get_wageotc', 'get_size', 'get_unemp']
+        expected = list(map(lambda x: getattr(self._dataset, x)(query), method_names))
+
+        self._dataset.set_profiler(data_model.Profiler())
+        actual = list(map(lambda x: getattr(self._dataset, x)(query), method_names))
+
+        self.assertEqual(actual, expected)
+
+    def test_records_stages(self):
+        recorded = []
+        profiler = data_model.Profiler(callback=recorded.append)
+        self._dataset.set_profiler(profiler)
+
+        self._dataset.get_wageotc(self._make_query())
+
+        profiles = profiler.get_profiles('get_wageotc')
+        self.assertEqual(len(profiles), 1)
+        self.assertEqual(recorded, profiles)
+
+        profile = profiles[0]
+        self.assertEqual(
+            set(profile.get_phases().keys()),
+            {'filter', 'gather', 'aggregate'}
+        )
+
+        matching = list(filter(lambda x: x['educ'] == 'College', self._rows))
+        self.assertEqual(profile.get_rows(), len(matching))
+        num_tuples = sum(map(lambda x: len(x['wageotc']), matching))
+        self.assertEqual(profile.get_tuples(), num_tuples)
+        self.assertGreater(profile.get_duration(), 0)
+
+        summary = profiler.get_summary()
+        self.assertEqual(summary['get_wageotc']['count'], 1)
+        histogram = profiler.get_histogram('get_wageotc')
+        self.assertEqual(sum(map(lambda x: x[1], histogram)), 1)
+
+    def test_failed_query_recorded(self):
+        profiler = data_model.Profiler()
+        self._dataset.set_profiler(profiler)
+
+        query = self._make_query()
+        query.set_region('North')
+        with self.assertRaises(RuntimeError):
+            self._dataset.get_wageotc(query)
+
+        profiles = profiler.get_profiles('get_wageotc')
+        self.assertEqual(len(profiles), 1)
+        self.assertNotIn('aggregate', profiles[0].get_phases())
+
+
+class FailingDataset:
+    """Dataset whose batches fail with an unexpected error."""
+
+    def run_batch(self, requests):
+        raise TypeError('Unexpected failure.')
+
+
+class CoalescerTests(unittest.IsolatedAsyncioTestCase):
+
+    async def test_batch(self):
+        rows = make_rows(100)
+        dataset = data_model.load_from_rows(rows)
+
+        query = data_model.Query()
+        query.set_educ('College')
+        expected = dataset.get_wageotc(query)
+
+        coalescer = data_model.QueryCoalescer(dataset)
+        results = await asyncio.gather(
+            coalescer.submit(query, 'get_wageotc'),
+            coalescer.submit(data_model.Query(), 'get_size')
+        )
+        self.assertEqual(results[0], expected)
+        self.assertEqual(results[1], dataset.get_size(data_model.Query()))
+
+    async def test_batch_failure(self):
+        coalescer = data_model.QueryCoalescer(FailingDataset())
+        results = await asyncio.wait_for(
+            asyncio.gather(
+                coalescer.submit(data_model.Query(), 'get_wageotc'),
+                coalescer.submit(data_model.Query(), 'get_size'),
+                return_exceptions=True
+            ),
+            timeout=5
+        )
+        self.assertEqual(len(results), 2)
+        for result in results:
+            self.assertIsInstance(result, TypeError)
+
+
+if __name__ == '__main__':
+    unittest.main()
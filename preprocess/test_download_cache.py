@@ -0,0 +1,154 @@
+"""Tests for the download cache against a local HTTP server.
+
+Author: A Samuel Pottinger
+License: MIT License
+"""
+import hashlib
+import http.server
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+import download_cache
+
+PAYLOAD = bytes(range(256)) * 1024
+ETAG = '"v1"'
+
+
+class FileHandler(http.server.BaseHTTPRequestHandler):
+    """Serve the server's payload with ETag, conditional, and Range support."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers.items()))
+
+        if self.headers.get('If-None-Match') == server.etag:
+            self.send_response(304)
+            self.send_header('ETag', server.etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        start = 0
+        range_header = self.headers.get('Range')
+        if range_header and self.headers.get('If-Range') == server.etag:
+            start = int(range_header.split('=')[1].rstrip('-'))
+
+        body = server.payload[start:]
+        self.send_response(206 if start > 0 else 200)
+        self.send_header('ETag', server.etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        if server.truncate:
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+        else:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DownloadCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FileHandler)
+        self._server.payload = PAYLOAD
+        self._server.etag = ETAG
+        self._server.truncate = False
+        self._server.requests = []
+
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.start()
+
+        self._directory = tempfile.TemporaryDirectory()
+        self._url = 'http://127.0.0.1:%d/data.zip' % self._server.server_address[1]
+
+    def tearDown(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._directory.cleanup()
+
+    def _make_cache(self):
+        return download_cache.DownloadCache(self._directory.name, progress=None)
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_fetch(self):
+        path = self._make_cache().fetch(self._url)
+        self.assertEqual(self._read(path), PAYLOAD)
+        self.assertEqual(os.path.basename(path), hashlib.sha256(PAYLOAD).hexdigest())
+
+    def test_revalidate_not_modified(self):
+        first_path = self._make_cache().fetch(self._url)
+        second_path = self._make_cache().fetch(self._url)
+
+        self.assertEqual(first_path, second_path)
+        self.assertEqual(self._server.requests[-1].get('If-None-Match'), ETAG)
+
+    def test_revalidate_changed(self):
+        self._make_cache().fetch(self._url)
+
+        self._server.payload = b'new release'
+        self._server.etag = '"v2"'
+        path = self._make_cache().fetch(self._url)
+
+        self.assertEqual(self._read(path), b'new release')
+
+    def test_resume(self):
+        self._server.truncate = True
+        with self.assertRaises(download_cache.TRANSFER_ERRORS):
+            self._make_cache().fetch(self._url)
+
+        self._server.truncate = False
+        path = self._make_cache().fetch(self._url)
+
+        self.assertEqual(self._read(path), PAYLOAD)
+        self.assertIn('Range', self._server.requests[-1])
+        self.assertEqual(self._server.requests[-1].get('If-Range'), ETAG)
+
+    def test_corrupt_cache_refetched(self):
+        path = self._make_cache().fetch(self._url)
+
+        with open(path, 'wb') as f:
+            f.write(b'\0' * len(PAYLOAD))
+
+        path = self._make_cache().fetch(self._url)
+
+        self.assertEqual(self._read(path), PAYLOAD)
+        self.assertNotIn('If-None-Match', self._server.requests[-1])
+
+    def test_failed_transfer_uses_cache(self):
+        cached_path = self._make_cache().fetch(self._url)
+
+        self._server.payload = b'new release' * 1000
+        self._server.etag = '"v2"'
+        self._server.truncate = True
+        path = self._make_cache().fetch(self._url)
+
+        self.assertEqual(path, cached_path)
+        self.assertEqual(self._read(path), PAYLOAD)
+
+    def test_verified_mtime_recorded(self):
+        self._make_cache().fetch(self._url)
+
+        metadata_filenames = filter(
+            lambda x: x.endswith('.json'),
+            os.listdir(self._directory.name)
+        )
+        for filename in metadata_filenames:
+            with open(os.path.join(self._directory.name, filename)) as f:
+                self.assertIn('verifiedMtime', json.load(f))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,555 @@
+"""Tests for the EPI microdata processing pipeline.
+
+Author: A Samuel Pottinger
+License: MIT License
+"""
+import contextlib
+import csv
+import io
+import json
+import os
+import random
+import tempfile
+import unittest
+import unittest.mock
+import zipfile
+
+import data_model
+import process_epi_data
+
+SOURCE_LABELS = {
+    'educ': ['Less than high school', 'High school', 'Some college', 'College', 'Advanced'],
+    'docc03': ['Management occupations', 'Sales and related occupations', 'Armed Forces'],
+    'lfstat': ['Employed', 'Unemployed', 'NILF'],
+    'wbhaom': ['White', 'Black', 'Hispanic', 'Asian'],
+    'female': ['Male', 'Female'],
+    'region': ['Northeast', 'Midwest', 'South', 'West'],
+    'citistat': ['native, born in US', 'foreign born, not a US citizen'],
+    'hoursuint': ['40 hours', '0-20 hours', 'Hours vary: full-time'],
+    'age': list(map(str, range(16, 80))) + ['80+']
+}
+
+
+def make_group(docc03, educ, wages, unemployed=0):
+    weight = sum(map(lambda x: x[1], wages))
+    return {
+        'educ': educ,
+        'docc03': docc03,
+        'wageotc': list(wages),
+        'unemp': [unemployed],
+        'wbhaom': 'White',
+        'female': 'Female',
+        'region': 'West',
+        'citistat': 'native, born in US',
+        'age': '25-35 yr',
+        'hoursuint': 'At Least 35 Hours',
+        'wageCount': weight,
+        'unempCount': weight
+    }
+
+
+def write_source(loc, num_rows, seed=0):
+    """Write a small Stata file with the columns read by load_data."""
+    import pandas
+
+    rng = random.Random(seed)
+    columns = {
+        'year': [2023] * num_rows,
+        'month': list(map(lambda x: 1 + x % 12, range(num_rows)))
+    }
+
+    for name, labels in SOURCE_LABELS.items():
+        values = list(map(lambda x: rng.choice(labels), range(num_rows)))
+        columns[name] = pandas.Categorical(values, categories=labels)
+
+    columns['wageotc'] = list(map(lambda x: rng.uniform(10, 60), range(num_rows)))
+    columns['wage'] = columns['wageotc']
+    columns['orgwgt'] = list(map(lambda x: rng.uniform(500, 5000), range(num_rows)))
+
+    pandas.DataFrame(columns).to_stata(loc, write_index=False)
+
+
+def make_agg(groups):
+    return dict(map(lambda x: (process_epi_data.get_key(x), x), groups))
+
+
+class PartitionTests(unittest.TestCase):
+
+    def test_shard_filename(self):
+        filename = process_epi_data.get_shard_filename('Sales and related occupations')
+        self.assertEqual(filename, 'sales_and_related_occupations.csv')
+
+    def test_shard_filename_collision(self):
+        first = process_epi_data.get_shard_filename('Sales, related')
+        second = process_epi_data.get_shard_filename('Sales related', {first})
+        self.assertNotEqual(first, second)
+        self.assertTrue(second.startswith('sales_related_'))
+
+    def test_shard_filename_empty_slug(self):
+        filename = process_epi_data.get_shard_filename('???')
+        self.assertNotEqual(filename, '.csv')
+
+    def test_write_partitioned_collision(self):
+        agg = make_agg([
+            make_group('Sales, related', 'College', [(20.0, 1.0)]),
+            make_group('Sales related', 'College', [(30.0, 1.0)])
+        ])
+
+        with tempfile.TemporaryDirectory() as directory:
+            output_loc = os.path.join(directory, 'data.csv')
+            partition_dir = os.path.join(directory, 'parts')
+            process_epi_data.run_export(agg, output_loc, partition_dir)
+
+            with open(os.path.join(partition_dir, 'manifest.json')) as f:
+                manifest = json.load(f)
+
+            filenames = set(map(lambda x: x['file'], manifest['shards'].values()))
+            self.assertEqual(len(filenames), 2)
+
+            for filename in filenames:
+                self.assertTrue(os.path.exists(os.path.join(partition_dir, filename)))
+
+    def test_overview(self):
+        agg = make_agg([
+            make_group('Sales', 'College', [(20.0, 1.0), (40.0, 1.0)], unemployed=1),
+            make_group('Sales', 'Advanced', [(30.0, 2.0)]),
+            make_group('Management', 'College', [(50.0, 4.0)])
+        ])
+
+        rows = process_epi_data.summarize_overview(agg)
+        by_key = dict(map(lambda x: ((x['dimension'], x['value']), x), rows))
+
+        total = by_key[('docc03', 'All occupations')]
+        self.assertEqual(total['wageMedian'], 40.0)
+        self.assertEqual(total['unempCount'], 8.0)
+        self.assertAlmostEqual(total['unemp'], 12.5)
+
+        college = by_key[('educ', 'College')]
+        self.assertEqual(college['wageMedian'], 50.0)
+        self.assertEqual(college['wageCount'], 6.0)
+
+        self.assertNotIn('wageotc', total)
+
+
+class FrameTests(unittest.TestCase):
+
+    def test_downcast_lossless(self):
+        import numpy
+        import pandas
+
+        series = pandas.Series([1.5, 2.25, numpy.nan, 1024.0])
+        downcast = process_epi_data.downcast_float(series)
+        self.assertEqual(downcast.dtype, numpy.float32)
+        self.assertTrue(downcast.astype(numpy.float64).equals(series))
+
+    def test_downcast_keeps_precision(self):
+        import numpy
+        import pandas
+
+        series = pandas.Series([1.5, 2.1, 16777217.0])
+        kept = process_epi_data.downcast_float(series)
+        self.assertEqual(kept.dtype, numpy.float64)
+        self.assertEqual(kept.tolist(), [1.5, 2.1, 16777217.0])
+
+    def test_concat_keeps_category_order(self):
+        import pandas
+
+        first = pandas.DataFrame({'educ': pandas.Categorical(
+            ['College', 'High school'],
+            categories=['High school', 'College']
+        )})
+        second = pandas.DataFrame({'educ': pandas.Categorical(
+            ['Advanced', 'High school'],
+            categories=['High school', 'Advanced']
+        )})
+
+        combined = process_epi_data.concat_frames([first, second])
+        self.assertIsInstance(combined['educ'].dtype, pandas.CategoricalDtype)
+        self.assertEqual(
+            combined['educ'].cat.categories.tolist(),
+            ['High school', 'College', 'Advanced']
+        )
+        self.assertEqual(
+            combined['educ'].tolist(),
+            ['College', 'High school', 'Advanced', 'High school']
+        )
+
+    def test_recode_categorical(self):
+        import pandas
+
+        series = pandas.Series(pandas.Categorical(['40 hours', '0-20 hours', None, '40 hours']))
+        recoded = process_epi_data.recode_categorical(series, process_epi_data.determine_hours)
+        self.assertEqual(recoded.tolist(), [
+            'At Least 35 Hours',
+            'Less than 35 Hours',
+            'Varies or Other',
+            'At Least 35 Hours'
+        ])
+
+
+class ArchiveTests(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self._zip_loc = os.path.join(self._directory.name, 'epi.zip')
+        self._output_dir = os.path.join(self._directory.name, 'out')
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def _write_zip(self, members):
+        with zipfile.ZipFile(self._zip_loc, 'w') as archive:
+            for name in members:
+                archive.writestr(zipfile.ZipInfo(name), b'contents of ' + name.encode('utf-8'))
+
+    def test_match_by_year(self):
+        names = [
+            'epi/epi_cpsorg_2022.dta',
+            'epi/epi_cpsorg_2023.dta',
+            'epi/epi_cpsorg_2024.dta',
+            'epi/readme_2023.txt'
+        ]
+        matching = process_epi_data.find_matching_members(names, 2023, 2024)
+        self.assertEqual(matching, ['epi/epi_cpsorg_2023.dta', 'epi/epi_cpsorg_2024.dta'])
+
+    def test_extract_and_list(self):
+        self._write_zip(['epi/epi_cpsorg_2022.dta', 'epi/epi_cpsorg_2023.dta'])
+
+        paths = process_epi_data.extract_members(self._zip_loc, 2023, 2023, self._output_dir)
+        self.assertEqual(paths, [os.path.join(self._output_dir, 'epi_cpsorg_2023.dta')])
+        with open(paths[0], 'rb') as f:
+            self.assertEqual(f.read(), b'contents of epi/epi_cpsorg_2023.dta')
+
+        members = process_epi_data.list_members(self._zip_loc, 2022, 2022)
+        self.assertEqual(list(map(lambda x: x.name, members)), ['epi_cpsorg_2022.dta'])
+        self.assertEqual(members[0].read_bytes(), b'contents of epi/epi_cpsorg_2022.dta')
+
+    def test_no_match(self):
+        self._write_zip(['epi/epi_cpsorg_2022.dta'])
+        paths = process_epi_data.extract_members(self._zip_loc, 2030, 2031, self._output_dir)
+        self.assertEqual(paths, [])
+        self.assertEqual(process_epi_data.list_members(self._zip_loc, 2030, 2031), [])
+
+    def test_unsafe_member_refused(self):
+        for name in ['../epi_cpsorg_2023.dta', '/tmp/epi_cpsorg_2023.dta', 'C:/epi_cpsorg_2023.dta']:
+            self._write_zip([name])
+            with self.assertRaises(RuntimeError):
+                process_epi_data.extract_members(self._zip_loc, 2023, 2023, self._output_dir)
+
+            self.assertEqual(os.listdir(self._output_dir), [])
+
+        self.assertFalse(os.path.exists(os.path.join(self._directory.name, 'epi_cpsorg_2023.dta')))
+
+
+class DatasetTests(unittest.TestCase):
+
+    def test_make_dataset_matches_export(self):
+        groups = [
+            make_group('Sales', 'College', [(20.0, 1.0), (40.0, 1.0)], unemployed=1),
+            make_group('Sales', 'Advanced', [(30.0, 2.0)]),
+            make_group('Management', 'College', [(50.0, 4.0)]),
+            make_group('Management', 'Advanced', [])
+        ]
+        groups[1]['female'] = 'Male'
+        groups[3]['region'] = 'South'
+        groups[3]['unempCount'] = 2.0
+
+        with tempfile.TemporaryDirectory() as directory:
+            output_loc = os.path.join(directory, 'data.csv')
+            process_epi_data.run_export(make_agg(groups), output_loc, 'none')
+            exported = data_model.load_from_file(output_loc)
+
+        dataset = process_epi_data.make_dataset(make_agg(groups))
+
+        for female in [None, True, False]:
+            query = data_model.Query()
+            if female is not None:
+                query.set_female(female)
+
+            self.assertEqual(dataset.get_wageotc(query), exported.get_wageotc(query))
+            self.assertEqual(dataset.get_size(query), exported.get_size(query))
+            self.assertAlmostEqual(dataset.get_unemp(query), exported.get_unemp(query))
+
+        self.assertEqual(dataset.get_region_vals(), exported.get_region_vals())
+
+
+class SampleTests(unittest.TestCase):
+
+    def _make_frame(self, num_rows):
+        import pandas
+
+        rng = random.Random(8)
+        columns = {}
+        for name in process_epi_data.STRATA_COLUMNS:
+            labels = SOURCE_LABELS[name][:2]
+            if name in ['age', 'hoursuint']:
+                labels = SOURCE_LABELS[name]
+            values = list(map(lambda x: rng.choice(labels), range(num_rows)))
+            columns[name] = pandas.Categorical(values, categories=SOURCE_LABELS[name])
+
+        columns['orgwgt'] = list(map(lambda x: rng.uniform(500, 5000), range(num_rows)))
+        return pandas.DataFrame(columns)
+
+    def _get_groups(self, frame):
+        groups = frame[process_epi_data.STRATA_COLUMNS].copy()
+        groups['age'] = process_epi_data.recode_categorical(
+            groups['age'],
+            process_epi_data.determine_age
+        )
+        groups['hoursuint'] = process_epi_data.recode_categorical(
+            groups['hoursuint'],
+            process_epi_data.determine_hours
+        )
+        groups['orgwgt'] = frame['orgwgt'].to_numpy(dtype='float64')
+        return groups.groupby(process_epi_data.STRATA_COLUMNS, observed=True)['orgwgt']
+
+    def test_recoded_groups_keep_weight(self):
+        frame = self._make_frame(20000)
+        sampled = process_epi_data.sample_frame(frame, 0.1, seed=1)
+        self.assertLess(len(sampled), len(frame) * 0.2)
+
+        groups = self._get_groups(frame)
+        is_large = groups.size() >= 10
+        self.assertGreater(is_large.sum(), is_large.shape[0] / 2)
+
+        expected = groups.sum()[is_large]
+        actual = self._get_groups(sampled).sum().reindex(expected.index).fillna(0)
+
+        relative_error = ((actual - expected).abs() / expected).max()
+        self.assertLess(relative_error, 1e-9)
+
+    def test_invalid_fraction(self):
+        with self.assertRaises(RuntimeError):
+            process_epi_data.sample_frame(self._make_frame(10), 0)
+
+
+def make_frame(num_rows, seed=0):
+    """Make a loaded frame with few distinct wages across two groups."""
+    import pandas
+
+    rng = random.Random(seed)
+    wages = [12.0, 15.5, 15.5, 20.0, 31.25]
+
+    return pandas.DataFrame({
+        'educ': ['College'] * num_rows,
+        'docc03': ['Management occupations'] * num_rows,
+        'wbhaom': ['White'] * num_rows,
+        'female': list(map(lambda x: rng.choice(['Male', 'Female']), range(num_rows))),
+        'region': ['West'] * num_rows,
+        'citistat': ['native, born in US'] * num_rows,
+        'age': ['25-35 yr'] * num_rows,
+        'hoursuint': ['At Least 35 Hours'] * num_rows,
+        'lfstat': list(map(lambda x: rng.choice(['Employed', 'Unemployed']), range(num_rows))),
+        'wageotc': list(map(lambda x: rng.choice(wages), range(num_rows))),
+        'orgwgt': list(map(lambda x: rng.uniform(500, 5000), range(num_rows)))
+    })
+
+
+class DedupeTests(unittest.TestCase):
+
+    def test_agg_collapses_wages(self):
+        frame = make_frame(200)
+        original = process_epi_data.agg_data(frame)
+        deduped = process_epi_data.agg_data(frame, dedupe=True)
+
+        self.assertEqual(original.keys(), deduped.keys())
+
+        for key, record in original.items():
+            deduped_record = deduped[key]
+            wages = sorted(record['wageotc'])
+            deduped_wages = deduped_record['wageotc']
+
+            distinct = set(map(lambda x: x[0], wages))
+            self.assertEqual(len(deduped_wages), len(distinct))
+            self.assertLess(len(deduped_wages), len(wages))
+
+            self.assertAlmostEqual(
+                sum(map(lambda x: x[1], deduped_wages)),
+                sum(map(lambda x: x[1], wages))
+            )
+            self.assertEqual(deduped_record['wageCount'], record['wageCount'])
+            self.assertEqual(
+                process_epi_data.get_weighted_median(deduped_wages),
+                process_epi_data.get_weighted_median(wages)
+            )
+
+    def test_weights_summed(self):
+        wages = [(15.5, 2), (12.0, 1), (15.5, 3), (20.0, 4)]
+        self.assertEqual(
+            process_epi_data.dedupe_wages(wages),
+            [(12.0, 1), (15.5, 5), (20.0, 4)]
+        )
+
+    def test_rounded(self):
+        wages = [(12.04, 1), (12.01, 2), (12.06, 3)]
+        self.assertEqual(
+            process_epi_data.dedupe_wages(wages, decimals=1),
+            [(12.0, 3), (12.1, 3)]
+        )
+
+
+class PruneTests(unittest.TestCase):
+
+    def _make_agg(self, num_groups, seed=0):
+        rng = random.Random(seed)
+        groups = []
+
+        for index in range(num_groups):
+            weight = rng.choice([10, 100, 1000, 20000])
+            group = make_group(
+                rng.choice(SOURCE_LABELS['docc03'][:2]),
+                rng.choice(SOURCE_LABELS['educ']),
+                [(rng.uniform(10, 60), weight)],
+                unemployed=weight if rng.random() < 0.1 else 0
+            )
+            group['female'] = rng.choice(SOURCE_LABELS['female'])
+            group['region'] = rng.choice(SOURCE_LABELS['region'])
+            group['citistat'] = rng.choice(SOURCE_LABELS['citistat'])
+            group['hoursuint'] = rng.choice(SOURCE_LABELS['hoursuint'])
+            group['age'] = rng.choice(['25-35 yr', '35-45 yr', '45-55 yr'])
+            groups.append(group)
+
+        return make_agg(groups)
+
+    def _get_totals(self, agg):
+        records = agg.values()
+        return (
+            sum(map(lambda x: x['unempCount'], records)),
+            sum(map(lambda x: x['wageCount'], records)),
+            sum(map(lambda x: sum(x['unemp']), records)),
+            sum(map(lambda x: len(x['wageotc']), records))
+        )
+
+    def test_weight_preserved(self):
+        agg = self._make_agg(400)
+        expected = self._get_totals(agg)
+
+        for min_share in [0.001, 0.01, 0.2, 1]:
+            pruned = process_epi_data.prune_agg(agg, min_share)
+            for actual_total, expected_total in zip(self._get_totals(pruned), expected):
+                self.assertAlmostEqual(actual_total, expected_total)
+
+    def test_small_groups_merged(self):
+        agg = self._make_agg(400)
+        pruned = process_epi_data.prune_agg(agg, 0.01)
+
+        self.assertLess(len(pruned), len(agg))
+
+        total_weight = self._get_totals(agg)[0]
+        small = filter(lambda x: x['unempCount'] < 0.01 * total_weight, pruned.values())
+        for record in small:
+            self.assertEqual(record['educ'], 'All education levels')
+            self.assertEqual(record['region'], 'All regions')
+
+    def test_female_kept(self):
+        pruned = process_epi_data.prune_agg(self._make_agg(400), 1)
+
+        females = set(map(lambda x: x['female'], pruned.values()))
+        self.assertEqual(females, {'Male', 'Female'})
+
+        occupations = set(map(lambda x: x['docc03'], pruned.values()))
+        self.assertEqual(occupations, set(SOURCE_LABELS['docc03'][:2]))
+
+    def test_female_rollup_refused(self):
+        with self.assertRaises(RuntimeError):
+            process_epi_data.prune_agg(self._make_agg(10), 0.01, ['female'])
+
+
+class CommandTests(unittest.TestCase):
+
+    def test_run_uses_config(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source_loc = os.path.join(directory, 'source.dta')
+            write_source(source_loc, 500)
+
+            config_loc = os.path.join(directory, 'config.json')
+            with open(config_loc, 'w') as f:
+                json.dump({'filters': [{'column': 'educ', 'exclude': ['College']}]}, f)
+
+            output_loc = os.path.join(directory, 'data.csv')
+            args = [source_loc, '2023', '1', '2023', '12', output_loc, 'none', 'none', config_loc]
+            self.assertEqual(process_epi_data.get_num_args_range('run'), (6, 9))
+            process_epi_data.execute_command('run', args)
+
+            with open(output_loc) as f:
+                rows = list(csv.DictReader(f))
+
+            educs = set(map(lambda x: x['educ'], rows))
+            self.assertNotIn('College', educs)
+            self.assertIn('Advanced', educs)
+
+            occupations = set(map(lambda x: x['docc03'], rows))
+            self.assertIn('Armed Forces', occupations)
+
+    def _run_main(self, args):
+        output = io.StringIO()
+        argv = ['process_epi_data.py'] + args
+        with unittest.mock.patch('sys.argv', argv):
+            with contextlib.redirect_stdout(output), contextlib.redirect_stderr(io.StringIO()):
+                process_epi_data.main()
+        return output.getvalue()
+
+    def test_non_numeric_args(self):
+        with unittest.mock.patch.object(process_epi_data, 'execute_command') as execute:
+            bad_args = [
+                ['aggregate', 'in.pickle', 'out.pickle', 'bogus'],
+                ['prune', 'in.pickle', 'out.pickle', 'small'],
+                ['run', 'source.dta', '2023', 'March', '2023', '9', 'out.csv'],
+                ['download', '2023', 'latest', 'out']
+            ]
+            for args in bad_args:
+                self.assertEqual(self._run_main(args), process_epi_data.USAGE_STR + '\n')
+
+            execute.assert_not_called()
+
+            self._run_main(['aggregate', 'in.pickle', 'out.pickle', '2'])
+            self._run_main(['aggregate', 'in.pickle', 'out.pickle', 'exact'])
+            self._run_main(['prune', 'in.pickle', 'out.pickle', '0.001'])
+            self.assertEqual(execute.call_count, 3)
+
+    def test_compact_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source_loc = os.path.join(directory, 'source.dta')
+            write_source(source_loc, 2000, seed=1)
+
+            output_loc = os.path.join(directory, 'data.csv')
+            compact_loc = os.path.join(directory, 'data.json')
+            args = [source_loc, '2023', '1', '2023', '12', output_loc, 'none', compact_loc]
+            process_epi_data.execute_command('run', args)
+
+            from_csv = data_model.load_from_file(output_loc)
+            from_compact = data_model.load_from_compact(compact_loc)
+
+            with open(output_loc) as f:
+                num_groups = len(list(csv.DictReader(f)))
+
+        # Weights are rounded to a tenth so each group may move by 0.05.
+        weight_tolerance = 0.05 * num_groups
+
+        for educ in [None] + SOURCE_LABELS['educ']:
+            query = data_model.Query()
+            if educ is not None:
+                query.set_educ(educ)
+
+            if from_csv.get_size(query) == 0:
+                continue
+
+            self.assertAlmostEqual(
+                from_compact.get_wageotc(query),
+                from_csv.get_wageotc(query),
+                delta=0.005
+            )
+            self.assertAlmostEqual(
+                from_compact.get_size(query),
+                from_csv.get_size(query),
+                delta=weight_tolerance
+            )
+            self.assertAlmostEqual(
+                from_compact.get_unemp(query),
+                from_csv.get_unemp(query),
+                delta=0.01
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
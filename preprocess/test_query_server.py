@@ -0,0 +1,123 @@
+"""Tests for the asyncio HTTP query server.
+
+Author: A Samuel Pottinger
+License: MIT License
+"""
+import asyncio
+import json
+import unittest
+
+import data_model
+import query_server
+
+
+def make_row(educ, female, wages, unemp=5.0):
+    return {
+        'educ': educ,
+        'docc03': 'Management occupations',
+        'wageotc': wages,
+        'unemp': unemp,
+        'wageCount': sum(map(lambda x: x[1], wages)),
+        'unempCount': sum(map(lambda x: x[1], wages)),
+        'wbhaom': 'White',
+        'female': female,
+        'region': 'West',
+        'age': '25-35 yr',
+        'hoursuint': 'At Least 35 Hours',
+        'citistat': 'native, born in US'
+    }
+
+
+def make_dataset():
+    return data_model.load_from_rows([
+        make_row('College', 'Female', [(20.0, 1.0), (30.0, 2.0)]),
+        make_row('College', 'Male', [(25.0, 1.0), (35.0, 1.0)]),
+        make_row('High school', 'Female', [(15.0, 3.0)])
+    ])
+
+
+class BrokenDataset:
+    """Dataset whose queries fail with an unexpected error."""
+
+    async def aquery(self, query, method_name='get_wageotc'):
+        raise TypeError('Unexpected failure.')
+
+
+class QueryServerTests(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self._server = None
+
+    async def asyncTearDown(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _start(self, dataset):
+        handler = query_server.QueryServer(dataset).handle_connection
+        self._server = await asyncio.start_server(handler, '127.0.0.1', 0)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def _request(self, port, request_bytes):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(request_bytes)
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+
+        head, _, body = response.partition(b'\r\n\r\n')
+        status = int(head.split(b' ')[1])
+        return (status, json.loads(body) if body else None)
+
+    async def _get(self, port, target):
+        request = 'GET %s HTTP/1.1\r\nConnection: close\r\n\r\n' % target
+        return await self._request(port, request.encode('latin-1'))
+
+    async def test_query(self):
+        port = await self._start(make_dataset())
+        status, body = await self._get(port, '/query?educ=College&female=Female')
+        self.assertEqual(status, 200)
+        self.assertEqual(body['wageotc'], 30.0)
+        self.assertEqual(body['size'], 3.0)
+
+    async def test_unknown_female_value(self):
+        port = await self._start(make_dataset())
+        status, body = await self._get(port, '/query?female=Femal')
+        self.assertEqual(status, 400)
+        self.assertIn('female', body['error'])
+
+    async def test_unknown_value(self):
+        port = await self._start(make_dataset())
+        status, _ = await self._get(port, '/query?educ=Doctorate')
+        self.assertEqual(status, 400)
+
+    async def test_unexpected_error(self):
+        port = await self._start(BrokenDataset())
+        status, body = await self._get(port, '/query?educ=College')
+        self.assertEqual(status, 500)
+        self.assertEqual(body['error'], 'Internal server error.')
+
+    async def test_malformed_request_line(self):
+        port = await self._start(make_dataset())
+        status, _ = await self._request(port, b'GET\r\n\r\n')
+        self.assertEqual(status, 400)
+
+    async def test_long_request_line(self):
+        port = await self._start(make_dataset())
+        target = '/query?educ=' + 'x' * 100000
+        status, _ = await self._get(port, target)
+        self.assertEqual(status, 400)
+
+    async def test_unknown_routes_share_bucket(self):
+        port = await self._start(make_dataset())
+        for target in ['/a', '/b', '/query?educ=College']:
+            await self._get(port, target)
+
+        status, body = await self._get(port, '/metrics')
+        self.assertEqual(status, 200)
+        self.assertEqual(set(body.keys()), {'/query', query_server.OTHER_ROUTE})
+        self.assertEqual(body[query_server.OTHER_ROUTE]['count'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+"""Tests for the sharded dataset facade.
+
+Author: A Samuel Pottinger
+License: MIT License
+"""
+import csv
+import os
+import random
+import tempfile
+import unittest
+import unittest.mock
+
+import data_model
+import sharded_dataset
+
+from test_data_model import EDUC_VALUES
+from test_data_model import OCCUPATIONS
+from test_data_model import make_rows
+from test_data_model import write_csv
+
+
+class ShardedDatasetTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls._directory = tempfile.TemporaryDirectory()
+        cls._loc = os.path.join(cls._directory.name, 'data.csv')
+        write_csv(cls._loc, make_rows(300, seed=5))
+        cls._dataset = data_model.load_from_file(cls._loc)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._directory.cleanup()
+
+    def _make_queries(self):
+        rng = random.Random(6)
+        queries = [data_model.Query()]
+
+        for trial in range(20):
+            query = data_model.Query()
+            if rng.random() < 0.5:
+                query.set_educ(rng.choice(EDUC_VALUES))
+            if rng.random() < 0.5:
+                query.set_docc03(rng.choice(OCCUPATIONS))
+            if rng.random() < 0.5:
+                query.set_female(rng.choice([True, False]))
+            queries.append(query)
+
+        return queries
+
+    def _check_partition(self, partition):
+        with sharded_dataset.load_sharded_from_file(self._loc, 2, partition) as sharded:
+            self.assertEqual(sharded.get_max_wage(), self._dataset.get_max_wage())
+            self.assertEqual(
+                sharded.get_max_unemployment(),
+                self._dataset.get_max_unemployment()
+            )
+            self.assertEqual(sharded.get_docc03_vals(), self._dataset.get_docc03_vals())
+            self.assertEqual(sharded.get_female_vals(), self._dataset.get_female_vals())
+
+            for query in self._make_queries():
+                self.assertEqual(sharded.get_wageotc(query), self._dataset.get_wageotc(query))
+                self.assertAlmostEqual(sharded.get_unemp(query), self._dataset.get_unemp(query))
+                self.assertAlmostEqual(sharded.get_size(query), self._dataset.get_size(query))
+
+    def test_docc03_partition(self):
+        self._check_partition('docc03')
+
+    def test_hash_partition(self):
+        self._check_partition('hash')
+
+    def test_occupation_routed_to_one_shard(self):
+        with sharded_dataset.load_sharded_from_file(self._loc, 2) as sharded:
+            query = data_model.Query()
+            query.set_docc03(OCCUPATIONS[0])
+            self.assertEqual(len(sharded.get_shards_for_query(query)), 1)
+
+    def test_empty_shard(self):
+        with sharded_dataset.load_sharded_from_file(self._loc, 5) as sharded:
+            self.assertEqual(sharded.get_max_wage(), self._dataset.get_max_wage())
+            self.assertEqual(
+                sharded.get_wageotc(data_model.Query()),
+                self._dataset.get_wageotc(data_model.Query())
+            )
+
+    def test_row_shard_matches_record(self):
+        with open(self._loc) as f:
+            rows = list(csv.DictReader(f))
+
+        counts = sharded_dataset.count_occupations(self._loc)
+        shard_by_occupation = sharded_dataset.assign_occupations(counts, 3)
+
+        for row in rows:
+            record = data_model.parse_record(row)
+            for partition in [None, shard_by_occupation]:
+                self.assertEqual(
+                    sharded_dataset.get_row_shard(row, 3, partition),
+                    sharded_dataset.get_shard(record, 3, partition)
+                )
+
+    def test_worker_parses_own_rows(self):
+        records = list(data_model.read_records(self._loc))
+        in_shard = list(filter(
+            lambda x: sharded_dataset.get_shard(x, 3, None) == 1,
+            records
+        ))
+
+        parse_record = unittest.mock.Mock(wraps=data_model.parse_record)
+        with unittest.mock.patch.object(data_model, 'parse_record', parse_record):
+            sharded_dataset._set_shard_dataset(self._loc, 1, 3, None)
+
+        self.assertEqual(parse_record.call_count, len(in_shard))
+
+        expected_size = sum(map(lambda x: x.get_wage_count(), in_shard))
+        self.assertAlmostEqual(
+            sharded_dataset._shard_dataset.get_size(data_model.Query()),
+            expected_size
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+"""Tests for the precomputed website views.
+
+Author: A Samuel Pottinger
+License: MIT License
+"""
+import csv
+import os
+import random
+import tempfile
+import unittest
+
+import data_model
+import process_epi_data
+import views
+
+from test_process_epi_data import SOURCE_LABELS
+from test_process_epi_data import make_agg
+from test_process_epi_data import make_group
+
+OCCUPATIONS = SOURCE_LABELS['docc03'][:2]
+EDUC_VALUES = ['High school', 'College', 'Advanced']
+
+
+def make_groups(num_groups, seed=0):
+    rng = random.Random(seed)
+    groups = []
+
+    for index in range(num_groups):
+        num_wages = rng.randint(1, 6)
+        wages = list(map(
+            lambda x: (round(rng.uniform(10, 60), 2), rng.uniform(100, 5000)),
+            range(num_wages)
+        ))
+        group = make_group(
+            rng.choice(OCCUPATIONS),
+            rng.choice(EDUC_VALUES),
+            wages,
+            unemployed=rng.uniform(0, 500)
+        )
+        group['female'] = rng.choice(SOURCE_LABELS['female'])
+        group['region'] = rng.choice(['West', 'South'])
+        groups.append(group)
+
+    return groups
+
+
+class ViewsTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls._directory = tempfile.TemporaryDirectory()
+        loc = os.path.join(cls._directory.name, 'data.csv')
+
+        summarized = process_epi_data.summarize_agg(make_agg(make_groups(120)))
+        process_epi_data.make_output_frame(summarized).to_csv(loc)
+
+        with open(loc) as f:
+            cls._views = views.compute_views(list(csv.DictReader(f)))
+
+        cls._dataset = data_model.load_from_file(loc)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._directory.cleanup()
+
+    def _get_view(self, view_type, grouping, removed=views.NO_REMOVAL):
+        return self._views['views'][view_type][grouping]['0'][removed]
+
+    def _make_query(self, occupation, educs=None):
+        query = data_model.Query()
+        if occupation != views.ALL_OCCUPATIONS_LABEL:
+            query.set_docc03(occupation)
+        if educs is not None:
+            query.set_educ(set(educs))
+        return query
+
+    def _check_view(self, view, method_name, educs=None):
+        self.assertEqual(view['names'], ['Female', 'Male'])
+        self.assertEqual(view['records'][0][0], views.ALL_OCCUPATIONS_LABEL)
+        self.assertEqual(len(view['records']), len(OCCUPATIONS) + 1)
+
+        for name, value, gini, gaps in view['records']:
+            query = self._make_query(name, educs)
+            expected = getattr(self._dataset, method_name)(query)
+            self.assertAlmostEqual(value, expected, places=3)
+
+            for female, (gap, population) in zip([True, False], gaps):
+                query.set_female(female)
+                expected_group = getattr(self._dataset, method_name)(query)
+                if method_name == 'get_wageotc':
+                    expected_gap = (expected_group - expected) / expected * 100
+                else:
+                    expected_gap = expected_group - expected
+
+                self.assertAlmostEqual(gap, expected_gap, places=3)
+
+    def test_income_median(self):
+        view = self._get_view('income.median', 'female')
+        self._check_view(view, 'get_wageotc')
+
+    def test_unemployment_mean(self):
+        view = self._get_view('unemployment.mean', 'female')
+        self._check_view(view, 'get_unemp')
+
+    def test_removed_group(self):
+        view = self._get_view('income.median', 'female', removed='College')
+        self._check_view(view, 'get_wageotc', educs=['High school', 'Advanced'])
+
+
+if __name__ == '__main__':
+    unittest.main()
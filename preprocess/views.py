@@ -0,0 +1,380 @@
+"""Precompute the website's occupation rollups for common view states.
+
+Mirrors Dataset.query in website/data.js: rows with a removed group are
+dropped, groups smaller than the minimum size are dropped, and the remaining
+rows are rolled up by occupation (plus All occupations) and by the grouping
+dimension before summarizing with the mean or median. Views are computed for
+every variable and summary type, grouping dimension, minimum group size used by
+the site, and either no removed group or a single removed group. The site can
+render these without parsing the full CSV, falling back to it for other
+combinations of removed groups.
+
+License: MIT
+Author: A Samuel Pottinger
+"""
+from __future__ import annotations
+
+import gzip
+import json
+import typing
+
+ATTRS = ['female', 'wbhaom', 'educ', 'region', 'citistat', 'age', 'hoursuint']
+VARIABLES = {
+    'income': {'variable': 'wageotc', 'count': 'wageCount'},
+    'unemployment': {'variable': 'unemp', 'count': 'unempCount'}
+}
+VIEW_TYPES = ['income.median', 'income.mean', 'unemployment.mean']
+MIN_GROUP_SIZES = [0.00025, 0]
+ALL_OCCUPATIONS_LABEL = 'All occupations'
+NO_REMOVAL = ''
+VIEW_DECIMALS = 4
+
+
+class ParsedRow:
+    """A row of output parsed once for a variable as the website would."""
+
+    def __init__(self, row: typing.Dict, variable_name: str):
+        """Parse a summarized group.
+
+        Args:
+            row: The group as returned by process_epi_data.summarize_agg.
+            variable_name: The name of the variable like income.
+        """
+        variable_attrs = VARIABLES[variable_name]
+        self._attrs = dict(map(
+            lambda x: (x, str(row[x])),
+            ATTRS + ['docc03']
+        ))
+        self._attr_values = set(map(lambda x: self._attrs[x], ATTRS))
+        self._count = float(row[variable_attrs['count']])
+
+        if variable_attrs['variable'] == 'wageotc':
+            self._values = parse_wage_tuples(row['wageotc'])
+            self._value_total = sum(map(lambda x: x[0] * x[1], self._values))
+        else:
+            unemp = float(row['unemp'])
+            self._values = [(unemp, self._count)]
+            self._value_total = unemp * float(row['unempCount'])
+
+    def get_attr(self, name: str) -> str:
+        return self._attrs[name]
+
+    def has_attr_value(self, value: str) -> bool:
+        return value in self._attr_values
+
+    def get_count(self) -> float:
+        return self._count
+
+    def get_values(self) -> typing.List[typing.Tuple[float, float]]:
+        return self._values
+
+    def get_value_total(self) -> float:
+        return self._value_total
+
+
+class Rollup:
+    """Running totals for an occupation or grouping within an occupation."""
+
+    def __init__(self):
+        """Create an empty rollup."""
+        self._value_total = 0
+        self._count_total = 0
+        self._values: typing.List[typing.Tuple[float, float]] = []
+
+    def add(self, row: ParsedRow):
+        """Add a row to the totals.
+
+        Args:
+            row: The row to add.
+        """
+        self._value_total += row.get_value_total()
+        self._count_total += row.get_count()
+        self._values.extend(row.get_values())
+
+    def merge(self, other: Rollup):
+        """Add the totals of another rollup to this one.
+
+        Args:
+            other: The rollup whose rows should be included.
+        """
+        self._value_total += other.get_value_total()
+        self._count_total += other.get_count_total()
+        self._values.extend(other.get_values())
+
+    def get_value_total(self) -> float:
+        return self._value_total
+
+    def get_count_total(self) -> float:
+        return self._count_total
+
+    def get_values(self) -> typing.List[typing.Tuple[float, float]]:
+        return self._values
+
+    def summarize(self, summary_type: str) -> float:
+        """Get the central value as the website's summarize strategies would.
+
+        Args:
+            summary_type: Either mean or median.
+        Returns:
+            The weighted mean or weighted median or zero if empty.
+        """
+        if summary_type == 'mean':
+            if self._count_total > 0:
+                return self._value_total / self._count_total
+            else:
+                return 0
+
+        if len(self._values) == 0:
+            return 0
+
+        values = sorted(self._values, key=lambda x: x[0])
+        midpoint_count = self._count_total / 2
+        last = len(values) - 1
+        accumulator = 0
+        i = 0
+        while i < last and accumulator + values[i][1] < midpoint_count:
+            accumulator += values[i][1]
+            i += 1
+
+        return values[i][0]
+
+
+def parse_wage_tuples(wages_str: str) -> typing.List[typing.Tuple[float, float]]:
+    """Parse the wageotc column into (wage, weight) tuples.
+
+    Args:
+        wages_str: The semicolon separated wage and weight pairs.
+    Returns:
+        List of (wage, weight) tuples in the order given.
+    """
+    pieces = map(lambda x: x.split(' '), wages_str.split(';'))
+    return list(map(lambda x: (float(x[0]), float(x[1])), pieces))
+
+
+def sort_names(names: typing.Iterable[str]) -> typing.List[str]:
+    """Order grouping names as the website does.
+
+    Args:
+        names: The names of the groups like Male and Female.
+    Returns:
+        Sorted names with <25 yr first and Some college third.
+    """
+    sorted_names = sorted(set(names))
+
+    if '<25 yr' in sorted_names:
+        sorted_names.remove('<25 yr')
+        sorted_names.insert(0, '<25 yr')
+
+    if 'Some college' in sorted_names:
+        sorted_names.remove('Some college')
+        sorted_names.insert(2, 'Some college')
+
+    return sorted_names
+
+
+def get_gini(groupings: typing.Dict[str, Rollup]) -> typing.Optional[float]:
+    """Get the gini index across the groupings of an occupation.
+
+    Args:
+        groupings: Mapping from group name to rollup.
+    Returns:
+        Gini index as a percentage or None if undefined.
+    """
+    items = list(groupings.values())
+    total_income = sum(map(lambda x: x.get_value_total(), items))
+    total_population = sum(map(lambda x: x.get_count_total(), items))
+
+    if total_income == 0 or total_population == 0:
+        return None
+
+    def get_mean(rollup: Rollup) -> float:
+        count = rollup.get_count_total()
+        return rollup.get_value_total() / count if count > 0 else 0
+
+    items.sort(key=get_mean)
+
+    percent_remaining = 1
+    sum_scores = 0
+    for item in items:
+        pop_percent = item.get_count_total() / total_population
+        percent_remaining -= pop_percent
+        income = item.get_value_total() / total_income
+        sum_scores += income * (pop_percent + 2 * percent_remaining)
+
+    return (1 - sum_scores) * 100
+
+
+def build_cells(rows: typing.List[ParsedRow], grouping: str
+    ) -> typing.Dict[typing.Tuple[str, str], Rollup]:
+    """Roll up rows by occupation and grouping value.
+
+    Args:
+        rows: The rows remaining after removing groups.
+        grouping: The grouping dimension like female.
+    Returns:
+        Mapping from occupation and grouping value to rollup in order of first
+        appearance.
+    """
+    cells: typing.Dict[typing.Tuple[str, str], Rollup] = {}
+
+    for row in rows:
+        key = (row.get_attr('docc03'), row.get_attr(grouping))
+        if key not in cells:
+            cells[key] = Rollup()
+        cells[key].add(row)
+
+    return cells
+
+
+def summarize_cells(cells: typing.Dict[typing.Tuple[str, str], Rollup], view_type: str,
+    min_group_size: float) -> typing.Dict:
+    """Compute the records the website shows for one view state.
+
+    Args:
+        cells: The rollups by occupation and grouping value from build_cells.
+        view_type: The variable and summary type like income.median.
+        min_group_size: The minimum size of an occupation and group as a share
+            (0 - 1) of the total.
+    Returns:
+        Dictionary with names (grouping values in display order) and records
+        (name, value, gini, and list of gap value and population for each
+        name) in display order.
+    """
+    variable_name, summary_type = view_type.split('.')
+
+    overall_total = sum(map(lambda x: x.get_count_total(), cells.values()))
+    min_count = min_group_size * overall_total
+
+    occupations: typing.Dict[str, typing.Tuple[Rollup, typing.Dict]] = {}
+    total: typing.Tuple[Rollup, typing.Dict] = (Rollup(), {})
+
+    for (occupation, group), cell in cells.items():
+        if cell.get_count_total() < min_count:
+            continue
+
+        if occupation not in occupations:
+            occupations[occupation] = (Rollup(), {})
+
+        occupation_rollup, occupation_groupings = occupations[occupation]
+        occupation_rollup.merge(cell)
+        occupation_groupings[group] = cell
+
+        total_rollup, total_groupings = total
+        total_rollup.merge(cell)
+        if group not in total_groupings:
+            total_groupings[group] = Rollup()
+        total_groupings[group].merge(cell)
+
+    occupations[ALL_OCCUPATIONS_LABEL] = total
+
+    names = sort_names(
+        name for _, groupings in occupations.values() for name in groupings
+    )
+
+    def round_value(value: typing.Optional[float]) -> typing.Optional[float]:
+        return None if value is None else round(value, VIEW_DECIMALS)
+
+    def summarize_occupation(item: typing.Tuple) -> typing.List:
+        name, (rollup, groupings) = item
+        value = rollup.summarize(summary_type)
+
+        def get_gap(group: str) -> typing.List:
+            if group not in groupings:
+                return [None, 0]
+
+            group_rollup = groupings[group]
+            diff = group_rollup.summarize(summary_type) - value
+            if variable_name == 'income':
+                gap = diff / value * 100 if value != 0 else None
+            else:
+                gap = diff
+
+            return [round_value(gap), round_value(group_rollup.get_count_total())]
+
+        gini = get_gini(groupings) if len(groupings) > 0 else None
+        return [
+            name,
+            round_value(value),
+            round_value(gini),
+            list(map(get_gap, names))
+        ]
+
+    records = list(map(summarize_occupation, occupations.items()))
+    records.sort(key=lambda x: (x[0] != ALL_OCCUPATIONS_LABEL, x[1]))
+
+    return {'names': names, 'records': records}
+
+
+def compute_views(rows: typing.List[typing.Dict]) -> typing.Dict:
+    """Compute every precomputed view.
+
+    Rows are filtered once per removed group and rolled up once per grouping
+    with the resulting cells shared by each summary type and minimum group
+    size.
+
+    Args:
+        rows: The groups as returned by process_epi_data.summarize_agg.
+    Returns:
+        JSON-serializable dictionary with the view types, grouping dimensions,
+        minimum group sizes, and views nested by view type, grouping, minimum
+        group size (as a string), and removed group (empty for none).
+    """
+    removable = sorted(set(
+        str(row[attr]) for row in rows for attr in ATTRS
+    ))
+
+    views: typing.Dict = {}
+    for view_type in VIEW_TYPES:
+        views[view_type] = dict(map(
+            lambda x: (x, dict(map(lambda y: (str(y), {}), MIN_GROUP_SIZES))),
+            ATTRS
+        ))
+
+    for variable_name in VARIABLES.keys():
+        parsed = list(map(lambda x: ParsedRow(x, variable_name), rows))
+        view_types = list(filter(
+            lambda x: x.split('.')[0] == variable_name,
+            VIEW_TYPES
+        ))
+
+        for removed in [NO_REMOVAL] + removable:
+            kept = list(filter(lambda x: not x.has_attr_value(removed), parsed))
+            if len(kept) == 0:
+                continue
+
+            for grouping in ATTRS:
+                cells = build_cells(kept, grouping)
+
+                for view_type in view_types:
+                    for min_group_size in MIN_GROUP_SIZES:
+                        view = summarize_cells(cells, view_type, min_group_size)
+                        target = views[view_type][grouping][str(min_group_size)]
+                        target[removed] = view
+
+    return {
+        'viewTypes': VIEW_TYPES,
+        'groupings': ATTRS,
+        'minGroupSizes': MIN_GROUP_SIZES,
+        'views': views
+    }
+
+
+def write_views(rows: typing.List[typing.Dict], loc: str) -> typing.List[str]:
+    """Write precomputed views as JSON along with a gzip sibling.
+
+    Args:
+        rows: The groups as returned by process_epi_data.summarize_agg.
+        loc: The location at which to write the uncompressed JSON.
+    Returns:
+        List of paths written.
+    """
+    payload = json.dumps(compute_views(rows), separators=(',', ':'))
+    payload_bytes = payload.encode('utf-8')
+
+    with open(loc, 'wb') as f:
+        f.write(payload_bytes)
+
+    with open(loc + '.gz', 'wb') as f:
+        f.write(gzip.compress(payload_bytes, compresslevel=9))
+
+    return [loc, loc + '.gz']
@@ -429,17 +429,19 @@ class Dataset {
         const midpointCount = countTotal / 2;
         rawRecord["values"].sort((a, b) => a["value"] - b["value"]);
 
-        let accumulator = 0;
-        let i = 0;
-
         const values = rawRecord["values"];
-        const getCurrentCount = () => {
-          return accumulator + values[i]["weight"];
-        };
+        if (values.length == 0) {
+          return 0;
+        }
 
-        while (getCurrentCount() < midpointCount) {
+        // Smallest value at which the cumulative weight reaches the midpoint
+        // as in Rollup.summarize within preprocess/views.py.
+        const last = values.length - 1;
+        let accumulator = 0;
+        let i = 0;
+        while (i < last && accumulator + values[i]["weight"] < midpointCount) {
+          accumulator += values[i]["weight"];
           i++;
-          accumulator = getCurrentCount();
         }
 
         return values[i]["value"];
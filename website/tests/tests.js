@@ -104,6 +104,37 @@ QUnit.module("incomeGaps", function() {
     });
   });
 
+  QUnit.test("dataset median", function(assert) {
+    const done = assert.async();
+    testDataset(done, assert, (dataset) => {
+      const median = dataset._getSummarizeStrategy("median");
+      const getMedian = (values) => {
+        const countTotal = values
+          .map((x) => x["weight"])
+          .reduce((a, b) => a + b, 0);
+        return median({"values": values, "countTotal": countTotal});
+      };
+
+      assert.equal(getMedian([
+        {"value": 30, "weight": 1},
+        {"value": 10, "weight": 4},
+        {"value": 20, "weight": 1}
+      ]), 10);
+      assert.equal(getMedian([
+        {"value": 10, "weight": 1},
+        {"value": 20, "weight": 1},
+        {"value": 30, "weight": 2}
+      ]), 20);
+      assert.equal(getMedian([
+        {"value": 10, "weight": 3},
+        {"value": 20, "weight": 1},
+        {"value": 30, "weight": 1},
+        {"value": 40, "weight": 5}
+      ]), 30);
+      assert.equal(getMedian([]), 0);
+    });
+  });
+
   function testPresenter(done, assert, callback) {
     loadSourceData(DATA_LOCATION).then((dataset) => {
       const presenter = new VizPresenter(60, -0.5, 0.5, 1);